@@ -60,12 +60,53 @@ CREATE TABLE IF NOT EXISTS "Veiculo" (
     FOREIGN KEY ("cliente_id") REFERENCES "Cliente" ("id") ON DELETE CASCADE
 );
 
+-- Particionada por mês ("Localizacao_AAAA_MM", criadas pelo app); o que não
+-- couber em nenhuma partição mensal vai para "Localizacao_padrao"
 CREATE TABLE IF NOT EXISTS "Localizacao" (
-    "id" BIGSERIAL PRIMARY KEY,
+    "id" BIGSERIAL,
     "placa" varchar(10) NOT NULL,
     "latitude" numeric(10,7) NOT NULL,
     "longitude" numeric(10,7) NOT NULL,
     "timestamp" timestamp with time zone NOT NULL,
+    "geohash" varchar(12),
+    PRIMARY KEY ("id", "timestamp"),
+    FOREIGN KEY ("placa") REFERENCES "Veiculo" ("placa") ON DELETE CASCADE
+) PARTITION BY RANGE ("timestamp");
+
+CREATE TABLE IF NOT EXISTS "Localizacao_padrao" PARTITION OF "Localizacao" DEFAULT;
+
+CREATE INDEX IF NOT EXISTS "ix_Localizacao_geohash_timestamp" ON "Localizacao" ("geohash", "timestamp");
+CREATE INDEX IF NOT EXISTS "ix_Localizacao_placa_timestamp" ON "Localizacao" ("placa", "timestamp", "id");
+CREATE INDEX IF NOT EXISTS "ix_Localizacao_timestamp" ON "Localizacao" ("timestamp", "id");
+
+-- Agregados de 1 min (resolucao = 60) e 15 min (900) por veículo, mantidos pelo app
+CREATE TABLE IF NOT EXISTS "LocalizacaoAgregada" (
+    "id" BIGSERIAL PRIMARY KEY,
+    "resolucao" integer NOT NULL,
+    "placa" varchar(10) NOT NULL,
+    "inicio" timestamp with time zone NOT NULL,
+    "pontos" integer NOT NULL,
+    "primeiro_ts" timestamp with time zone NOT NULL,
+    "primeiro_lat" numeric(10,7) NOT NULL,
+    "primeiro_lng" numeric(10,7) NOT NULL,
+    "ultimo_ts" timestamp with time zone NOT NULL,
+    "ultimo_lat" numeric(10,7) NOT NULL,
+    "ultimo_lng" numeric(10,7) NOT NULL,
+    "media_lat" numeric(10,7) NOT NULL,
+    "media_lng" numeric(10,7) NOT NULL,
+    "distancia_m" double precision NOT NULL DEFAULT 0,
+    "velocidade_max_kmh" double precision NOT NULL DEFAULT 0,
+    CONSTRAINT "uq_LocalizacaoAgregada_resolucao_placa_inicio" UNIQUE ("resolucao", "placa", "inicio"),
+    FOREIGN KEY ("placa") REFERENCES "Veiculo" ("placa") ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS "ix_LocalizacaoAgregada_resolucao_inicio" ON "LocalizacaoAgregada" ("resolucao", "inicio", "id");
+
+-- Janelas de 15 min com posições novas, à espera do recálculo dos agregados
+CREATE TABLE IF NOT EXISTS "LocalizacaoAgregadaPendente" (
+    "placa" varchar(10) NOT NULL,
+    "janela" timestamp with time zone NOT NULL,
+    PRIMARY KEY ("placa", "janela"),
     FOREIGN KEY ("placa") REFERENCES "Veiculo" ("placa") ON DELETE CASCADE
 );
 
@@ -78,3 +119,54 @@ CREATE TABLE IF NOT EXISTS "Evento" (
     "lido" boolean NOT NULL,
     FOREIGN KEY ("veiculo_id") REFERENCES "Veiculo" ("id") ON DELETE CASCADE
 );
+
+CREATE TABLE IF NOT EXISTS "VeiculoEstado" (
+    "veiculo_id" BIGINT PRIMARY KEY,
+    "localizacao_id" BIGINT,
+    "latitude" numeric(10,7),
+    "longitude" numeric(10,7),
+    "timestamp" timestamp with time zone,
+    "status_ignicao" boolean,
+    "ultimo_evento_tipo" varchar(50),
+    "ultimo_evento_ts" timestamp with time zone,
+    "ultima_atualizacao" timestamp with time zone,
+    "versao" BIGINT NOT NULL DEFAULT 0,
+    FOREIGN KEY ("veiculo_id") REFERENCES "Veiculo" ("id") ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_versao" ON "VeiculoEstado" ("versao");
+CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_posicao" ON "VeiculoEstado" USING gist (point(longitude::float8, latitude::float8));
+CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_sem_conexao" ON "VeiculoEstado" ("ultima_atualizacao")
+    WHERE ultimo_evento_tipo IS NULL OR ultimo_evento_tipo <> 'CONEXAO';
+
+CREATE TABLE IF NOT EXISTS "VeiculoRemovido" (
+    "id" BIGSERIAL PRIMARY KEY,
+    "veiculo_id" BIGINT NOT NULL,
+    "cliente_id" BIGINT,
+    "placa" varchar(10),
+    "removido_em" timestamp with time zone NOT NULL,
+    "versao" BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS "ix_VeiculoRemovido_cliente_id" ON "VeiculoRemovido" ("cliente_id");
+CREATE INDEX IF NOT EXISTS "ix_VeiculoRemovido_removido_em" ON "VeiculoRemovido" ("removido_em");
+CREATE INDEX IF NOT EXISTS "ix_VeiculoRemovido_versao" ON "VeiculoRemovido" ("versao");
+
+CREATE TABLE IF NOT EXISTS "Geofence" (
+    "id" BIGSERIAL PRIMARY KEY,
+    "cliente_id" BIGINT,
+    "administrador_id" BIGINT,
+    "nome" varchar(100) NOT NULL,
+    "tipo" varchar(20) NOT NULL,
+    "latitude" numeric(10,7),
+    "longitude" numeric(10,7),
+    "raio_m" double precision,
+    "pontos" json,
+    "ativo" boolean NOT NULL,
+    "criado_em" timestamp with time zone NOT NULL,
+    FOREIGN KEY ("cliente_id") REFERENCES "Cliente" ("id") ON DELETE CASCADE,
+    FOREIGN KEY ("administrador_id") REFERENCES "Administrador" ("id") ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS "ix_Geofence_cliente_id" ON "Geofence" ("cliente_id");
+CREATE INDEX IF NOT EXISTS "ix_Geofence_administrador_id" ON "Geofence" ("administrador_id");
@@ -15,7 +15,14 @@ from routes.evento_routes import evento_bp
 from routes.usuario_routes import usuario_bp
 from routes.payments_routes import payments_bp
 from routes.admin_payment_routes import admin_bp
+from routes.geofence_routes import geofence_bp
 from middlewares import check_payment_status
+from utils.fila_ingestao import iniciar_ingestao_assincrona
+from utils.presenca import presenca
+from utils.conexao_perdida import varredura_conexao
+from utils.particoes import manutencao_particoes
+from utils.agregados import atualizacao_agregados
+from utils.tempo_real import iniciar_tempo_real
 
 load_dotenv()
 
@@ -36,6 +43,23 @@ app.register_blueprint(evento_bp)
 app.register_blueprint(usuario_bp)
 app.register_blueprint(payments_bp)
 app.register_blueprint(admin_bp)
+app.register_blueprint(geofence_bp)
+
+
+def iniciar_servicos(app):
+    """
+    Threads de fundo (heartbeats, varredura de conexão, partições, agregados,
+    tempo real e ingestão assíncrona). Só os pontos de entrada de longa duração
+    chamam: wsgi.py, `python app.py` e tracker_server.py. Scripts que importam o
+    app não iniciam nada e gravam os heartbeats direto.
+    """
+    presenca.iniciar(app)
+    varredura_conexao.iniciar(app)
+    manutencao_particoes.iniciar(app)
+    atualizacao_agregados.iniciar(app)
+    iniciar_tempo_real(app)
+    if app.config["INGESTAO_ASSINCRONA"]:
+        iniciar_ingestao_assincrona(app)
 
 
 def get_firebase_config():
@@ -208,5 +232,9 @@ if __name__ == "__main__":
     with app.app_context():
         db.create_all()
 
+    # Com o reloader do modo debug, só o processo filho (WERKZEUG_RUN_MAIN) roda as threads de fundo
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        iniciar_servicos(app)
+
     PORT = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=PORT, debug=True, use_reloader=True)
@@ -27,6 +27,36 @@ class Config:
 
     ASSETS_ROOT = '/static/assets'
 
+    # Ingestão de localizações
+    LOTE_MAX_LOCALIZACOES = int(os.getenv("LOTE_MAX_LOCALIZACOES", "500"))
+
+    # Ingestão assíncrona: handlers respondem 202 e um writer grava em micro-lotes
+    INGESTAO_ASSINCRONA = os.getenv("INGESTAO_ASSINCRONA", "False").lower() == "true"
+    FILA_INGESTAO_ARQUIVO = os.getenv("FILA_INGESTAO_ARQUIVO", "fila_ingestao.db")
+    FILA_INGESTAO_LOTE = int(os.getenv("FILA_INGESTAO_LOTE", "200"))
+    FILA_INGESTAO_INTERVALO = float(os.getenv("FILA_INGESTAO_INTERVALO", "1.0"))
+    # Janela (s) em que o writer assíncrono segura os fixes de cada veículo para reordenar/deduplicar
+    JANELA_REORDENACAO_S = float(os.getenv("JANELA_REORDENACAO_S", "5"))
+    REORDENACAO_MAX_POR_VEICULO = int(os.getenv("REORDENACAO_MAX_POR_VEICULO", "100"))
+
+    # Heartbeats (Veiculo.ultima_atualizacao) ficam em memória e são gravados em lote
+    # a cada N segundos; manter bem abaixo dos 9 s usados no status Online/Offline
+    PRESENCA_FLUSH_INTERVALO = float(os.getenv("PRESENCA_FLUSH_INTERVALO", "3"))
+
+    # Varredura em background que registra o evento CONEXAO de veículos sem
+    # atualização há CONEXAO_PERDIDA_TIMEOUT segundos
+    CONEXAO_PERDIDA_TIMEOUT = int(os.getenv("CONEXAO_PERDIDA_TIMEOUT", "600"))
+    VARREDURA_CONEXAO_INTERVALO = float(os.getenv("VARREDURA_CONEXAO_INTERVALO", "60"))
+
+    # Partições mensais de "Localizacao" (PostgreSQL): meses criados com antecedência
+    # e retenção em meses (partições mais antigas são apagadas inteiras; 0 = manter tudo)
+    PARTICOES_FUTURAS_MESES = int(os.getenv("PARTICOES_FUTURAS_MESES", "3"))
+    RETENCAO_LOCALIZACAO_MESES = int(os.getenv("RETENCAO_LOCALIZACAO_MESES", "0"))
+    MANUTENCAO_PARTICOES_INTERVALO = float(os.getenv("MANUTENCAO_PARTICOES_INTERVALO", "3600"))
+
+    # Agregados de 1 e 15 min das posições: intervalo (s) do recálculo das janelas pendentes
+    AGREGACAO_INTERVALO = float(os.getenv("AGREGACAO_INTERVALO", "30"))
+
     # Configuração do Flask-Mail
     MAIL_SERVER = os.getenv("MAIL_SERVER")
     MAIL_PORT = int(os.getenv("MAIL_PORT"))
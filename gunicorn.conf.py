@@ -0,0 +1,17 @@
+"""
+Configuração do gunicorn (lida automaticamente da raiz): workers gevent para os
+streams SSE e psycopg2 cooperativo, senão cada consulta bloqueia o worker inteiro.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = "gevent"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+timeout = 60
+
+
+def post_fork(server, worker):
+    # Antes do wsgi.py abrir qualquer conexão com o banco neste worker
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
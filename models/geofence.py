@@ -0,0 +1,44 @@
+from datetime import datetime
+import pytz
+from database import db
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+class Geofence(db.Model):
+    """
+    Cerca virtual (círculo ou polígono) de um cliente ou de um administrador.
+    Cercas de administrador valem para os veículos de todos os seus clientes.
+    """
+    __tablename__ = "Geofence"
+
+    id = db.Column(db.BigInteger, primary_key=True, unique=True)
+    cliente_id = db.Column(db.BigInteger, db.ForeignKey("Cliente.id", ondelete="CASCADE"), nullable=True, index=True)
+    administrador_id = db.Column(db.BigInteger, db.ForeignKey("Administrador.id", ondelete="CASCADE"), nullable=True, index=True)
+    nome = db.Column(db.String(100), nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # "circulo", "poligono"
+    # Círculo: centro e raio em metros
+    latitude = db.Column(db.Numeric(10, 7), nullable=True)
+    longitude = db.Column(db.Numeric(10, 7), nullable=True)
+    raio_m = db.Column(db.Float, nullable=True)
+    # Polígono: [[lat, lng], ...]
+    pontos = db.Column(db.JSON, nullable=True)
+    ativo = db.Column(db.Boolean, nullable=False, default=True)
+    criado_em = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(br_tz))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "cliente_id": self.cliente_id,
+            "administrador_id": self.administrador_id,
+            "nome": self.nome,
+            "tipo": self.tipo,
+            "latitude": float(self.latitude) if self.latitude is not None else None,
+            "longitude": float(self.longitude) if self.longitude is not None else None,
+            "raio_m": self.raio_m,
+            "pontos": self.pontos,
+            "ativo": self.ativo,
+            "criado_em": self.criado_em.isoformat() if self.criado_em else None
+        }
+
+    def __repr__(self):
+        return f"<Geofence {self.nome} ({self.tipo})>"
@@ -1,18 +1,41 @@
 from datetime import datetime
 from database import db
-from sqlalchemy.sql import func
+from sqlalchemy import PrimaryKeyConstraint, event
+from sqlalchemy.ext.compiler import compiles
+from utils.geo import geohash
 import pytz
 
 br_tz = pytz.timezone("America/Sao_Paulo")
 
+
+def _geohash_da_linha(context):
+    # Inserts que não informam o geohash (ORM, rotas antigas) calculam aqui
+    linha = context.get_current_parameters()
+    return geohash(linha["latitude"], linha["longitude"])
+
+
 class Localizacao(db.Model):
+    """
+    Histórico de posições. No PostgreSQL a tabela é particionada por mês
+    (utils/particoes.py), por isso lá a chave primária inclui o timestamp (veja
+    _pk_particionada). Para o ORM e os outros bancos a chave é só o id.
+    """
     __tablename__ = "Localizacao"
+    __table_args__ = (
+        # Busca por área e período (GET /localizacao/area): prefixo do geohash + intervalo de tempo
+        db.Index("ix_Localizacao_geohash_timestamp", "geohash", "timestamp"),
+        # Históricos paginados por (timestamp, id): por placa e da frota inteira
+        db.Index("ix_Localizacao_placa_timestamp", "placa", "timestamp", "id"),
+        db.Index("ix_Localizacao_timestamp", "timestamp", "id"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
-    id = db.Column(db.BigInteger, primary_key=True, unique=True)
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
     placa = db.Column(db.String(10), db.ForeignKey("Veiculo.placa"), nullable=False)
     latitude = db.Column(db.Numeric(10, 7), nullable=False)
     longitude = db.Column(db.Numeric(10, 7), nullable=False)
-    timestamp = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(br_tz))
+    timestamp = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(br_tz))
+    geohash = db.Column(db.String(12), nullable=True, default=_geohash_da_linha)
 
     def to_dict(self):
         ts = self.timestamp.astimezone(br_tz) if self.timestamp.tzinfo else pytz.utc.localize(self.timestamp).astimezone(br_tz)
@@ -26,3 +49,20 @@ class Localizacao(db.Model):
 
     def __repr__(self):
         return f"<Localizacao {self.placa} ({self.latitude}, {self.longitude})>"
+
+
+@compiles(PrimaryKeyConstraint, "postgresql")
+def _pk_particionada(constraint, compiler, **kw):
+    # Tabela particionada exige a chave de partição na PK; o SQLite não aceita
+    # autoincremento em PK composta, então a PK (id, timestamp) é só do PostgreSQL
+    if constraint.table is Localizacao.__table__:
+        return 'PRIMARY KEY (id, "timestamp")'
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
+@event.listens_for(Localizacao.__table__, "after_create")
+def _criar_particoes(target, connection, **kw):
+    # Tabela nova (create_all): partição padrão e os próximos meses já prontos
+    if connection.dialect.name == "postgresql":
+        from utils.particoes import garantir_particoes
+        garantir_particoes(connection)
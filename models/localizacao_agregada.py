@@ -0,0 +1,46 @@
+from database import db
+
+
+class LocalizacaoAgregada(db.Model):
+    """
+    Resumo das posições de um veículo em um intervalo de `resolucao` segundos
+    (1 ou 15 min) começando em `inicio` (UTC). Mantido por utils/agregados.py a
+    partir de "Localizacao"; os históricos de períodos longos leem daqui.
+
+    `distancia_m` e `velocidade_max_kmh` consideram só os trechos entre posições
+    do próprio intervalo: o trecho até o intervalo seguinte é calculado na
+    consulta (último ponto deste -> primeiro do próximo).
+    """
+    __tablename__ = "LocalizacaoAgregada"
+    __table_args__ = (
+        db.UniqueConstraint("resolucao", "placa", "inicio", name="uq_LocalizacaoAgregada_resolucao_placa_inicio"),
+        # Históricos da frota por período (ordem (inicio, id), como os brutos)
+        db.Index("ix_LocalizacaoAgregada_resolucao_inicio", "resolucao", "inicio", "id"),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    resolucao = db.Column(db.Integer, nullable=False)
+    placa = db.Column(db.String(10), db.ForeignKey("Veiculo.placa", ondelete="CASCADE"), nullable=False)
+    inicio = db.Column(db.DateTime(timezone=True), nullable=False)
+    pontos = db.Column(db.Integer, nullable=False)
+    primeiro_ts = db.Column(db.DateTime(timezone=True), nullable=False)
+    primeiro_lat = db.Column(db.Numeric(10, 7), nullable=False)
+    primeiro_lng = db.Column(db.Numeric(10, 7), nullable=False)
+    ultimo_ts = db.Column(db.DateTime(timezone=True), nullable=False)
+    ultimo_lat = db.Column(db.Numeric(10, 7), nullable=False)
+    ultimo_lng = db.Column(db.Numeric(10, 7), nullable=False)
+    media_lat = db.Column(db.Numeric(10, 7), nullable=False)
+    media_lng = db.Column(db.Numeric(10, 7), nullable=False)
+    distancia_m = db.Column(db.Float, nullable=False, default=0.0)
+    velocidade_max_kmh = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f"<LocalizacaoAgregada {self.placa} {self.resolucao}s {self.inicio}>"
+
+
+class LocalizacaoAgregadaPendente(db.Model):
+    """Janelas de 15 min de um veículo com posições novas ou apagadas, à espera do recálculo."""
+    __tablename__ = "LocalizacaoAgregadaPendente"
+
+    placa = db.Column(db.String(10), db.ForeignKey("Veiculo.placa", ondelete="CASCADE"), primary_key=True)
+    janela = db.Column(db.DateTime(timezone=True), primary_key=True)
@@ -14,6 +14,7 @@ class Veiculo(db.Model):
     marca = db.Column(db.String(50), nullable=False)
     ano = db.Column(db.SmallInteger, nullable=False)
     status_ignicao = db.Column(db.Boolean, nullable=False, default=False)
+    # Sem índice: é regravada a cada lote de heartbeats (a varredura usa "VeiculoEstado")
     ultima_atualizacao = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(br_tz))
     ativo = db.Column(db.Boolean, nullable=False, default=True)
     criado_em = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(br_tz))
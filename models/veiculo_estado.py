@@ -0,0 +1,60 @@
+from sqlalchemy import DDL, event
+from database import db
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Predicado do índice parcial; a consulta da varredura repete a mesma condição
+SEM_CONEXAO = "ultimo_evento_tipo IS NULL OR ultimo_evento_tipo <> 'CONEXAO'"
+
+class VeiculoEstado(db.Model):
+    """
+    Estado "ao vivo" de cada veículo (uma linha por veículo), atualizado na mesma
+    transação de cada localização. Os endpoints de última posição leem daqui em
+    vez de varrer o histórico de "Localizacao".
+    """
+    __tablename__ = "VeiculoEstado"
+    __table_args__ = (
+        # Varredura de perda de conexão: só veículos ainda não marcados com CONEXAO
+        db.Index(
+            "ix_VeiculoEstado_sem_conexao", "ultima_atualizacao",
+            postgresql_where=db.text(SEM_CONEXAO), sqlite_where=db.text(SEM_CONEXAO)
+        ),
+    )
+
+    veiculo_id = db.Column(db.BigInteger, db.ForeignKey("Veiculo.id", ondelete="CASCADE"), primary_key=True)
+    localizacao_id = db.Column(db.BigInteger, nullable=True)
+    latitude = db.Column(db.Numeric(10, 7), nullable=True)
+    longitude = db.Column(db.Numeric(10, 7), nullable=True)
+    timestamp = db.Column(db.DateTime(timezone=True), nullable=True)
+    status_ignicao = db.Column(db.Boolean, nullable=True)
+    ultimo_evento_tipo = db.Column(db.String(50), nullable=True)
+    ultimo_evento_ts = db.Column(db.DateTime(timezone=True), nullable=True)
+    ultima_atualizacao = db.Column(db.DateTime(timezone=True), nullable=True)
+    # Transação que mudou a linha por último (cursor da sincronização incremental)
+    versao = db.Column(db.BigInteger, nullable=False, server_default="0", index=True)
+
+    veiculo = db.relationship("Veiculo", backref=db.backref("estado", uselist=False, passive_deletes=True))
+
+    def to_dict(self, placa):
+        # Mesmo formato de Localizacao.to_dict
+        ts = self.timestamp.astimezone(br_tz) if self.timestamp.tzinfo else pytz.utc.localize(self.timestamp).astimezone(br_tz)
+        return {
+            "id": self.localizacao_id,
+            "placa": placa,
+            "latitude": float(self.latitude),
+            "longitude": float(self.longitude),
+            "timestamp": ts.isoformat()
+        }
+
+    def __repr__(self):
+        return f"<VeiculoEstado {self.veiculo_id} ({self.latitude}, {self.longitude})>"
+
+
+# Índice espacial da última posição (GET /localizacao?bbox=...). Usa os tipos
+# geométricos nativos do PostgreSQL (GiST sobre point(lng, lat)), sem PostGIS
+INDICE_POSICAO = DDL(
+    'CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_posicao" ON "VeiculoEstado" '
+    'USING gist (point(longitude::float8, latitude::float8))'
+)
+event.listen(VeiculoEstado.__table__, "after_create", INDICE_POSICAO.execute_if(dialect="postgresql"))
@@ -0,0 +1,21 @@
+from database import db
+
+
+class VeiculoRemovido(db.Model):
+    """
+    Tombstone de um veículo que saiu da frota de um cliente (excluído ou
+    transferido). A sincronização incremental de GET /localizacao?since=...
+    usa esta tabela para avisar os mapas que o marcador deve ser removido.
+    """
+    __tablename__ = "VeiculoRemovido"
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    veiculo_id = db.Column(db.BigInteger, nullable=False)
+    cliente_id = db.Column(db.BigInteger, nullable=True, index=True)
+    placa = db.Column(db.String(10), nullable=True)
+    removido_em = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    # Transação que registrou a remoção (mesmo cursor de "VeiculoEstado".versao)
+    versao = db.Column(db.BigInteger, nullable=False, server_default="0", index=True)
+
+    def __repr__(self):
+        return f"<VeiculoRemovido {self.veiculo_id} ({self.placa})>"
@@ -10,6 +10,7 @@ import os
 import middlewares
 from flask_mail import Message
 from mail_service import mail
+from utils.presenca import presenca
 
 cliente_bp = Blueprint("cliente_bp", __name__)
 br_tz = pytz.timezone("America/Sao_Paulo")
@@ -307,7 +308,7 @@ def listar_veiculos_por_cliente(id):
             "ano": v.ano,
             "status_ignicao": v.status_ignicao,
             "ativo": v.ativo,
-            "ultima_atualizacao": v.ultima_atualizacao,
+            "ultima_atualizacao": presenca.ultima_atualizacao(v),
         }
         for v in veiculos
     ])
@@ -1,8 +1,13 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, current_app
 from database import db
 from models.evento import Evento
 from models.veiculo import Veiculo
 from models.cliente import Cliente
+from utils.estado_veiculo import reconstruir_estado_vivo
+from utils.frota import clientes_do_usuario
+from utils.notificacoes import notificacoes, contar_nao_lidos, notificar_nao_lidos, evento_to_dict, ultimos_eventos
+from utils import tempo_real
+from middlewares import check_subscription_status, _get_email_from_auth_header
 from datetime import datetime
 import pytz
 
@@ -115,8 +120,114 @@ def listar_eventos_cliente(cliente_id):
 def limpar_eventos_cliente(cliente_id):
     try:
         Evento.query.filter_by(cliente_id=cliente_id).delete()
+        notificar_nao_lidos([cliente_id])
+        # O último evento dos veículos deste cliente mudou
+        reconstruir_estado_vivo([v.id for v in Veiculo.query.filter_by(cliente_id=cliente_id).all()])
         db.session.commit()
         return jsonify({"message": "Notificações removidas para o cliente", "cliente_id": cliente_id}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 400
+
+
+# Quantos eventos recentes vão no snapshot inicial do feed (o que a navbar mostra)
+SNAPSHOT_NOTIFICACOES = 10
+# Limite de eventos reenviados ao reconectar com Last-Event-ID
+REENVIO_MAX_NOTIFICACOES = 100
+HEARTBEAT_STREAM_SEGUNDOS = 15
+
+
+# Feed (SSE) de notificações do usuário logado: eventos novos e total de não lidos.
+# O `id` de cada mensagem é o id do Evento; ao reconectar, o navegador manda o
+# Last-Event-ID e recebe o que perdeu.
+@evento_bp.route("/eventos/stream", methods=["GET"])
+@check_subscription_status
+def stream_notificacoes():
+    clientes = clientes_do_usuario(_get_email_from_auth_header())
+    if clientes is None:
+        return jsonify({"error": "Usuário não identificado"}), 403
+
+    ultimo_id = request.headers.get("Last-Event-ID") or request.args.get("ultimo_id")
+    try:
+        ultimo_id = int(ultimo_id) if ultimo_id else None
+    except ValueError:
+        ultimo_id = None
+
+    # Assina antes de consultar: nada confirmado entre a consulta e o stream se perde
+    # (um evento pode chegar repetido; o front ignora ids já vistos)
+    assinatura = notificacoes.assinar(lambda m: m["c"] in clientes)
+    totais, contados = {}, {}
+
+    def recontar(cliente_ids):
+        # Eventos até `contados[c]` já estão no total: a mensagem deles não soma de novo
+        contados.update(ultimos_eventos(cliente_ids))
+        totais.update(contar_nao_lidos(cliente_ids))
+
+    try:
+        recontar(clientes)
+        consulta = Evento.query.filter(Evento.cliente_id.in_(clientes)) if clientes else None
+        if consulta is None:
+            perdidos, recentes = [], []
+        elif ultimo_id is None:
+            perdidos = []
+            recentes = [evento_to_dict(e) for e in consulta.order_by(
+                Evento.timestamp.desc()).limit(SNAPSHOT_NOTIFICACOES).all()]
+        else:
+            perdidos = [evento_to_dict(e) for e in consulta.filter(Evento.id > ultimo_id).order_by(
+                Evento.id.asc()).limit(REENVIO_MAX_NOTIFICACOES).all()]
+            recentes = None
+    except Exception:
+        notificacoes.cancelar(assinatura)
+        raise
+
+    # O stream pode ficar aberto por horas: não segura conexão do pool
+    db.session.remove()
+    app = current_app._get_current_object()
+
+    def gerar():
+        try:
+            yield "retry: 5000\n\n"
+            if recentes is not None:
+                maior_id = max((e["id"] for e in recentes), default=None)
+                yield tempo_real.formatar_sse(
+                    {"eventos": recentes, "nao_lidos": sum(totais.values())},
+                    evento="snapshot", id_=maior_id
+                )
+            else:
+                for e in perdidos:
+                    yield tempo_real.formatar_sse(e, evento="evento", id_=e["id"])
+                yield tempo_real.formatar_sse({"total": sum(totais.values())}, evento="nao_lidos")
+
+            while True:
+                mensagens = assinatura.aguardar(HEARTBEAT_STREAM_SEGUNDOS)
+                if not mensagens:
+                    yield ": ping\n\n"
+                    continue
+                mudou_total = False
+                alterados = set()
+                for m in mensagens:
+                    if m["tipo"] == "evento":
+                        evento = m["evento"]
+                        yield tempo_real.formatar_sse(evento, evento="evento", id_=evento["id"])
+                        if not evento["lido"] and evento["id"] > contados.get(m["c"], 0):
+                            totais[m["c"]] = totais.get(m["c"], 0) + 1
+                            mudou_total = True
+                    else:
+                        alterados.add(m["c"])
+                if alterados:
+                    # Uma contagem por lote de avisos, só dos clientes que mudaram
+                    with app.app_context():
+                        try:
+                            recontar(alterados)
+                        finally:
+                            db.session.remove()
+                    mudou_total = True
+                if mudou_total:
+                    yield tempo_real.formatar_sse({"total": sum(totais.values())}, evento="nao_lidos")
+        finally:
+            notificacoes.cancelar(assinatura)
+
+    return Response(gerar(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
@@ -0,0 +1,161 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy import or_
+from database import db
+from middlewares import _get_email_from_auth_header, check_subscription_status
+from models.administrador import Administrador
+from models.cliente import Cliente
+from models.geofence import Geofence
+
+geofence_bp = Blueprint("geofence_bp", __name__)
+
+
+def _usuario_logado():
+    """(administrador, cliente) do usuário logado; um dos dois é None."""
+    email = _get_email_from_auth_header()
+    if not email:
+        return None, None
+    admin = Administrador.query.filter_by(email=email).first()
+    if admin:
+        return admin, None
+    return None, Cliente.query.filter_by(email=email).first()
+
+
+def _pode_alterar(cerca, admin, cliente):
+    if admin:
+        if cerca.administrador_id == admin.id:
+            return True
+        dono = Cliente.query.get(cerca.cliente_id) if cerca.cliente_id else None
+        return dono is not None and dono.administrador_id == admin.id
+    return cliente is not None and cerca.cliente_id == cliente.id
+
+
+def _aplicar_geometria(cerca, data):
+    """Valida e copia a geometria do JSON para a cerca; retorna a mensagem de erro ou None."""
+    tipo = data.get("tipo", cerca.tipo)
+    if tipo == "circulo":
+        try:
+            latitude = float(data.get("latitude", cerca.latitude))
+            longitude = float(data.get("longitude", cerca.longitude))
+            raio_m = float(data.get("raio_m", cerca.raio_m))
+        except (TypeError, ValueError):
+            return "Círculo requer latitude, longitude e raio_m numéricos"
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180) or raio_m <= 0:
+            return "Coordenadas ou raio inválidos"
+        cerca.tipo, cerca.latitude, cerca.longitude, cerca.raio_m, cerca.pontos = tipo, latitude, longitude, raio_m, None
+    elif tipo == "poligono":
+        pontos = data.get("pontos", cerca.pontos)
+        try:
+            pontos = [[float(lat), float(lng)] for lat, lng in pontos]
+        except (TypeError, ValueError):
+            return "Polígono requer 'pontos' como lista de [latitude, longitude]"
+        if len(pontos) < 3:
+            return "Polígono requer pelo menos 3 pontos"
+        cerca.tipo, cerca.pontos, cerca.latitude, cerca.longitude, cerca.raio_m = tipo, pontos, None, None, None
+    else:
+        return "Tipo deve ser 'circulo' ou 'poligono'"
+    return None
+
+
+# Listar as cercas visíveis para o usuário logado
+@geofence_bp.route("/geofences", methods=["GET"])
+@check_subscription_status
+def listar_geofences():
+    admin, cliente = _usuario_logado()
+    if admin:
+        clientes = db.session.query(Cliente.id).filter(Cliente.administrador_id == admin.id)
+        filtro = or_(Geofence.administrador_id == admin.id, Geofence.cliente_id.in_(clientes))
+    elif cliente:
+        filtro = or_(Geofence.cliente_id == cliente.id, Geofence.administrador_id == cliente.administrador_id)
+    else:
+        return jsonify({"error": "Usuário não identificado"}), 403
+
+    cercas = Geofence.query.filter(filtro).order_by(Geofence.id).all()
+    return jsonify([c.to_dict() for c in cercas])
+
+
+# Criar uma cerca (círculo ou polígono)
+@geofence_bp.route("/geofences", methods=["POST"])
+@check_subscription_status
+def criar_geofence():
+    data = request.get_json(silent=True) or {}
+    admin, cliente = _usuario_logado()
+    if not admin and not cliente:
+        return jsonify({"error": "Usuário não identificado"}), 403
+    if not data.get("nome"):
+        return jsonify({"error": "Informe o nome da cerca"}), 400
+
+    cerca = Geofence(nome=data["nome"], ativo=bool(data.get("ativo", True)))
+    if admin:
+        # Administrador: cerca própria (vale para todos os clientes) ou de um cliente seu
+        cliente_id = data.get("cliente_id")
+        if cliente_id:
+            dono = Cliente.query.get(cliente_id)
+            if not dono or dono.administrador_id != admin.id:
+                return jsonify({"error": "Cliente inválido ou não pertence a este administrador"}), 403
+            cerca.cliente_id = dono.id
+        else:
+            cerca.administrador_id = admin.id
+    else:
+        cerca.cliente_id = cliente.id
+
+    erro = _aplicar_geometria(cerca, data)
+    if erro:
+        return jsonify({"error": erro}), 400
+
+    try:
+        db.session.add(cerca)
+        db.session.commit()
+        return jsonify(cerca.to_dict()), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+
+# Atualizar nome, geometria ou ativação de uma cerca
+@geofence_bp.route("/geofences/<int:id>", methods=["PUT"])
+@check_subscription_status
+def atualizar_geofence(id):
+    cerca = Geofence.query.get(id)
+    if not cerca:
+        return jsonify({"error": "Cerca não encontrada"}), 404
+    admin, cliente = _usuario_logado()
+    if not _pode_alterar(cerca, admin, cliente):
+        return jsonify({"error": "Acesso não autorizado"}), 403
+
+    data = request.get_json(silent=True) or {}
+    if "nome" in data:
+        cerca.nome = data["nome"]
+    if "ativo" in data:
+        cerca.ativo = bool(data["ativo"])
+    if any(campo in data for campo in ("tipo", "latitude", "longitude", "raio_m", "pontos")):
+        erro = _aplicar_geometria(cerca, data)
+        if erro:
+            db.session.rollback()
+            return jsonify({"error": erro}), 400
+
+    try:
+        db.session.commit()
+        return jsonify(cerca.to_dict()), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+
+# Remover uma cerca
+@geofence_bp.route("/geofences/<int:id>", methods=["DELETE"])
+@check_subscription_status
+def deletar_geofence(id):
+    cerca = Geofence.query.get(id)
+    if not cerca:
+        return jsonify({"error": "Cerca não encontrada"}), 404
+    admin, cliente = _usuario_logado()
+    if not _pode_alterar(cerca, admin, cliente):
+        return jsonify({"error": "Acesso não autorizado"}), 403
+
+    try:
+        db.session.delete(cerca)
+        db.session.commit()
+        return jsonify({"message": f"Cerca {cerca.nome} removida com sucesso!"}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
@@ -3,10 +3,9 @@ from models.localizacao import Localizacao
 from middlewares import check_subscription_status
 from models.veiculo import Veiculo
 from models.cliente import Cliente
-from models.evento import Evento
+from models.veiculo_estado import VeiculoEstado
 from database import db
 from datetime import datetime, timedelta
-from sqlalchemy import func
 import pytz
 
 localizacao_bp = Blueprint("localizacao_bp", __name__)
@@ -19,77 +18,252 @@ br_tz = pytz.timezone("America/Sao_Paulo")
 @localizacao_bp.route("/localizacao", methods=["GET"])
 @check_subscription_status
 def listar_localizacoes():
-    # Subquery para pegar o ID da última localização de cada placa
-    subquery = db.session.query(
-        func.max(Localizacao.id).label('max_id')
-    ).group_by(Localizacao.placa).subquery()
-
-    # Join com a subquery para trazer apenas as últimas
-    localizacoes = db.session.query(Localizacao, Veiculo).join(
-        Veiculo, Localizacao.placa == Veiculo.placa
-    ).join(
-        subquery, Localizacao.id == subquery.c.max_id
-    ).all()
+    # Última posição de cada veículo, mantida em "VeiculoEstado" pela ingestão
+    return _responder_ultimas_localizacoes()
 
+# Listar localizações filtradas por cliente (APENAS A ÚLTIMA DE CADA VEÍCULO)
+@localizacao_bp.route("/localizacao/cliente/<int:cliente_id>", methods=["GET"])
+def listar_localizacoes_cliente(cliente_id):
+    return _responder_ultimas_localizacoes(cliente_id)
+
+
+def _responder_ultimas_localizacoes(cliente_id=None):
+    """
+    Sem `since`: lista completa, no formato de sempre. Com `since` (cursor do
+    header X-Sync-Cursor da resposta anterior): só os veículos que mudaram e os
+    ids dos que saíram da frota. Responde 304 se a versão da frota (ETag) for a
+    mesma do If-None-Match, sem montar a lista.
+
+    `bbox=minLng,minLat,maxLng,maxLat` restringe ao que está visível no mapa
+    (índice espacial em "VeiculoEstado"); no delta, veículos que saíram da área
+    vêm em `removidos`.
+    """
+    agora = datetime.now(br_tz)
+    desde = None
+    if request.args.get("since"):
+        try:
+            desde = sincronizacao.ler_cursor(request.args["since"])
+        except ValueError:
+            return jsonify({"error": "Cursor 'since' inválido"}), 400
+    bbox = None
+    if request.args.get("bbox"):
+        try:
+            bbox = ler_bbox(request.args["bbox"])
+        except ValueError:
+            return jsonify({"error": "bbox inválido: use minLng,minLat,maxLng,maxLat"}), 400
+
+    # Antes de qualquer leitura: o que for confirmado depois entra na próxima resposta
+    marca = sincronizacao.marca_dagua()
+    versao = sincronizacao.versao_frota(marca, cliente_id, agora)
+    if request.if_none_match.contains_weak(versao):
+        resposta = Response(status=304)
+    else:
+        consulta = db.session.query(VeiculoEstado, Veiculo).join(Veiculo, VeiculoEstado.veiculo_id == Veiculo.id)
+        if cliente_id is not None:
+            consulta = consulta.filter(Veiculo.cliente_id == cliente_id)
+        completa = consulta.filter(VeiculoEstado.timestamp.isnot(None))
+        if bbox is not None:
+            completa = completa.filter(dentro_da_area(bbox))
+
+        if desde is None:
+            resposta = jsonify(_ultimas_localizacoes(completa.all()))
+        elif sincronizacao.cursor_expirado(desde, agora):
+            # Tombstones desse período já foram apagados: manda a frota inteira
+            resposta = jsonify({
+                "completo": True,
+                "localizacoes": _ultimas_localizacoes(completa.all()),
+                "removidos": [],
+            })
+        else:
+            alterados = sincronizacao.filtrar_alterados(consulta, desde, agora).all()
+            com_posicao = [
+                (estado, veiculo) for estado, veiculo in alterados
+                if estado.timestamp is not None
+                and (bbox is None or ponto_na_area(bbox, estado.latitude, estado.longitude))
+            ]
+            presentes = {veiculo.id for _, veiculo in com_posicao}
+            removidos = set(sincronizacao.removidos_desde(desde, cliente_id))
+            # Linha sem posição (ex.: histórico apagado) ou fora da área também sai do mapa
+            removidos.update(veiculo.id for _, veiculo in alterados)
+            resposta = jsonify({
+                "completo": False,
+                "localizacoes": _ultimas_localizacoes(com_posicao),
+                "removidos": sorted(removidos - presentes),
+            })
+
+    resposta.set_etag(versao, weak=True)
+    resposta.headers["X-Sync-Cursor"] = sincronizacao.emitir_cursor(marca, agora)
+    resposta.headers["Cache-Control"] = "no-cache"
+    return resposta
+
+
+def _consulta_ultimas_localizacoes():
+    return db.session.query(VeiculoEstado, Veiculo).join(
+        Veiculo, VeiculoEstado.veiculo_id == Veiculo.id
+    ).filter(VeiculoEstado.timestamp.isnot(None))
+
+
+def _ultimas_localizacoes(linhas):
     agora = datetime.now(br_tz)
     resultado = []
-    for loc in localizacoes:
-        ts = loc.Localizacao.timestamp
+    for estado, veiculo in linhas:
+        ts = estado.timestamp
         ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
         delta = agora - ts_br
-        status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
+        status_gps = "Online" if delta.total_seconds() <= ONLINE_TIMEOUT_SECS else "Offline"
         resultado.append({
-            "id": loc.Localizacao.id,
-            "placa": loc.Localizacao.placa,
-            "veiculo_id": loc.Veiculo.id,
-            "modelo": loc.Veiculo.modelo,
-            "marca": loc.Veiculo.marca,
-            "latitude": loc.Localizacao.latitude,
-            "longitude": loc.Localizacao.longitude,
+            "id": estado.localizacao_id,
+            "placa": veiculo.placa,
+            "veiculo_id": veiculo.id,
+            "modelo": veiculo.modelo,
+            "marca": veiculo.marca,
+            "latitude": estado.latitude,
+            "longitude": estado.longitude,
             "timestamp": ts_br.isoformat(),
             "status_gps": status_gps
         })
+    return resultado
 
-    return jsonify(resultado)
+from utils.event_helper import process_vehicle_events
+from utils.ingestao import parse_timestamp, processar_lote, normalizar_fix, fix_duplicado
+from utils.estado_veiculo import obter_estado, reconstruir_estado_vivo
+from utils import fila_ingestao
+from utils.geo import (
+    arrays_trajeto, resumo_trajeto, codificar_polyline, metros_por_pixel, pontos_de_parada,
+    pontos_mais_proximos, simplificar_trajeto
+)
+from models.evento import Evento
+from utils.presenca import presenca, ONLINE_TIMEOUT_SECS
+from utils import agregados, paginacao, sincronizacao
+from models.localizacao_agregada import LocalizacaoAgregada
+from flask import current_app, Response, stream_with_context
+from middlewares import _get_email_from_auth_header, require_admin
+from utils.frota import (
+    clientes_do_usuario, ler_bbox, dentro_da_area, ponto_na_area, mais_proximos, historico_na_area
+)
+from utils.cercas import CercaIndexada
+from sqlalchemy import func
+from utils import tempo_real
+from utils.clusters import piramides
+import pytz
 
-# Listar localizações filtradas por cliente (APENAS A ÚLTIMA DE CADA VEÍCULO)
-@localizacao_bp.route("/localizacao/cliente/<int:cliente_id>", methods=["GET"])
-def listar_localizacoes_cliente(cliente_id):
-    # Subquery para pegar o ID da última localização de cada placa
-    subquery = db.session.query(
-        func.max(Localizacao.id).label('max_id')
-    ).group_by(Localizacao.placa).subquery()
 
-    localizacoes = db.session.query(Localizacao, Veiculo).join(
-        Veiculo, Localizacao.placa == Veiculo.placa
-    ).join(
-        subquery, Localizacao.id == subquery.c.max_id
-    ).filter(Veiculo.cliente_id == cliente_id).all()
+def _enfileirar(fixes):
+    # Modo assíncrono: grava na fila local e deixa o writer persistir no banco
+    fila_ingestao.fila.enfileirar([
+        {**fix, "timestamp": fix["timestamp"].isoformat()} for fix in fixes
+    ])
+
+# Intervalo dos comentários de heartbeat nos streams SSE (mantém proxies e o EventSource vivos)
+HEARTBEAT_STREAM_SEGUNDOS = 15
+
+
+def _posicao_compacta(estado, veiculo):
+    ts = estado.timestamp if estado.timestamp.tzinfo else pytz.utc.localize(estado.timestamp)
+    return {
+        "v": veiculo.id,
+        "c": veiculo.cliente_id,
+        "p": veiculo.placa,
+        "la": float(estado.latitude),
+        "lo": float(estado.longitude),
+        "t": int(ts.timestamp()),
+    }
+
+
+# Stream (SSE) das posições da frota do usuário logado: envia um snapshot
+# e depois só os deltas, assim que cada localização é confirmada no banco
+@localizacao_bp.route("/localizacao/stream", methods=["GET"])
+@check_subscription_status
+def stream_localizacoes():
+    clientes = clientes_do_usuario(_get_email_from_auth_header())
+    if clientes is None:
+        return jsonify({"error": "Usuário não identificado"}), 403
+
+    snapshot = [
+        _posicao_compacta(estado, veiculo)
+        for estado, veiculo in _consulta_ultimas_localizacoes().filter(Veiculo.cliente_id.in_(clientes)).all()
+    ] if clientes else []
+    assinatura = tempo_real.posicoes.assinar(lambda m: m["c"] in clientes)
+    # O stream pode ficar aberto por horas: não segura conexão do pool
+    db.session.remove()
+
+    def gerar():
+        try:
+            yield "retry: 5000\n\n"
+            yield tempo_real.formatar_sse(snapshot, evento="snapshot")
+            while True:
+                mensagens = assinatura.aguardar(HEARTBEAT_STREAM_SEGUNDOS)
+                if not mensagens:
+                    yield ": ping\n\n"
+                    continue
+                # Vários fixes do mesmo veículo no intervalo: só o mais recente
+                ultimos = {}
+                for m in mensagens:
+                    if m["v"] not in ultimos or m["t"] >= ultimos[m["v"]]["t"]:
+                        ultimos[m["v"]] = m
+                yield tempo_real.formatar_sse(list(ultimos.values()), evento="posicao")
+        finally:
+            tempo_real.posicoes.cancelar(assinatura)
+
+    return Response(gerar(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+# Agrupamento das últimas posições da frota do usuário logado para o zoom do mapa:
+# cada cluster traz o centro, o total e quantos estão Online/Offline
+@localizacao_bp.route("/localizacao/clusters", methods=["GET"])
+@check_subscription_status
+def clusters_localizacoes():
+    clientes = clientes_do_usuario(_get_email_from_auth_header())
+    if clientes is None:
+        return jsonify({"error": "Usuário não identificado"}), 403
+
+    zoom = request.args.get("zoom", type=int)
+    if zoom is None or not 0 <= zoom <= 22:
+        return jsonify({"error": "Informe o zoom (0 a 22)"}), 400
+    bbox = None
+    if request.args.get("bbox"):
+        try:
+            bbox = ler_bbox(request.args["bbox"])
+        except ValueError:
+            return jsonify({"error": "bbox inválido: use minLng,minLat,maxLng,maxLat"}), 400
+
+    clusters = piramides.obter(clientes).clusters(zoom, bbox)
+    return jsonify({"zoom": zoom, "total": sum(c["total"] for c in clusters), "clusters": clusters})
+
+# Os k veículos do usuário logado mais perto de um ponto (ex.: endereço de um chamado)
+@localizacao_bp.route("/localizacao/proximos", methods=["GET"])
+@check_subscription_status
+def veiculos_proximos():
+    clientes = clientes_do_usuario(_get_email_from_auth_header())
+    if clientes is None:
+        return jsonify({"error": "Usuário não identificado"}), 403
+
+    latitude = request.args.get("lat", type=float)
+    longitude = request.args.get("lng", type=float)
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({"error": "Informe lat e lng válidos"}), 400
+    k = request.args.get("k", default=10, type=int)
+    if k is None or not 1 <= k <= 100:
+        return jsonify({"error": "k deve estar entre 1 e 100"}), 400
 
     agora = datetime.now(br_tz)
     resultado = []
-    for loc in localizacoes:
-        ts = loc.Localizacao.timestamp
-        ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
-        delta = agora - ts_br
-        status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
+    for estado, veiculo, distancia in mais_proximos(clientes, latitude, longitude, k):
+        ts = estado.timestamp if estado.timestamp.tzinfo else pytz.utc.localize(estado.timestamp)
         resultado.append({
-            "id": loc.Localizacao.id,
-            "placa": loc.Localizacao.placa,
-            "veiculo_id": loc.Veiculo.id,
-            "modelo": loc.Veiculo.modelo,
-            "marca": loc.Veiculo.marca,
-            "latitude": loc.Localizacao.latitude,
-            "longitude": loc.Localizacao.longitude,
-            "timestamp": ts_br.isoformat(),
-            "status_gps": status_gps
+            "veiculo_id": veiculo.id,
+            "placa": veiculo.placa,
+            "modelo": veiculo.modelo,
+            "latitude": estado.latitude,
+            "longitude": estado.longitude,
+            "timestamp": ts.astimezone(br_tz).isoformat(),
+            "distancia_m": round(distancia, 1),
+            "status_gps": presenca.status_gps(veiculo, ts, agora),
         })
-
     return jsonify(resultado)
 
-from utils.event_helper import process_vehicle_events
-import pytz
-
 # Criar uma nova localização para um veículo existente
 @localizacao_bp.route("/localizacao", methods=["POST"])
 def criar_localizacao():
@@ -100,29 +274,32 @@ def criar_localizacao():
     timestamp_str = data.get("timestamp") # Pode vir string ou datetime
     led_color = data.get("led") # "verde", "green", "vermelho", "red"
 
+    if fila_ingestao.ingestao_assincrona_ativa():
+        fix, erro = normalizar_fix(data)
+        if erro:
+            return jsonify({"error": erro}), 400
+        _enfileirar([fix])
+        return jsonify({"message": "Localização enfileirada", "placa": placa}), 202
+
     # Verifica se o veículo existe
     veiculo = Veiculo.query.filter_by(placa=placa).first()
     if not veiculo:
         return jsonify({"error": "Veículo não encontrado para a placa fornecida"}), 404
 
     # Tratamento de timestamp
-    if isinstance(timestamp_str, str):
-        try:
-            timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        except:
-            timestamp = datetime.now(br_tz)
-    else:
-        timestamp = datetime.now(br_tz)
-        
+    timestamp = parse_timestamp(timestamp_str)
+
+    # Reenvio idêntico à última posição (retransmissão do rastreador): não grava de novo
+    if fix_duplicado(obter_estado(veiculo), latitude, longitude, timestamp):
+        db.session.rollback()
+        return jsonify({"message": "Localização duplicada ignorada", "placa": placa}), 200
+
     # Processar Eventos (Movimento/Parada/Ignição) ANTES de salvar a nova localização
     # para comparar com a anterior corretamente
     process_vehicle_events(veiculo, latitude, longitude, timestamp, led_color)
 
-    # Atualiza timestamp do veículo para ficar online
-    veiculo.ultima_atualizacao = datetime.now(br_tz)
-    
-    # Força a marcação do objeto como modificado na sessão
-    db.session.add(veiculo)
+    # Heartbeat do veículo (gravado em lote pelo registro de presença)
+    presenca.registrar(veiculo)
 
     localizacao = Localizacao(
         placa=placa,
@@ -143,115 +320,540 @@ def criar_localizacao():
         db.session.rollback()
         return jsonify({"error": str(e)}), 400
 
+# Criar várias localizações de uma vez (rastreadores reenviando posições em buffer)
+@localizacao_bp.route("/localizacao/batch", methods=["POST"])
+def criar_localizacoes_lote():
+    data = request.get_json(silent=True)
+    itens = data.get("localizacoes") if isinstance(data, dict) else data
+    if not isinstance(itens, list) or not itens:
+        return jsonify({"error": "Envie uma lista de localizações"}), 400
+
+    limite = current_app.config.get("LOTE_MAX_LOCALIZACOES", 500)
+    if len(itens) > limite:
+        return jsonify({"error": f"Lote excede o limite de {limite} localizações"}), 413
+
+    if fila_ingestao.ingestao_assincrona_ativa():
+        resultados = []
+        validos = []
+        for idx, item in enumerate(itens):
+            fix, erro = normalizar_fix(item)
+            if erro:
+                resultados.append({"index": idx, "status": "erro", "error": erro})
+            else:
+                validos.append(fix)
+                resultados.append({"index": idx, "status": "enfileirado", "placa": fix["placa"]})
+        if validos:
+            _enfileirar(validos)
+        return jsonify({
+            "message": "Lote enfileirado",
+            "enfileiradas": len(validos),
+            "rejeitadas": len(itens) - len(validos),
+            "resultados": resultados
+        }), 202 if validos else 400
+
+    try:
+        resultados = processar_lote(itens)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    inseridas = sum(1 for r in resultados if r["status"] == "ok")
+    duplicadas = sum(1 for r in resultados if r["status"] == "duplicado")
+    return jsonify({
+        "message": "Lote processado",
+        "inseridas": inseridas,
+        "duplicadas": duplicadas,
+        "rejeitadas": len(resultados) - inseridas - duplicadas,
+        "resultados": resultados
+    }), 201 if inseridas else (200 if duplicadas else 400)
+
+# Métricas da fila de ingestão assíncrona (profundidade e latência de flush)
+@localizacao_bp.route("/ingestao/metricas", methods=["GET"])
+@require_admin
+def metricas_ingestao():
+    if not fila_ingestao.ingestao_assincrona_ativa():
+        return jsonify({"ingestao_assincrona": False})
+    return jsonify({"ingestao_assincrona": True, **fila_ingestao.writer.metricas()})
+
 @localizacao_bp.route("/localizacao/historico", methods=["GET"])
 @check_subscription_status
 def historico_localizacao():
-    cutoff = datetime.utcnow() - timedelta(hours=24)
-    dados = db.session.query(Localizacao, Veiculo).join(
-        Veiculo, Localizacao.placa == Veiculo.placa
-    ).filter(Localizacao.timestamp >= cutoff).order_by(Localizacao.timestamp.desc()).all()
-    
-    resultado = []
-    for loc, veiculo in dados:
-        d = loc.to_dict()
-        d['veiculo_id'] = veiculo.id
-        resultado.append(d)
-        
-    return jsonify(resultado)
+    return _historico_frota()
 
 @localizacao_bp.route("/localizacao/historico/admin/<int:admin_id>", methods=["GET"])
 def historico_localizacao_admin(admin_id):
-    cutoff = datetime.utcnow() - timedelta(hours=24)
-    dados = db.session.query(Localizacao, Veiculo).join(
-        Veiculo, Localizacao.placa == Veiculo.placa
-    ).join(
-        Cliente, Veiculo.cliente_id == Cliente.id
-    ).filter(
-        Cliente.administrador_id == admin_id,
-        Localizacao.timestamp >= cutoff
-    ).order_by(Localizacao.timestamp.desc()).all()
-    
-    resultado = []
-    for loc, veiculo in dados:
-        d = loc.to_dict()
-        d['veiculo_id'] = veiculo.id
-        resultado.append(d)
-    
-    return jsonify(resultado)
+    return _historico_frota(Cliente.administrador_id == admin_id)
+
+
+def _historico_frota(*filtros_cliente):
+    """Histórico da frota (com veiculo_id) no período e na resolução pedidos; padrão: últimas 24h."""
+    try:
+        dt_inicio, dt_fim = _intervalo_historico()
+    except ValueError:
+        return jsonify({"error": "Formato de data/hora inválido"}), 400
+    try:
+        resolucao = _resolucao_historico(dt_inicio, dt_fim)
+    except ValueError:
+        return jsonify({"error": "resolucao deve ser auto, bruta, 1min ou 15min"}), 400
+
+    modelo = Localizacao if resolucao is None else LocalizacaoAgregada
+    consulta = _consulta_historico(resolucao, dt_inicio, dt_fim, com_veiculo=True).join(
+        Veiculo, modelo.placa == Veiculo.placa
+    )
+    if filtros_cliente:
+        consulta = consulta.join(Cliente, Veiculo.cliente_id == Cliente.id).filter(*filtros_cliente)
+    return _responder_historico(consulta, resolucao)
+
+
+def _colunas_historico(com_veiculo=False):
+    # Só as colunas do to_dict: nada de objetos ORM nos históricos
+    colunas = [Localizacao.id, Localizacao.placa, Localizacao.latitude, Localizacao.longitude, Localizacao.timestamp]
+    if com_veiculo:
+        colunas.append(Veiculo.id.label("veiculo_id"))
+    return colunas
+
+
+def _colunas_agregadas(com_veiculo=False):
+    # Mesmos nomes das colunas brutas (posição média do intervalo, timestamp = início) + o resumo
+    colunas = [
+        LocalizacaoAgregada.id, LocalizacaoAgregada.placa,
+        LocalizacaoAgregada.media_lat.label("latitude"), LocalizacaoAgregada.media_lng.label("longitude"),
+        LocalizacaoAgregada.inicio.label("timestamp"), LocalizacaoAgregada.resolucao, LocalizacaoAgregada.pontos,
+        LocalizacaoAgregada.distancia_m, LocalizacaoAgregada.velocidade_max_kmh,
+        LocalizacaoAgregada.primeiro_ts, LocalizacaoAgregada.primeiro_lat, LocalizacaoAgregada.primeiro_lng,
+        LocalizacaoAgregada.ultimo_ts, LocalizacaoAgregada.ultimo_lat, LocalizacaoAgregada.ultimo_lng,
+    ]
+    if com_veiculo:
+        colunas.append(Veiculo.id.label("veiculo_id"))
+    return colunas
+
+
+def _colunas_ordem(resolucao):
+    """(timestamp, id) que ordenam e paginam o histórico na resolução."""
+    if resolucao is None:
+        return Localizacao.timestamp, Localizacao.id
+    return LocalizacaoAgregada.inicio, LocalizacaoAgregada.id
+
+
+def _consulta_historico(resolucao, dt_inicio, dt_fim, com_veiculo=False):
+    """Posições brutas (resolucao None) ou agregados que cobrem o período, com as colunas do histórico."""
+    if resolucao is None:
+        consulta = db.session.query(*_colunas_historico(com_veiculo)).filter(Localizacao.timestamp >= dt_inicio)
+        if dt_fim is not None:
+            consulta = consulta.filter(Localizacao.timestamp <= dt_fim)
+        return consulta
+
+    consulta = db.session.query(*_colunas_agregadas(com_veiculo)).filter(
+        LocalizacaoAgregada.resolucao == resolucao,
+        LocalizacaoAgregada.inicio > dt_inicio - timedelta(seconds=resolucao),
+    )
+    if dt_fim is not None:
+        consulta = consulta.filter(LocalizacaoAgregada.inicio <= dt_fim)
+    return consulta
+
+
+def _resolucao_historico(dt_inicio, dt_fim):
+    """
+    Resolução pedida em ?resolucao=bruta|1min|15min ou, por padrão (auto),
+    escolhida pelo tamanho do período. None = posições brutas. Lança ValueError.
+    """
+    pedida = request.args.get("resolucao") or "auto"
+    if pedida == "auto":
+        return agregados.escolher_resolucao(dt_inicio, dt_fim or datetime.utcnow())
+    for resolucao, nome in agregados.NOMES_RESOLUCAO.items():
+        if pedida == nome:
+            return resolucao
+    raise ValueError("resolucao inválida")
+
+
+def _iso_br(ts):
+    return (ts if ts.tzinfo else pytz.utc.localize(ts)).astimezone(br_tz).isoformat()
+
+
+def _historico_para_dict(linha):
+    # Mesmo formato de Localizacao.to_dict (+ veiculo_id nos históricos da frota
+    # e o resumo do intervalo quando a linha é um agregado)
+    d = {
+        "id": linha.id,
+        "placa": linha.placa,
+        "latitude": float(linha.latitude),
+        "longitude": float(linha.longitude),
+        "timestamp": _iso_br(linha.timestamp),
+    }
+    if "veiculo_id" in linha._fields:
+        d["veiculo_id"] = linha.veiculo_id
+    if "pontos" in linha._fields:
+        d.update({
+            "resolucao": agregados.NOMES_RESOLUCAO[linha.resolucao],
+            "pontos": linha.pontos,
+            "distancia_m": round(linha.distancia_m, 1),
+            "velocidade_max_kmh": round(linha.velocidade_max_kmh, 1),
+            "primeiro": {
+                "latitude": float(linha.primeiro_lat),
+                "longitude": float(linha.primeiro_lng),
+                "timestamp": _iso_br(linha.primeiro_ts),
+            },
+            "ultimo": {
+                "latitude": float(linha.ultimo_lat),
+                "longitude": float(linha.ultimo_lng),
+                "timestamp": _iso_br(linha.ultimo_ts),
+            },
+        })
+    return d
+
+
+def _responder_historico(consulta, resolucao=None):
+    """
+    Resposta dos históricos, do mais recente para o mais antigo:
+    - ?limite=N[&cursor=...]: uma página; o header X-Proximo-Cursor (ausente na
+      última página) vai no `cursor` da próxima requisição;
+    - ?formato=ndjson: todas as linhas, um objeto por linha, em streaming;
+    - sem nenhum dos dois: o mesmo array JSON de sempre, enviado em streaming.
+    O header X-Resolucao diz se as linhas são posições (bruta) ou agregados (1min/15min).
+    """
+    formato = request.args.get("formato")
+    if formato not in (None, "", "json", "ndjson"):
+        return jsonify({"error": "formato deve ser json ou ndjson"}), 400
+
+    col_ts, col_id = _colunas_ordem(resolucao)
+    if request.args.get("limite") or request.args.get("cursor"):
+        limite = request.args.get("limite", default=1000, type=int)
+        if limite is None or not 1 <= limite <= paginacao.TAMANHO_PAGINA_MAXIMO:
+            return jsonify({"error": f"limite deve estar entre 1 e {paginacao.TAMANHO_PAGINA_MAXIMO}"}), 400
+        cursor = None
+        if request.args.get("cursor"):
+            try:
+                cursor = paginacao.ler_cursor(request.args["cursor"])
+            except ValueError:
+                return jsonify({"error": "Cursor inválido"}), 400
+        linhas, proximo = paginacao.pagina(consulta, col_ts, col_id, limite, cursor)
+        resposta = jsonify([_historico_para_dict(linha) for linha in linhas])
+        resposta.headers["X-Resolucao"] = agregados.NOMES_RESOLUCAO[resolucao]
+        if proximo:
+            resposta.headers["X-Proximo-Cursor"] = proximo
+        return resposta
+
+    consulta = consulta.order_by(col_ts.desc(), col_id.desc())
+    json_provider = current_app.json
+
+    def serializar(linha):
+        return json_provider.dumps(_historico_para_dict(linha))
+
+    if formato == "ndjson":
+        gerador, mimetype = paginacao.gerar_ndjson(consulta, serializar), "application/x-ndjson"
+    else:
+        gerador, mimetype = paginacao.gerar_lista_json(consulta, serializar), "application/json"
+    return Response(stream_with_context(gerador), mimetype=mimetype, headers={
+        "X-Accel-Buffering": "no",
+        "X-Resolucao": agregados.NOMES_RESOLUCAO[resolucao],
+    })
 
 
 # Localização mais recente por placa
 @localizacao_bp.route("/localizacao/<placa>", methods=["GET"])
 @check_subscription_status
 def localizacao_por_placa(placa):
-    localizacao = Localizacao.query.filter_by(placa=placa).order_by(Localizacao.timestamp.desc()).first()
-    if not localizacao:
+    estado = _consulta_ultimas_localizacoes().filter(Veiculo.placa == placa).first()
+    if not estado:
         return jsonify({"error": "Nenhuma localização encontrada para esta placa"}), 404
-    return jsonify(localizacao.to_dict())
+    return jsonify(estado.VeiculoEstado.to_dict(placa))
+
+def _intervalo_historico():
+    """
+    Lê os filtros opcionais ?data=YYYY-MM-DD&inicio=HH:MM&fim=HH:MM ou, para
+    períodos de vários dias, ?data_inicial=YYYY-MM-DD&data_final=YYYY-MM-DD.
+    Retorna (inicio, fim) em UTC; sem data, as últimas 24h (fim = None).
+    Lança ValueError se o formato for inválido.
+    """
+    if request.args.get("data_inicial"):
+        # Dias inteiros no horário de Brasília, data_final inclusive
+        dia_inicial = datetime.strptime(request.args["data_inicial"], "%Y-%m-%d")
+        dia_final = datetime.strptime(request.args.get("data_final") or request.args["data_inicial"], "%Y-%m-%d")
+        if dia_final < dia_inicial:
+            raise ValueError("data_final anterior a data_inicial")
+        dt_inicio = br_tz.localize(dia_inicial).astimezone(pytz.utc).replace(tzinfo=None)
+        dt_fim = br_tz.localize(dia_final.replace(hour=23, minute=59, second=59)).astimezone(pytz.utc).replace(tzinfo=None)
+        return dt_inicio, dt_fim
 
-# Histórico de 24h por placa ou filtro personalizado
-@localizacao_bp.route("/localizacao/<placa>/historico", methods=["GET"])
-@check_subscription_status
-def historico_por_placa(placa):
-    # Parâmetros opcionais para filtro
     data_filtro = request.args.get("data")       # YYYY-MM-DD
     hora_inicio = request.args.get("inicio")     # HH:MM
     hora_fim = request.args.get("fim")           # HH:MM
 
-    query = Localizacao.query.filter(Localizacao.placa == placa)
+    if not data_filtro:
+        # Padrão: últimas 24h
+        return datetime.utcnow() - timedelta(hours=24), None
 
-    if data_filtro:
-        try:
-            # Monta horário inicio/fim baseando-se na data
-            # Assumindo horário de Brasília para o input
-            h_ini = hora_inicio if hora_inicio else "00:00"
-            h_fim = hora_fim if hora_fim else "23:59"
+    # Monta horário inicio/fim baseando-se na data
+    # Assumindo horário de Brasília para o input
+    h_ini = hora_inicio if hora_inicio else "00:00"
+    h_fim = hora_fim if hora_fim else "23:59"
 
-            dt_inicio_str = f"{data_filtro} {h_ini}:00"
-            dt_fim_str = f"{data_filtro} {h_fim}:59"
+    dt_inicio_str = f"{data_filtro} {h_ini}:00"
+    dt_fim_str = f"{data_filtro} {h_fim}:59"
 
-            # Converte string para datetime (naive)
-            dt_inicio_naive = datetime.strptime(dt_inicio_str, "%Y-%m-%d %H:%M:%S")
-            dt_fim_naive = datetime.strptime(dt_fim_str, "%Y-%m-%d %H:%M:%S")
+    # Converte string para datetime (naive)
+    dt_inicio_naive = datetime.strptime(dt_inicio_str, "%Y-%m-%d %H:%M:%S")
+    dt_fim_naive = datetime.strptime(dt_fim_str, "%Y-%m-%d %H:%M:%S")
 
-            # Localiza como BR
-            dt_inicio_br = br_tz.localize(dt_inicio_naive)
-            dt_fim_br = br_tz.localize(dt_fim_naive)
+    # Localiza como BR
+    dt_inicio_br = br_tz.localize(dt_inicio_naive)
+    dt_fim_br = br_tz.localize(dt_fim_naive)
 
-            # Converte para UTC (já que o banco parece usar UTC/utcnow)
-            dt_inicio_utc = dt_inicio_br.astimezone(pytz.utc).replace(tzinfo=None)
-            dt_fim_utc = dt_fim_br.astimezone(pytz.utc).replace(tzinfo=None)
+    # Converte para UTC (já que o banco parece usar UTC/utcnow)
+    dt_inicio_utc = dt_inicio_br.astimezone(pytz.utc).replace(tzinfo=None)
+    dt_fim_utc = dt_fim_br.astimezone(pytz.utc).replace(tzinfo=None)
+    return dt_inicio_utc, dt_fim_utc
 
-            query = query.filter(
-                Localizacao.timestamp >= dt_inicio_utc,
-                Localizacao.timestamp <= dt_fim_utc
-            )
-        except ValueError:
-            return jsonify({"error": "Formato de data/hora inválido"}), 400
-    else:
-        # Padrão: últimas 24h
-        cutoff = datetime.utcnow() - timedelta(hours=24)
-        query = query.filter(Localizacao.timestamp >= cutoff)
 
-    dados = query.order_by(Localizacao.timestamp.desc()).all()
+def _consulta_historico_placa(placa, dt_inicio, dt_fim):
+    query = Localizacao.query.filter(
+        Localizacao.placa == placa,
+        Localizacao.timestamp >= dt_inicio
+    )
+    if dt_fim is not None:
+        query = query.filter(Localizacao.timestamp <= dt_fim)
+    return query
+
+
+# Histórico de 24h por placa ou filtro personalizado
+@localizacao_bp.route("/localizacao/<placa>/historico", methods=["GET"])
+@check_subscription_status
+def historico_por_placa(placa):
+    data_filtro = request.args.get("data") or request.args.get("data_inicial")
+    try:
+        dt_inicio, dt_fim = _intervalo_historico()
+    except ValueError:
+        return jsonify({"error": "Formato de data/hora inválido"}), 400
+    try:
+        resolucao = _resolucao_historico(dt_inicio, dt_fim)
+    except ValueError:
+        return jsonify({"error": "resolucao deve ser auto, bruta, 1min ou 15min"}), 400
+
+    try:
+        tolerancia, zoom = _parametros_simplificacao()
+    except ValueError:
+        return jsonify({"error": "Use tolerancia (metros) > 0 ou zoom entre 0 e 22"}), 400
+
+    polyline = request.args.get("formato") == "polyline"
+    if resolucao is None:
+        consulta = _consulta_historico_placa(placa, dt_inicio, dt_fim).with_entities(*_colunas_historico())
+    else:
+        consulta = _consulta_historico(resolucao, dt_inicio, dt_fim).filter(LocalizacaoAgregada.placa == placa)
+    if tolerancia is None and zoom is None and not polyline:
+        # Padrão 24h sem nenhuma posição: mantém o 404 de sempre
+        if not data_filtro and not request.args.get("cursor") and consulta.first() is None:
+            return jsonify({"error": "Nenhuma localização encontrada para esta placa nas últimas 24h"}), 404
+        return _responder_historico(consulta, resolucao)
+
+    # Simplificação e polyline precisam do trajeto inteiro em memória (a resposta é que fica pequena)
+    col_ts, col_id = _colunas_ordem(resolucao)
+    dados = consulta.order_by(col_ts.desc(), col_id.desc()).all()
     
     # Se não encontrar nada
     if not dados:
         # Se foi filtro específico, retorna lista vazia para não quebrar front
         if data_filtro:
-            return jsonify([])
+            return jsonify(_historico_polyline(placa, []) if polyline else [])
         # Se foi padrão 24h, mantém comportamento antigo de 404 (opcional, mas mantendo compatibilidade)
         return jsonify({"error": "Nenhuma localização encontrada para esta placa nas últimas 24h"}), 404
 
-    return jsonify([d.to_dict() for d in dados])
+    total = len(dados)
+    if tolerancia is not None or zoom is not None:
+        dados = _simplificar_historico(placa, dados, tolerancia, zoom)
+
+    if polyline:
+        resposta = jsonify(_historico_polyline(placa, dados))
+    else:
+        resposta = jsonify([_historico_para_dict(d) for d in dados])
+    resposta.headers["X-Pontos-Total"] = str(total)
+    resposta.headers["X-Pontos-Descartados"] = str(total - len(dados))
+    resposta.headers["X-Resolucao"] = agregados.NOMES_RESOLUCAO[resolucao]
+    return resposta
+
+
+def _historico_polyline(placa, dados):
+    """
+    ?formato=polyline: o trajeto em ordem cronológica como encoded polyline do Google
+    (5 casas decimais), com timestamps (epoch em ms) e ids em arrays paralelos,
+    o primeiro valor absoluto e os demais como diferença do anterior.
+    """
+    trajeto = dados[::-1]
+    epochs_ms = [
+        int((l.timestamp if l.timestamp.tzinfo else pytz.utc.localize(l.timestamp)).timestamp() * 1000)
+        for l in trajeto
+    ]
+    ids = [l.id for l in trajeto]
+    return {
+        "placa": placa,
+        "pontos": len(trajeto),
+        "polyline": codificar_polyline([l.latitude for l in trajeto], [l.longitude for l in trajeto]),
+        "timestamps": [b - a for a, b in zip([0] + epochs_ms, epochs_ms)],
+        "ids": [b - a for a, b in zip([0] + ids, ids)],
+    }
+
+
+def _parametros_simplificacao():
+    """
+    (tolerancia, zoom) de ?tolerancia=<metros> ou ?zoom=<nível do mapa>; os dois
+    None se a simplificação não foi pedida. Lança ValueError se inválido.
+    """
+    tolerancia = zoom = None
+    if request.args.get("tolerancia"):
+        tolerancia = float(request.args["tolerancia"])
+        if not tolerancia > 0:
+            raise ValueError("tolerancia")
+    elif request.args.get("zoom"):
+        zoom = int(request.args["zoom"])
+        if not 0 <= zoom <= 22:
+            raise ValueError("zoom")
+    return tolerancia, zoom
+
+
+def _simplificar_historico(placa, dados, tolerancia=None, zoom=None):
+    """
+    Douglas-Peucker sobre o trajeto (dados em ordem decrescente, como na resposta),
+    mantendo início/fim de paradas e os pontos dos eventos do veículo no período.
+    Com `zoom`, a tolerância é 1 pixel do mapa nesse zoom.
+    """
+    trajeto = dados[::-1]
+    lats, lngs, epochs = arrays_trajeto(trajeto)
+    if tolerancia is None:
+        tolerancia = metros_por_pixel(zoom, lats.mean())
+
+    manter = pontos_de_parada(lats, lngs, epochs)
+    veiculo = Veiculo.query.filter_by(placa=placa).first()
+    if veiculo:
+        instantes = [
+            ts.timestamp() for (ts,) in db.session.query(Evento.timestamp).filter(
+                Evento.veiculo_id == veiculo.id,
+                Evento.timestamp >= trajeto[0].timestamp,
+                Evento.timestamp <= trajeto[-1].timestamp,
+            )
+        ]
+        manter[pontos_mais_proximos(epochs, instantes)] = True
+
+    mascara = simplificar_trajeto(lats, lngs, tolerancia, manter)
+    return [l for l, fica in zip(trajeto, mascara) if fica][::-1]
+
+def _ler_poligono(texto):
+    """"lat,lng;lat,lng;..." -> CercaIndexada (mesma ordem de Geofence.pontos). Lança ValueError."""
+    pontos = [[float(v) for v in par.split(",")] for par in texto.split(";") if par.strip()]
+    if len(pontos) < 3 or any(len(p) != 2 or not (-90 <= p[0] <= 90 and -180 <= p[1] <= 180) for p in pontos):
+        raise ValueError("polígono inválido")
+    return CercaIndexada(None, None, "poligono", pontos=pontos)
+
+
+# Veículos que passaram por uma área (bbox ou polígono) no período do histórico
+# (?data=YYYY-MM-DD&inicio=HH:MM&fim=HH:MM), com o primeiro e o último horário lá dentro
+@localizacao_bp.route("/localizacao/area", methods=["GET"])
+@check_subscription_status
+def veiculos_na_area():
+    clientes = clientes_do_usuario(_get_email_from_auth_header())
+    if clientes is None:
+        return jsonify({"error": "Usuário não identificado"}), 403
+
+    poligono = None
+    try:
+        if request.args.get("poligono"):
+            poligono = _ler_poligono(request.args["poligono"])
+            min_lat, min_lng, max_lat, max_lng = poligono.bbox
+            bbox = (min_lng, min_lat, max_lng, max_lat)
+        elif request.args.get("bbox"):
+            bbox = ler_bbox(request.args["bbox"])
+        else:
+            return jsonify({"error": "Informe bbox=minLng,minLat,maxLng,maxLat ou poligono=lat,lng;lat,lng;..."}), 400
+    except ValueError:
+        return jsonify({"error": "Área inválida"}), 400
+    try:
+        dt_inicio, dt_fim = _intervalo_historico()
+    except ValueError:
+        return jsonify({"error": "Formato de data/hora inválido"}), 400
+
+    filtros = [
+        Veiculo.cliente_id.in_(clientes),
+        historico_na_area(bbox),
+        Localizacao.timestamp >= dt_inicio,
+    ]
+    if dt_fim is not None:
+        filtros.append(Localizacao.timestamp <= dt_fim)
+    base = db.session.query(Veiculo.id, Veiculo.placa).join(Localizacao, Localizacao.placa == Veiculo.placa)
+
+    passagens = {}
+    if poligono is None:
+        # Retângulo: o filtro já é exato, agrega no banco
+        for veiculo_id, placa, primeiro, ultimo, pontos in base.add_columns(
+            func.min(Localizacao.timestamp), func.max(Localizacao.timestamp), func.count(Localizacao.id)
+        ).filter(*filtros).group_by(Veiculo.id, Veiculo.placa):
+            passagens[veiculo_id] = [placa, primeiro, ultimo, pontos]
+    else:
+        # Polígono: o retângulo envolvente vem do índice, o teste exato é feito aqui
+        linhas = base.add_columns(
+            Localizacao.latitude, Localizacao.longitude, Localizacao.timestamp
+        ).filter(*filtros).execution_options(yield_per=5000)
+        for veiculo_id, placa, lat, lng, ts in linhas:
+            if not poligono.contem(float(lat), float(lng)):
+                continue
+            item = passagens.get(veiculo_id)
+            if item is None:
+                passagens[veiculo_id] = [placa, ts, ts, 1]
+            else:
+                item[1] = min(item[1], ts)
+                item[2] = max(item[2], ts)
+                item[3] += 1
+
+    def _br(ts):
+        return (ts if ts.tzinfo else pytz.utc.localize(ts)).astimezone(br_tz).isoformat()
+
+    resultado = [
+        {"veiculo_id": veiculo_id, "placa": placa, "primeiro": _br(primeiro), "ultimo": _br(ultimo), "pontos": pontos}
+        for veiculo_id, (placa, primeiro, ultimo, pontos) in passagens.items()
+    ]
+    resultado.sort(key=lambda item: item["primeiro"])
+    return jsonify(resultado)
+
+
+# Resumo do trajeto (distância, duração e velocidades) com os mesmos filtros do histórico
+@localizacao_bp.route("/localizacao/<placa>/historico/resumo", methods=["GET"])
+@check_subscription_status
+def resumo_historico_por_placa(placa):
+    try:
+        dt_inicio, dt_fim = _intervalo_historico()
+    except ValueError:
+        return jsonify({"error": "Formato de data/hora inválido"}), 400
+    try:
+        resolucao = _resolucao_historico(dt_inicio, dt_fim)
+    except ValueError:
+        return jsonify({"error": "resolucao deve ser auto, bruta, 1min ou 15min"}), 400
+
+    if resolucao is None:
+        # Só as colunas necessárias, sem montar objetos ORM
+        linhas = _consulta_historico_placa(placa, dt_inicio, dt_fim).with_entities(
+            Localizacao.latitude, Localizacao.longitude, Localizacao.timestamp
+        ).order_by(Localizacao.timestamp.asc()).all()
+        lats, lngs, epochs = arrays_trajeto(linhas)
+        resumo = resumo_trajeto(lats, lngs, epochs)
+    else:
+        # Períodos longos: os agregados dão o mesmo resultado lendo uma fração das linhas
+        linhas = _consulta_historico(resolucao, dt_inicio, dt_fim).filter(
+            LocalizacaoAgregada.placa == placa
+        ).order_by(LocalizacaoAgregada.inicio.asc()).all()
+        resumo = agregados.resumo_agregados(linhas)
+
+    resposta = jsonify({"placa": placa, **resumo})
+    resposta.headers["X-Resolucao"] = agregados.NOMES_RESOLUCAO[resolucao]
+    return resposta
 
 @localizacao_bp.route("/localizacao/<int:id>", methods=["DELETE"])
 def deletar_localizacao(id):
-    loc = Localizacao.query.get(id)
+    # Chave primária é (id, timestamp) por causa do particionamento
+    loc = Localizacao.query.filter_by(id=id).first()
     if not loc:
         return jsonify({"error": "Localização não encontrada"}), 404
 
     db.session.delete(loc)
+    # A localização removida pode ser a última conhecida do veículo
+    veiculo = Veiculo.query.filter_by(placa=loc.placa).first()
+    if veiculo:
+        reconstruir_estado_vivo([veiculo.id])
     db.session.commit()
     return jsonify({"message": "Localização deletada"})
 
@@ -269,6 +871,8 @@ def deletar_localizacoes_24h():
         deletadas = Localizacao.query.filter(
             Localizacao.timestamp >= cutoff
         ).delete()
+        reconstruir_estado_vivo()
+        agregados.descartar_desde(cutoff)
 
         db.session.commit()
 
@@ -288,54 +892,25 @@ def info_completa(placa):
     if not veiculo:
         return jsonify({"error": "Veículo não encontrado"}), 404
 
-    localizacao = Localizacao.query.filter_by(placa=placa)\
-        .order_by(Localizacao.timestamp.desc()).first()
+    localizacao = VeiculoEstado.query.get(veiculo.id)
 
-    if not localizacao:
+    if not localizacao or localizacao.timestamp is None:
         return jsonify({"error": "Nenhuma localização encontrada"}), 404
 
     agora = datetime.now(br_tz)
 
     ts = localizacao.timestamp
     ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
-    delta_loc = agora - ts_br
-    if delta_loc.total_seconds() <= 9:
-        status = "Online"
-    else:
-        if veiculo.ultima_atualizacao:
-            delta = agora - veiculo.ultima_atualizacao
-            status = "Online" if delta.total_seconds() <= 9 else "Offline"
-        else:
-            status = "Offline"
-
-    # Offline por falta de atualizações: cria apenas UM evento de conexão perdida após 10 min
-    try:
-        if status == "Offline":
-            if veiculo.ultima_atualizacao:
-                gap = (agora - veiculo.ultima_atualizacao).total_seconds()
-                # Após 10 minutos sem atualização, registra perda de conexão (uma única vez)
-                CONNECTION_LOSS_TIMEOUT_SECS = 600
-                if gap >= CONNECTION_LOSS_TIMEOUT_SECS:
-                    last_event2 = Evento.query.filter_by(veiculo_id=veiculo.id).order_by(Evento.timestamp.desc()).first()
-                    if not last_event2 or last_event2.tipo != "CONEXAO":
-                        perda = Evento(
-                            veiculo_id=veiculo.id,
-                            cliente_id=veiculo.cliente_id,
-                            tipo="CONEXAO",
-                            descricao="Perda de conexão (10+ min sem atualizações)",
-                            timestamp=agora,
-                            lido=False
-                        )
-                        db.session.add(perda)
-                        db.session.commit()
-    except Exception:
-        db.session.rollback()
+    ultima_atualizacao = presenca.ultima_atualizacao(veiculo)
+    status = presenca.status_gps(veiculo, ts_br, agora)
 
+    # Só leitura: o evento CONEXAO (perda de conexão) é criado pela varredura em
+    # background (utils/conexao_perdida.py), não por quem consulta o status
     return jsonify({
         "placa": veiculo.placa,
         "status_gps": status,
         "latitude": localizacao.latitude,
         "longitude": localizacao.longitude,
         "timestamp": ts_br.isoformat(),
-        "ultima_atualizacao": veiculo.ultima_atualizacao.isoformat() if veiculo.ultima_atualizacao else None
+        "ultima_atualizacao": ultima_atualizacao.isoformat() if ultima_atualizacao else None
     })
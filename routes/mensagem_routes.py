@@ -3,9 +3,12 @@ from models.localizacao import Localizacao
 from models.veiculo import Veiculo
 from database import db
 from datetime import datetime
-import re
 import pytz  # timezone
 from utils.event_helper import process_vehicle_events
+from utils import fila_ingestao
+from utils.ingestao import normalizar_fix, processar_lote, extrair_fix_mensagem
+from utils.protocolo_binario import decodificar_pacote, PacoteInvalido
+from utils.presenca import presenca
 
 mensagens_bp = Blueprint('mensagens_bp', __name__)
 
@@ -17,15 +20,31 @@ def receber_mensagem():
 
     print(f"Mensagem recebida: {mensagem}")
 
-    # Regex para extrair placa, latitude e longitude
-    padrao = r"placa=([A-Z0-9]+), latitude=([-+]?\d*\.\d+|\d+), longitude=([-+]?\d*\.\d+|\d+)"
-    match = re.search(padrao, mensagem)
-    if not match:
+    # Regex (pré-compilada) para extrair placa, latitude e longitude
+    fix = extrair_fix_mensagem(mensagem)
+    if not fix:
         return jsonify({"error": "Não conseguiu extrair placa/lat/lng da mensagem"}), 400
 
-    placa = match.group(1)
-    lat = float(match.group(2))
-    lng = float(match.group(3))
+    placa = fix["placa"]
+    lat = fix["latitude"]
+    lng = fix["longitude"]
+
+    if fila_ingestao.ingestao_assincrona_ativa():
+        # Modo assíncrono: a validação do veículo e a gravação ficam com o writer
+        timestamp_brasilia = datetime.now(pytz.timezone("America/Sao_Paulo"))
+        fila_ingestao.fila.enfileirar([{
+            "placa": placa,
+            "latitude": lat,
+            "longitude": lng,
+            "timestamp": timestamp_brasilia.isoformat()
+        }])
+        return jsonify({
+            "status": "enfileirado",
+            "placa": placa,
+            "latitude": lat,
+            "longitude": lng,
+            "timestamp": timestamp_brasilia.isoformat()
+        }), 202
 
     # Verifica se o veículo existe
     veiculo = Veiculo.query.filter_by(placa=placa).first()
@@ -41,7 +60,7 @@ def receber_mensagem():
 
      # Atualiza status do veículo (ONLINE)
     # veiculo.status_ignicao = True # Removido para deixar o helper decidir baseado na velocidade
-    veiculo.ultima_atualizacao = timestamp_brasilia
+    presenca.registrar(veiculo, timestamp_brasilia)
 
     # Criar entrada GPS
     gps_entry = Localizacao(
@@ -65,3 +84,42 @@ def receber_mensagem():
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 400
+
+
+# Protocolo binário compacto (ver utils/protocolo_binario.py): vários registros por corpo
+@mensagens_bp.route("/mensagem/binario", methods=["POST"])
+def receber_mensagem_binaria():
+    try:
+        fixes = decodificar_pacote(request.get_data(cache=False))
+    except PacoteInvalido as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fila_ingestao.ingestao_assincrona_ativa():
+        validos = []
+        for fix in fixes:
+            normalizado, erro = normalizar_fix(fix)
+            if not erro:
+                validos.append({**normalizado, "timestamp": normalizado["timestamp"].isoformat()})
+        if validos:
+            fila_ingestao.fila.enfileirar(validos)
+        return jsonify({
+            "status": "enfileirado",
+            "recebidos": len(fixes),
+            "enfileirados": len(validos)
+        }), 202 if validos else 400
+
+    try:
+        resultados = processar_lote(fixes)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    inseridos = sum(1 for r in resultados if r["status"] == "ok")
+    duplicados = sum(1 for r in resultados if r["status"] == "duplicado")
+    erros = [r for r in resultados if r["status"] == "erro"]
+    return jsonify({
+        "status": "parcial" if erros else "ok",
+        "recebidos": len(fixes),
+        "inseridos": inseridos,
+        "duplicados": duplicados,
+        "erros": erros
+    }), 201 if inseridos else (200 if duplicados else 400)
@@ -9,6 +9,7 @@ from models.log_comando import LogComando
 from datetime import datetime
 import pytz
 import models.evento as evento
+from utils.frota import status_frota, do_administrador
 
 br_tz = pytz.timezone("America/Sao_Paulo")
 veiculo_bp = Blueprint("veiculo_bp", __name__)
@@ -16,8 +17,6 @@ veiculo_bp = Blueprint("veiculo_bp", __name__)
 @veiculo_bp.route("/veiculos", methods=["GET"])
 @check_subscription_status
 def listar_veiculos():
-    agora = datetime.now(br_tz)
-
     email = _get_email_from_auth_header()
     if not email:
         return jsonify([])
@@ -28,37 +27,20 @@ def listar_veiculos():
     admin = Administrador.query.filter_by(email=email).first()
     if admin:
         # Retorna veículos dos clientes criados por este admin
-        veiculos = Veiculo.query.join(Cliente).filter(Cliente.administrador_id == admin.id).all()
+        veiculos = status_frota(do_administrador(admin.id))
     else:
         # 2. Verifica se é Cliente
         cliente = Cliente.query.filter_by(email=email).first()
         if cliente:
             # Retorna apenas os veículos deste cliente
-            veiculos = Veiculo.query.filter_by(cliente_id=cliente.id).all()
+            veiculos = status_frota(Veiculo.cliente_id == cliente.id)
         else:
             # Se não identificou usuário, retorna lista vazia por segurança
             return jsonify([])
 
     resposta = []
 
-    for v in veiculos:
-        status_gps = "Offline"
-        loc = Localizacao.query.filter_by(placa=v.placa).order_by(Localizacao.timestamp.desc()).first()
-        if loc and loc.timestamp:
-            ts = loc.timestamp
-            ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
-            delta_loc = agora - ts_br
-            if delta_loc.total_seconds() <= 9:
-                status_gps = "Online"
-            else:
-                if v.ultima_atualizacao:
-                    delta = agora - v.ultima_atualizacao
-                    status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-        else:
-            if v.ultima_atualizacao:
-                delta = agora - v.ultima_atualizacao
-                status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-
+    for v, status_gps in veiculos:
         resposta.append({
             "id": v.id,
             "placa": v.placa,
@@ -75,29 +57,9 @@ def listar_veiculos():
 
 @veiculo_bp.route("/veiculos/admin/<int:admin_id>", methods=["GET"])
 def listar_veiculos_por_admin(admin_id):
-    agora = datetime.now(br_tz)
-
-    veiculos = Veiculo.query.join(Cliente).filter(Cliente.administrador_id == admin_id).all()
     resposta = []
 
-    for v in veiculos:
-        status_gps = "Offline"
-        loc = Localizacao.query.filter_by(placa=v.placa).order_by(Localizacao.timestamp.desc()).first()
-        if loc and loc.timestamp:
-            ts = loc.timestamp
-            ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
-            delta_loc = agora - ts_br
-            if delta_loc.total_seconds() <= 9:
-                status_gps = "Online"
-            else:
-                if v.ultima_atualizacao:
-                    delta = agora - v.ultima_atualizacao
-                    status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-        else:
-            if v.ultima_atualizacao:
-                delta = agora - v.ultima_atualizacao
-                status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-
+    for v, status_gps in status_frota(do_administrador(admin_id)):
         resposta.append({
             "id": v.id,
             "placa": v.placa,
@@ -115,9 +77,10 @@ def listar_veiculos_por_admin(admin_id):
 @veiculo_bp.route("/veiculos/<int:id>", methods=["GET"])
 @check_subscription_status
 def obter_veiculo(id):
-    v = Veiculo.query.get(id)
-    if not v:
+    encontrados = status_frota(Veiculo.id == id)
+    if not encontrados:
         return jsonify({"error": "Veículo não encontrado"}), 404
+    v, status_gps = encontrados[0]
 
     # Verificação de segurança
     email = _get_email_from_auth_header()
@@ -136,24 +99,6 @@ def obter_veiculo(id):
             else:
                 return jsonify({"error": "Usuário não identificado"}), 403
 
-    agora = datetime.now(br_tz)
-    status_gps = "Offline"
-    loc = Localizacao.query.filter_by(placa=v.placa).order_by(Localizacao.timestamp.desc()).first()
-    if loc and loc.timestamp:
-        ts = loc.timestamp
-        ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
-        delta_loc = agora - ts_br
-        if delta_loc.total_seconds() <= 9:
-            status_gps = "Online"
-        else:
-            if v.ultima_atualizacao:
-                delta = agora - v.ultima_atualizacao
-                status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-    else:
-        if v.ultima_atualizacao:
-            delta = agora - v.ultima_atualizacao
-            status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-
     return jsonify({
         "id": v.id,
         "placa": v.placa,
@@ -282,30 +227,12 @@ def atualizar_veiculo(id):
 @veiculo_bp.route("/veiculos/cliente/<int:cliente_id>", methods=["GET"])
 @check_subscription_status
 def listar_veiculos_cliente(cliente_id):
-    agora = datetime.now(br_tz)
-    veiculos = Veiculo.query.filter_by(cliente_id=cliente_id).all()
+    veiculos = status_frota(Veiculo.cliente_id == cliente_id)
     if not veiculos:
         return jsonify({"message": "Nenhum veículo encontrado para este cliente"}), 404
     
     resposta = []
-    for v in veiculos:
-        status_gps = "Offline"
-        loc = Localizacao.query.filter_by(placa=v.placa).order_by(Localizacao.timestamp.desc()).first()
-        if loc and loc.timestamp:
-            ts = loc.timestamp
-            ts_br = ts.astimezone(br_tz) if ts.tzinfo else pytz.utc.localize(ts).astimezone(br_tz)
-            delta_loc = agora - ts_br
-            if delta_loc.total_seconds() <= 9:
-                status_gps = "Online"
-            else:
-                if v.ultima_atualizacao:
-                    delta = agora - v.ultima_atualizacao
-                    status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-        else:
-            if v.ultima_atualizacao:
-                delta = agora - v.ultima_atualizacao
-                status_gps = "Online" if delta.total_seconds() <= 9 else "Offline"
-        
+    for v, status_gps in veiculos:
         resposta.append({
             "id": v.id,
             "placa": v.placa,
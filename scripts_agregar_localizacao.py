@@ -0,0 +1,68 @@
+"""
+Recalcula os agregados de 1 e 15 min ("LocalizacaoAgregada") a partir de
+"Localizacao". Cria as tabelas se ainda não existirem.
+
+Use na primeira implantação (para cobrir o histórico já gravado) ou se os
+agregados divergirem das posições (ex.: localizações alteradas direto no banco).
+A ingestão e a atualização periódica do app mantêm os agregados depois disso.
+Cada placa é recalculada dia a dia, com um commit por dia.
+
+Uso:
+    python scripts_agregar_localizacao.py
+    python scripts_agregar_localizacao.py --desde 2024-01-01 --ate 2024-03-31
+    python scripts_agregar_localizacao.py --placa ABC1234 --placa XYZ9876
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func
+import pytz
+
+from app import app
+from database import db
+from models.localizacao import Localizacao
+from models.localizacao_agregada import LocalizacaoAgregada, LocalizacaoAgregadaPendente
+from utils.agregados import recalcular_periodo
+
+
+def ler_data(valor):
+    return pytz.utc.localize(datetime.strptime(valor, "%Y-%m-%d"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recalcula "LocalizacaoAgregada" a partir do histórico')
+    parser.add_argument("--placa", action="append", help="Recalcula só estas placas (pode repetir)")
+    parser.add_argument("--desde", type=ler_data, help="Primeiro dia (YYYY-MM-DD, UTC); padrão: início do histórico")
+    parser.add_argument("--ate", type=ler_data, help="Último dia, inclusive (YYYY-MM-DD, UTC); padrão: agora")
+    args = parser.parse_args()
+
+    with app.app_context():
+        LocalizacaoAgregada.__table__.create(db.engine, checkfirst=True)
+        LocalizacaoAgregadaPendente.__table__.create(db.engine, checkfirst=True)
+
+        consulta = db.session.query(
+            Localizacao.placa, func.min(Localizacao.timestamp), func.max(Localizacao.timestamp)
+        ).group_by(Localizacao.placa)
+        if args.placa:
+            consulta = consulta.filter(Localizacao.placa.in_(args.placa))
+        if args.desde:
+            consulta = consulta.filter(Localizacao.timestamp >= args.desde)
+        if args.ate:
+            consulta = consulta.filter(Localizacao.timestamp < args.ate + timedelta(days=1))
+        faixas = consulta.all()
+        db.session.commit()
+        if not faixas:
+            print("Nenhuma localização no período")
+            return
+
+        inicio = time.perf_counter()
+        total = 0
+        for placa, menor, maior in faixas:
+            gravados = recalcular_periodo(placa, menor, maior)
+            total += gravados
+            print(f"{placa}: {gravados} agregados ({time.perf_counter() - inicio:.0f}s)")
+        print(f"{total} agregados de {len(faixas)} veículo(s) em {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
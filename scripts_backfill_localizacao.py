@@ -0,0 +1,261 @@
+"""
+Carga histórica de localizações (migração de outro fornecedor de rastreamento).
+
+Lê um arquivo CSV (cabeçalho: placa,latitude,longitude,timestamp) ou NDJSON
+(um objeto por linha com os mesmos campos) em streaming e grava em "Localizacao"
+via COPY do PostgreSQL, em blocos. Cada bloco é gravado junto com o checkpoint
+na mesma transação, então uma carga interrompida pode ser retomada rodando o
+mesmo comando novamente. Ao final, os agregados de 1/15 min das placas
+carregadas são recalculados.
+
+Uso:
+    python scripts_backfill_localizacao.py historico.csv
+    python scripts_backfill_localizacao.py historico.ndjson --bloco 100000 --eventos
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime
+import pytz
+
+from app import app
+from database import db
+from models.evento import Evento
+from models.localizacao import Localizacao
+from models.veiculo import Veiculo
+from utils import event_helper
+from utils.geo import geohash
+from utils.particoes import manter_particoes
+from utils.agregados import recalcular_periodo
+from utils.estado_veiculo import EstadoVeiculo, definir_estado, cache_estado, reconstruir_estado_vivo
+from utils.cercas import TIPOS_EVENTO_CERCA
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+SQL_CHECKPOINT = """
+CREATE TABLE IF NOT EXISTS backfill_checkpoint (
+    arquivo TEXT PRIMARY KEY,
+    registros BIGINT NOT NULL,
+    atualizado_em TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+# Eventos derivados do trajeto, recriados pela opção --eventos
+TIPOS_REGENERADOS = ("Movimento", "Parada", "Alerta") + TIPOS_EVENTO_CERCA
+
+
+def ler_registros(caminho, formato):
+    with open(caminho, newline="", encoding="utf-8") as f:
+        if formato == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for linha in f:
+                linha = linha.strip()
+                if linha:
+                    yield json.loads(linha)
+
+
+def converter_timestamp(valor):
+    """Aceita epoch (segundos) ou ISO 8601; sem fuso, assume UTC. Lança ValueError se inválido."""
+    if valor is None or valor == "":
+        raise ValueError("timestamp ausente")
+    if isinstance(valor, (int, float)):
+        return datetime.fromtimestamp(valor, pytz.utc)
+    texto = str(valor).strip()
+    try:
+        return datetime.fromtimestamp(float(texto), pytz.utc)
+    except ValueError:
+        pass
+    ts = datetime.fromisoformat(texto.replace("Z", "+00:00"))
+    return ts if ts.tzinfo else pytz.utc.localize(ts)
+
+
+def validar_registro(registro, placas):
+    """Retorna (placa, latitude, longitude, timestamp) ou None se o registro for inválido."""
+    placa = (registro.get("placa") or "").strip()
+    if placa not in placas:
+        return None
+    try:
+        return placa, float(registro["latitude"]), float(registro["longitude"]), \
+            converter_timestamp(registro.get("timestamp"))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def gravar_bloco(conn, arquivo, linhas, total_registros):
+    """COPY do bloco + checkpoint em uma única transação."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerows(linhas)
+    buffer.seek(0)
+
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            'COPY "Localizacao" (placa, latitude, longitude, timestamp, geohash) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+        cur.execute(
+            "INSERT INTO backfill_checkpoint (arquivo, registros, atualizado_em) VALUES (%s, %s, now()) "
+            "ON CONFLICT (arquivo) DO UPDATE SET registros = EXCLUDED.registros, atualizado_em = now()",
+            (arquivo, total_registros)
+        )
+    conn.commit()
+
+
+def carregar(caminho, formato, tamanho_bloco):
+    arquivo = os.path.abspath(caminho)
+    placas = {placa for (placa,) in db.session.query(Veiculo.placa).all()}
+    print(f"{len(placas)} placas cadastradas")
+
+    conn = db.engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SQL_CHECKPOINT)
+            cur.execute("SELECT registros FROM backfill_checkpoint WHERE arquivo = %s", (arquivo,))
+            linha = cur.fetchone()
+        conn.commit()
+        ja_carregados = linha[0] if linha else 0
+        if ja_carregados:
+            print(f"Retomando após {ja_carregados} registros já carregados")
+
+        faixas = defaultdict(lambda: [None, None])  # placa -> [menor, maior timestamp]
+        bloco = []
+        lidos = 0
+        inseridos = 0
+        rejeitados = 0
+        inicio = time.perf_counter()
+
+        for registro in ler_registros(caminho, formato):
+            lidos += 1
+            valido = validar_registro(registro, placas)
+            if valido is None:
+                if lidos > ja_carregados:
+                    rejeitados += 1
+                continue
+
+            placa, latitude, longitude, ts = valido
+            # As faixas incluem o que já foi carregado, para o --eventos funcionar ao retomar
+            faixa = faixas[placa]
+            faixa[0] = ts if faixa[0] is None or ts < faixa[0] else faixa[0]
+            faixa[1] = ts if faixa[1] is None or ts > faixa[1] else faixa[1]
+            if lidos <= ja_carregados:
+                continue
+
+            bloco.append((placa, latitude, longitude, ts.isoformat(), geohash(latitude, longitude)))
+
+            if len(bloco) >= tamanho_bloco:
+                gravar_bloco(conn, arquivo, bloco, lidos)
+                inseridos += len(bloco)
+                bloco = []
+                decorrido = time.perf_counter() - inicio
+                print(f"{inseridos} linhas gravadas ({inseridos / decorrido:,.0f} linhas/s), {rejeitados} rejeitadas")
+
+        if bloco:
+            gravar_bloco(conn, arquivo, bloco, lidos)
+            inseridos += len(bloco)
+        elif lidos > ja_carregados:
+            # Só rejeitados no final: avança o checkpoint mesmo assim
+            gravar_bloco(conn, arquivo, [], lidos)
+
+        decorrido = max(time.perf_counter() - inicio, 1e-9)
+        print(
+            f"Carga concluída: {inseridos} linhas em {decorrido:.1f}s "
+            f"({inseridos / decorrido:,.0f} linhas/s), {rejeitados} rejeitadas"
+        )
+        return faixas
+    finally:
+        conn.close()
+
+
+def regenerar_eventos(faixas, tamanho_bloco):
+    """
+    Recria os eventos de trajeto de cada veículo afetado em uma única passada
+    ordenada por timestamp, usando a mesma lógica do process_vehicle_events.
+    LED/ignição não fica gravado em Localizacao, então Ligado/Desligado não são recriados.
+    """
+    event_helper.DEBUG = False
+    veiculos = {v.placa: v for v in Veiculo.query.filter(Veiculo.placa.in_(list(faixas))).all()}
+
+    for placa, (menor, maior) in faixas.items():
+        veiculo = veiculos[placa]
+        inicio = time.perf_counter()
+
+        Evento.query.filter(
+            Evento.veiculo_id == veiculo.id,
+            Evento.tipo.in_(TIPOS_REGENERADOS),
+            Evento.timestamp >= menor,
+            Evento.timestamp <= maior
+        ).delete(synchronize_session=False)
+
+        # Estado inicial: o que existia imediatamente antes do período carregado
+        anterior = Localizacao.query.filter(
+            Localizacao.placa == placa, Localizacao.timestamp < menor
+        ).order_by(Localizacao.timestamp.desc()).first()
+        evento_anterior = Evento.query.filter(
+            Evento.veiculo_id == veiculo.id, Evento.timestamp < menor,
+            Evento.tipo.notin_(TIPOS_EVENTO_CERCA)
+        ).order_by(Evento.timestamp.desc()).first()
+        estado = EstadoVeiculo()
+        if anterior:
+            estado.registrar_posicao(anterior.latitude, anterior.longitude, anterior.timestamp)
+        if evento_anterior:
+            estado.registrar_evento(evento_anterior.tipo, evento_anterior.timestamp)
+        definir_estado(veiculo, estado)
+
+        pontos = db.session.query(
+            Localizacao.latitude, Localizacao.longitude, Localizacao.timestamp
+        ).filter(
+            Localizacao.placa == placa,
+            Localizacao.timestamp >= menor,
+            Localizacao.timestamp <= maior
+        ).order_by(Localizacao.timestamp.asc()).execution_options(yield_per=tamanho_bloco)
+
+        total = 0
+        for latitude, longitude, ts in pontos:
+            event_helper.process_vehicle_events(veiculo, latitude, longitude, ts)
+            total += 1
+        db.session.commit()
+        # O estado histórico não deve ficar no cache da ingestão ao vivo
+        cache_estado.invalidar(veiculo.id)
+
+        decorrido = max(time.perf_counter() - inicio, 1e-9)
+        print(f"Eventos de {placa}: {total} pontos analisados em {decorrido:.1f}s ({total / decorrido:,.0f} pontos/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga histórica de localizações via COPY")
+    parser.add_argument("arquivo", help="Arquivo .csv ou .ndjson")
+    parser.add_argument("--formato", choices=["csv", "ndjson"], help="Padrão: pela extensão do arquivo")
+    parser.add_argument("--bloco", type=int, default=50000, help="Linhas por COPY/commit")
+    parser.add_argument("--eventos", action="store_true", help="Recria os eventos de trajeto dos veículos carregados")
+    args = parser.parse_args()
+
+    formato = args.formato or ("csv" if args.arquivo.lower().endswith(".csv") else "ndjson")
+
+    with app.app_context():
+        faixas = carregar(args.arquivo, formato, args.bloco)
+        if faixas:
+            # Meses sem partição caíram na partição padrão: cria as mensais e move as linhas (sem retenção aqui)
+            resultado = manter_particoes(app.config["PARTICOES_FUTURAS_MESES"], 0)
+            if resultado:
+                print(f"{resultado['criadas']} partição(ões) criada(s), {resultado['movidas']} linhas movidas da padrão")
+        if args.eventos and faixas:
+            regenerar_eventos(faixas, args.bloco)
+        if faixas:
+            # O COPY não passa pela ingestão: agregados de 1/15 min das faixas carregadas
+            for placa, (menor, maior) in faixas.items():
+                total = recalcular_periodo(placa, menor, maior)
+                print(f"{placa}: {total} agregados recalculados")
+        if faixas:
+            # A carga pode trazer posições mais novas que as de "VeiculoEstado"
+            ids = [id_ for (id_,) in db.session.query(Veiculo.id).filter(Veiculo.placa.in_(list(faixas)))]
+            reconstruir_estado_vivo(ids)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark do índice de cercas (utils.cercas) contra a varredura de todas as cercas.
+
+Gera cercas aleatórias (círculos de 50 m a 1 km e polígonos de 4 a 12 vértices)
+sobre a Grande São Paulo e mede o custo por fix com 1/10 do total e com o total.
+Com o índice, o custo acompanha as cercas candidatas na célula do fix (aqui a
+área é fixa, então a densidade cresce junto com o total), não o total de cercas.
+
+Uso:
+    python scripts_bench_cercas.py [quantidade_de_cercas] [quantidade_de_fixes]
+"""
+import sys
+import time
+from math import cos, sin, pi
+import numpy as np
+
+from utils.cercas import CercaIndexada, IndiceCercas
+
+# Grande São Paulo (~60 x 60 km)
+LAT_MIN, LAT_MAX = -23.85, -23.30
+LNG_MIN, LNG_MAX = -46.90, -46.35
+
+
+def gerar_cercas(n, rng):
+    cercas = []
+    for i in range(n):
+        lat = rng.uniform(LAT_MIN, LAT_MAX)
+        lng = rng.uniform(LNG_MIN, LNG_MAX)
+        if i % 2 == 0:
+            cercas.append(CercaIndexada(i, f"c{i}", "circulo", lat, lng, rng.uniform(50, 1000)))
+        else:
+            vertices = int(rng.integers(4, 13))
+            raio = rng.uniform(0.0005, 0.008)
+            pontos = [
+                (lat + raio * sin(2 * pi * k / vertices), lng + raio * cos(2 * pi * k / vertices))
+                for k in range(vertices)
+            ]
+            cercas.append(CercaIndexada(i, f"p{i}", "poligono", pontos=pontos))
+    return cercas
+
+
+def cronometrar(nome, fn, fixes):
+    inicio = time.perf_counter()
+    resultado = fn()
+    decorrido = time.perf_counter() - inicio
+    print(f"  {nome:<28} {decorrido * 1e6 / fixes:10.1f} µs/fix")
+    return resultado
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    n_fixes = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    rng = np.random.default_rng(42)
+    todas = gerar_cercas(total, rng)
+    fixes = list(zip(rng.uniform(LAT_MIN, LAT_MAX, n_fixes), rng.uniform(LNG_MIN, LNG_MAX, n_fixes)))
+
+    for n in sorted({max(total // 10, 1), total}):
+        cercas = todas[:n]
+        inicio = time.perf_counter()
+        indice = IndiceCercas(cercas)
+        montagem = time.perf_counter() - inicio
+        candidatas = sum(len(indice.candidatas(lat, lng)) for lat, lng in fixes) / n_fixes
+
+        print(f"\n{n} cercas (índice montado em {montagem * 1000:.0f} ms, {candidatas:.1f} candidatas/fix em média)")
+        # A varredura completa é lenta: mede numa amostra
+        amostra = fixes[:max(n_fixes // 20, 1)]
+        linear = cronometrar("varredura de todas", lambda: [
+            {c.id for c in cercas if c.contem(lat, lng)} for lat, lng in amostra
+        ], len(amostra))
+        indexado = cronometrar("índice em grade", lambda: [
+            set(indice.contendo(lat, lng)) for lat, lng in fixes
+        ], n_fixes)
+        assert linear == indexado[:len(amostra)], "índice e varredura divergiram"
+
+    print("\nResultados idênticos entre índice e varredura.")
+
+
+if __name__ == "__main__":
+    main()
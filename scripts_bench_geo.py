@@ -0,0 +1,67 @@
+"""
+Benchmark do utils.geo contra o haversine escalar original do event_helper.
+
+Uso:
+    python scripts_bench_geo.py [quantidade_de_pontos]
+"""
+import sys
+import time
+from decimal import Decimal
+from math import radians, cos, sin, asin, sqrt
+import numpy as np
+
+from utils.geo import haversine, distancias_trecho, distancia_acumulada
+
+
+def haversine_original(lat1, lon1, lat2, lon2):
+    # Cópia da implementação anterior (math sobre Decimal, uma chamada por par)
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * asin(sqrt(a))
+    return c * 6371 * 1000
+
+
+def cronometrar(nome, fn, repeticoes=5):
+    melhor = float("inf")
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = fn()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    print(f"{nome:<40} {melhor * 1000:10.2f} ms")
+    return resultado
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = np.random.default_rng(42)
+    # Trajeto aleatório em torno de São Paulo, como as colunas Numeric(10, 7) devolvem
+    lats = -23.55 + np.cumsum(rng.normal(0, 0.0002, n))
+    lngs = -46.63 + np.cumsum(rng.normal(0, 0.0002, n))
+    lats_dec = [Decimal(f"{v:.7f}") for v in lats]
+    lngs_dec = [Decimal(f"{v:.7f}") for v in lngs]
+
+    print(f"Trajeto com {n} pontos ({n - 1} trechos)\n")
+
+    total_original = cronometrar("original (math + Decimal, laço)", lambda: sum(
+        haversine_original(lats_dec[i], lngs_dec[i], lats_dec[i + 1], lngs_dec[i + 1])
+        for i in range(n - 1)
+    ))
+    total_escalar = cronometrar("utils.geo.haversine (laço)", lambda: sum(
+        haversine(lats_dec[i], lngs_dec[i], lats_dec[i + 1], lngs_dec[i + 1])
+        for i in range(n - 1)
+    ))
+    total_vetorizado = cronometrar("utils.geo.distancias_trecho (NumPy)", lambda: float(
+        distancias_trecho(np.array(lats_dec, dtype=np.float64), np.array(lngs_dec, dtype=np.float64)).sum()
+    ))
+    cronometrar("utils.geo.distancia_acumulada (NumPy)", lambda: distancia_acumulada(lats, lngs))
+
+    print(f"\nDistância total: original={total_original:.3f} m, "
+          f"escalar={total_escalar:.3f} m, vetorizado={total_vetorizado:.3f} m")
+    print(f"Par único (ingestão): {haversine(lats_dec[0], lngs_dec[0], lats_dec[1], lngs_dec[1]):.3f} m")
+
+
+if __name__ == "__main__":
+    main()
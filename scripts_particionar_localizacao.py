@@ -0,0 +1,134 @@
+"""
+Converte "Localizacao" numa tabela particionada por mês (PostgreSQL).
+
+A tabela atual é renomeada para "Localizacao_antiga" (com seus índices e a
+sequência do id), a nova é criada particionada com a partição padrão e os
+próximos meses, e as linhas são copiadas mês a mês, um commit por mês. Pode ser
+interrompido e rodado de novo: a cópia continua de onde parou (ON CONFLICT na
+chave (id, timestamp)). Pare o app e o tracker durante a conversão; o script
+segura o advisory lock das partições até o fim, então a manutenção automática
+(utils/particoes.py) não cria nem apaga partições no meio da cópia.
+
+Rode antes `python update_db_schema.py` (coluna geohash).
+
+Uso:
+    python scripts_particionar_localizacao.py
+    python scripts_particionar_localizacao.py --apagar-antiga
+"""
+import argparse
+import time
+from sqlalchemy import inspect, text
+import pytz
+
+from app import app
+from database import db
+from models.localizacao import Localizacao
+from utils.particoes import (
+    CHAVE_LOCK, TABELA, criar_particao, garantir_particoes, particoes_mensais, somar_meses, tabela_particionada
+)
+
+ANTIGA = f"{TABELA}_antiga"
+COLUNAS = 'id, placa, latitude, longitude, "timestamp", geohash'
+
+
+def renomear_tabela_atual(conn):
+    """Libera os nomes ("Localizacao", índices, sequência) para a tabela particionada."""
+    indices = conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :tabela"
+    ), {"tabela": TABELA}).scalars().all()
+    sequencia = conn.execute(text(f"""SELECT pg_get_serial_sequence('"{TABELA}"', 'id')""")).scalar()
+
+    conn.execute(text(f'ALTER TABLE "{TABELA}" RENAME TO "{ANTIGA}"'))
+    for nome in indices:
+        conn.execute(text(f'ALTER INDEX "{nome}" RENAME TO "{nome[:55]}_antiga"'))
+    if sequencia:
+        # A tabela nova cria a própria sequência (BIGSERIAL) com o nome de sempre
+        conn.execute(text(f'ALTER SEQUENCE {sequencia} RENAME TO "{ANTIGA}_id_seq"'))
+
+
+def copiar_mes(conn, mes):
+    if mes not in particoes_mensais(conn):
+        criar_particao(conn, mes)
+    return conn.execute(text(
+        f'INSERT INTO "{TABELA}" ({COLUNAS}) SELECT {COLUNAS} FROM "{ANTIGA}" '
+        f'WHERE "timestamp" >= :inicio AND "timestamp" < :fim ON CONFLICT DO NOTHING'
+    ), {"inicio": mes, "fim": somar_meses(mes, 1)}).rowcount
+
+
+def converter(engine, args):
+    """Renomeia a tabela atual, cria a particionada e copia as linhas mês a mês."""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        if not tabela_particionada(conn):
+            if "geohash" not in [c["name"] for c in inspector.get_columns(TABELA)]:
+                print("Coluna 'geohash' ausente: rode python update_db_schema.py antes")
+                return
+            print(f'Renomeando "{TABELA}" para "{ANTIGA}" e criando a tabela particionada...')
+            renomear_tabela_atual(conn)
+            Localizacao.__table__.create(conn)
+        elif not inspector.has_table(ANTIGA):
+            print(f'"{TABELA}" já é particionada.')
+            return
+        else:
+            print(f'Retomando a cópia de "{ANTIGA}"...')
+
+    with engine.connect() as conn:
+        meses = conn.execute(text(
+            f"SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC') FROM \"{ANTIGA}\" "
+            "WHERE \"timestamp\" IS NOT NULL ORDER BY 1"
+        )).scalars().all()
+        sem_timestamp = conn.execute(text(f'SELECT count(*) FROM "{ANTIGA}" WHERE "timestamp" IS NULL')).scalar()
+
+    total = 0
+    inicio = time.perf_counter()
+    for mes in meses:
+        mes = mes.replace(tzinfo=pytz.utc)  # date_trunc do horário UTC (sem fuso)
+        with engine.begin() as conn:
+            copiadas = copiar_mes(conn, mes)
+        total += copiadas
+        print(f"{mes:%Y-%m}: {copiadas} linhas ({time.perf_counter() - inicio:.0f}s)")
+
+    with engine.begin() as conn:
+        # Ids novos continuam depois dos copiados
+        conn.execute(text(
+            f"""SELECT setval(pg_get_serial_sequence('"{TABELA}"', 'id'), """
+            f'(SELECT COALESCE(max(id), 0) + 1 FROM "{ANTIGA}"), false)'
+        ))
+        garantir_particoes(conn, futuras=app.config["PARTICOES_FUTURAS_MESES"])
+        if args.apagar_antiga:
+            conn.execute(text(f'DROP TABLE "{ANTIGA}"'))
+
+    print(f"Cópia concluída: {total} linhas em {len(meses)} mês(es)")
+    if sem_timestamp:
+        print(f'⚠️  {sem_timestamp} linha(s) sem timestamp ficaram só em "{ANTIGA}"')
+    if not args.apagar_antiga:
+        print(f'Confira os dados e apague a tabela antiga com: DROP TABLE "{ANTIGA}";')
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Particiona "Localizacao" por mês')
+    parser.add_argument("--apagar-antiga", action="store_true", help=f'Apaga "{ANTIGA}" ao final da cópia')
+    args = parser.parse_args()
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name != "postgresql":
+            print("Particionamento só é suportado no PostgreSQL")
+            return
+
+        # Lock de sessão numa conexão à parte, mantido durante toda a conversão
+        with engine.connect() as trava:
+            if not trava.execute(text("SELECT pg_try_advisory_lock(:chave)"), {"chave": CHAVE_LOCK}).scalar():
+                print("Manutenção de partições em andamento em outro processo; tente de novo em instantes")
+                return
+            trava.commit()
+            try:
+                converter(engine, args)
+            finally:
+                trava.execute(text("SELECT pg_advisory_unlock(:chave)"), {"chave": CHAVE_LOCK})
+                trava.commit()
+
+
+if __name__ == "__main__":
+    main()
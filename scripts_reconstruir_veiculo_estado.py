@@ -0,0 +1,44 @@
+"""
+Recalcula a tabela "VeiculoEstado" (última posição/evento de cada veículo) a partir
+do histórico de "Localizacao" e "Evento". Cria a tabela se ainda não existir.
+
+Use na primeira implantação da tabela ou se ela divergir do histórico
+(ex.: localizações apagadas direto no banco).
+
+Uso:
+    python scripts_reconstruir_veiculo_estado.py
+    python scripts_reconstruir_veiculo_estado.py --placa ABC1234 --placa XYZ9876
+"""
+import argparse
+import time
+
+from app import app
+from database import db
+from models.veiculo import Veiculo
+from models.veiculo_estado import VeiculoEstado
+from utils.estado_veiculo import reconstruir_estado_vivo
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconstrói "VeiculoEstado" a partir do histórico')
+    parser.add_argument("--placa", action="append", help="Reconstrói só estas placas (pode repetir)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        VeiculoEstado.__table__.create(db.engine, checkfirst=True)
+
+        ids = None
+        if args.placa:
+            ids = [id_ for (id_,) in db.session.query(Veiculo.id).filter(Veiculo.placa.in_(args.placa))]
+            if not ids:
+                print("Nenhum veículo encontrado para as placas informadas")
+                return
+
+        inicio = time.perf_counter()
+        total = reconstruir_estado_vivo(ids)
+        db.session.commit()
+        print(f"{total} veículo(s) reconstruído(s) em {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
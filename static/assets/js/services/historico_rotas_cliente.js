@@ -2,6 +2,11 @@ let map;
 let routePath;
 let markers = [];
 let lastLocations = [];
+// Trajeto simplificado no servidor com tolerância de 1 pixel neste zoom (~2 m);
+// a exportação CSV busca os pontos completos
+const ZOOM_TRAJETO = 16;
+let lastHistoricoUrl = null;
+let lastTotalPontos = 0;
 
 document.addEventListener("DOMContentLoaded", async () => {
     // 1. Inicializar Mapa
@@ -169,6 +174,9 @@ async function carregarTrajeto() {
         if (inicio) params.append("inicio", inicio);
         if (fim) params.append("fim", fim);
         
+        lastHistoricoUrl = `${url}?${params.toString()}`;
+        params.append("zoom", ZOOM_TRAJETO);
+        params.append("formato", "polyline");
         const fullUrl = `${url}?${params.toString()}`;
         console.log("Fetching:", fullUrl);
 
@@ -184,7 +192,7 @@ async function carregarTrajeto() {
             throw new Error("Erro ao buscar histórico");
         }
 
-        const locations = await res.json();
+        const locations = decodificarHistorico(await res.json());
         if (!locations || locations.length === 0) {
             Swal.fire({ icon: 'info', title: 'Info', text: 'Nenhum histórico encontrado para este período.' });
             clearMap();
@@ -193,8 +201,9 @@ async function carregarTrajeto() {
         }
 
         lastLocations = locations;
+        lastTotalPontos = Number(res.headers.get("X-Pontos-Total")) || locations.length;
         plotRoute(locations);
-        updateStats(locations);
+        updateStats(locations, lastTotalPontos);
 
     } catch (e) {
         console.error(e);
@@ -205,6 +214,25 @@ async function carregarTrajeto() {
     }
 }
 
+// Resposta ?formato=polyline -> [{id, placa, latitude, longitude, timestamp}] em ordem cronológica
+function decodificarHistorico(dados) {
+    if (!dados || !dados.polyline) return [];
+    const pontos = google.maps.geometry.encoding.decodePath(dados.polyline);
+    let ts = 0;
+    let id = 0;
+    return pontos.map((p, i) => {
+        ts += dados.timestamps[i];
+        id += dados.ids[i];
+        return {
+            id,
+            placa: dados.placa,
+            latitude: p.lat(),
+            longitude: p.lng(),
+            timestamp: new Date(ts).toISOString(),
+        };
+    });
+}
+
 function clearMap() {
     if (routePath) routePath.setMap(null);
     markers.forEach(m => m.setMap(null));
@@ -259,7 +287,7 @@ function plotRoute(locations) {
     map.fitBounds(bounds);
 }
 
-function updateStats(locations) {
+function updateStats(locations, totalPontos) {
     const elDist = document.getElementById("statDistancia");
     const elTempo = document.getElementById("statTempo");
     const elParadas = document.getElementById("statParadas");
@@ -296,7 +324,7 @@ function updateStats(locations) {
 
     if (elDist) elDist.innerText = `${totalDistKm.toFixed(1)} km`;
     if (elTempo) elTempo.innerText = `${hours}h ${mins}min`;
-    if (elParadas) elParadas.innerText = `${locations.length} pts`;
+    if (elParadas) elParadas.innerText = `${totalPontos || locations.length} pts`;
     if (elVel) elVel.innerText = `${avgSpeed.toFixed(1)} km/h`;
 }
 
@@ -327,20 +355,33 @@ function limparFiltros() {
   if (inicio) inicio.value = "";
   if (fim) fim.value = "";
   lastLocations = [];
+  lastHistoricoUrl = null;
   clearMap();
   updateStats(null);
 }
 
-function exportCSV() {
+async function exportCSV() {
   if (!lastLocations || lastLocations.length === 0) {
     Swal.fire({ icon: 'info', title: 'Info', text: 'Carregue um trajeto antes de exportar.' });
     return;
   }
+  let locations = lastLocations;
+  if (lastHistoricoUrl && lastTotalPontos > lastLocations.length) {
+    try {
+      const res = await fetch(lastHistoricoUrl);
+      if (res.ok) {
+        locations = await res.json();
+        locations.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp));
+      }
+    } catch (e) {
+      console.error(e);
+    }
+  }
   const select = document.getElementById("filtroVeiculo");
   const placa = select && select.value ? select.value : "veiculo";
   const data = document.getElementById("filtroData")?.value || "periodo";
   const header = ["timestamp","latitude","longitude"];
-  const rows = lastLocations.map(l => {
+  const rows = locations.map(l => {
     const ts = new Date(l.timestamp).toISOString();
     return [ts, l.latitude, l.longitude].join(",");
   });
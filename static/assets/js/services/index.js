@@ -6,6 +6,10 @@ class TempoRealUI {
         this.map = null;
         this.marker = null;
         this.markers = [];
+        this.markersByVehicle = {};
+        this.stream = null;
+        this.streamAtivo = false;
+        this.ultimoPoll = 0;
         this.generalMode = false;
         this.vehicles = [];
         this.currentVehicle = null;
@@ -180,6 +184,7 @@ class TempoRealUI {
             }
             if (this.panelIndividual) this.panelIndividual.style.display = "none";
             if (this.panelGeneral) this.panelGeneral.style.display = "block";
+            this.syncCursor = null;
             this.renderGeneral();
             this.renderVehicleList();
         } else {
@@ -236,6 +241,7 @@ class TempoRealUI {
             this.markers.forEach(m => m.setMap(null));
         }
         this.markers = [];
+        this.markersByVehicle = {};
     }
 
     async updateSingleView() {
@@ -292,36 +298,51 @@ class TempoRealUI {
 
     async renderGeneral() {
         try {
-            this.clearMarkers();
-            const url = this.userId ? `/localizacao/cliente/${this.userId}` : "/localizacao";
-            const lr = await fetch(this._bust(url));
-            const locs = await lr.json();
-            const latestByVehicle = {};
-            if (Array.isArray(locs)) {
-                locs.forEach(l => {
-                    const k = String(l.veiculo_id);
-                    const t = new Date(l.timestamp).getTime();
-                    if (!latestByVehicle[k] || t > latestByVehicle[k].t) {
-                        latestByVehicle[k] = { l, t };
-                    }
-                });
-            }
+            const base = this.userId ? `/localizacao/cliente/${this.userId}` : "/localizacao";
+            // Depois da carga inicial pede só o que mudou desde o cursor (304 se nada mudou)
+            const delta = !!this.syncCursor;
+            const url = delta ? `${base}?since=${encodeURIComponent(this.syncCursor)}` : base;
+            const headers = delta && this.syncEtag ? { "If-None-Match": this.syncEtag } : {};
+            const lr = await fetch(this._bust(url), { headers, cache: "no-store" });
+            if (lr.status === 304) return;
+            const body = await lr.json();
+            if (!lr.ok) return;
+            this.syncCursor = lr.headers.get("X-Sync-Cursor");
+            this.syncEtag = lr.headers.get("ETag");
+
+            const completo = !delta || body.completo;
+            const locs = Array.isArray(body) ? body : (body.localizacoes || []);
+            if (completo) this.clearMarkers();
+            (body.removidos || []).forEach(id => {
+                const m = this.markersByVehicle[String(id)];
+                if (!m) return;
+                m.setMap(null);
+                this.markers = this.markers.filter(x => x !== m);
+                delete this.markersByVehicle[String(id)];
+            });
+
             const bounds = new google.maps.LatLngBounds();
             let count = 0;
-            Object.values(latestByVehicle).forEach(item => {
-                const lat = parseFloat(item.l.latitude);
-                const lng = parseFloat(item.l.longitude);
-                const p = { lat, lng };
+            locs.forEach(l => {
+                const k = String(l.veiculo_id);
+                const p = { lat: parseFloat(l.latitude), lng: parseFloat(l.longitude) };
+                const v = this.vehicles.find(x => String(x.id) === k);
+                if (v) v.status_gps = l.status_gps;
+                if (this.markersByVehicle[k]) {
+                    this.markersByVehicle[k].setPosition(p);
+                    return;
+                }
                 const m = new google.maps.Marker({
                     position: p,
                     map: this.map,
-                    title: "Veículo " + item.l.veiculo_id
+                    title: "Veículo " + l.veiculo_id
                 });
                 this.markers.push(m);
+                this.markersByVehicle[k] = m;
                 bounds.extend(p);
                 count++;
             });
-            if (count > 0) {
+            if (completo && count > 0) {
                 this.map.fitBounds(bounds);
             }
         } catch (e) {
@@ -329,8 +350,48 @@ class TempoRealUI {
         }
     }
 
+    // Posições chegam por push (SSE) assim que o fix é gravado
+    openStream() {
+        if (!window.EventSource) return;
+        const es = new EventSource("/localizacao/stream");
+        es.onopen = () => { this.streamAtivo = true; };
+        es.onerror = () => { this.streamAtivo = false; };
+        es.addEventListener("posicao", (e) => {
+            try {
+                this.aplicarPosicoes(JSON.parse(e.data));
+            } catch (err) {
+                console.error(err);
+            }
+        });
+        this.stream = es;
+    }
+
+    // Delta compacto: v=veículo, p=placa, la/lo=coordenadas, t=epoch (s)
+    aplicarPosicoes(lista) {
+        lista.forEach(m => {
+            const v = this.vehicles.find(x => String(x.id) === String(m.v));
+            if (!v) return;
+            v.status_gps = "Online";
+            const pos = { lat: m.la, lng: m.lo };
+            if (this.generalMode) {
+                const marker = this.markersByVehicle[String(m.v)];
+                if (marker) marker.setPosition(pos);
+            } else if (this.currentVehicle && String(this.currentVehicle.id) === String(m.v)) {
+                this.marker.setPosition(pos);
+                this.map.setCenter(pos);
+                if (this.lastUpdateEl) this.lastUpdateEl.textContent = new Date(m.t * 1000).toLocaleString("pt-BR");
+                if (this.statusEl) this.statusEl.innerText = "Online";
+            }
+        });
+        if (this.generalMode) this.renderVehicleList();
+    }
+
     loop() {
+        this.openStream();
         setInterval(() => {
+            // Com o stream aberto o polling vira só uma reconciliação a cada minuto
+            if (this.streamAtivo && Date.now() - this.ultimoPoll < 60000) return;
+            this.ultimoPoll = Date.now();
             if (this.generalMode) {
                 this.renderGeneral();
                 this.renderVehicleList();
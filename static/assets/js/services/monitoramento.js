@@ -44,10 +44,15 @@ const MonitoramentoApi = (() => {
   return {
     listClients: () => request("/clientes"),
     listVehicles: () => request("/veiculos"),
-    listLocations: () => request("/localizacao"),
+    listLocations: (bbox) => request(bbox ? `/localizacao?bbox=${bbox}` : "/localizacao"),
+    listClusters: (zoom, bbox) =>
+      request(`/localizacao/clusters?zoom=${zoom}${bbox ? `&bbox=${bbox}` : ""}`),
   };
 })();
 
+// Acima disso o mapa mostra agrupamentos calculados no servidor em vez de um marcador por veículo
+const LIMITE_MARCADORES = 500;
+
 class MonitoramentoUI {
   constructor() {
     this.state = {
@@ -61,6 +66,7 @@ class MonitoramentoUI {
       },
       autoRefresh: true,
       refreshIntervalId: null,
+      stream: null,
     };
 
     this.elements = {
@@ -113,14 +119,61 @@ class MonitoramentoUI {
       clearInterval(this.state.refreshIntervalId);
       this.state.refreshIntervalId = null;
     }
+    if (this.state.stream) {
+      this.state.stream.close();
+      this.state.stream = null;
+    }
 
     if (this.state.autoRefresh) {
+      // Posições por push (SSE); o polling fica só para reconciliar status/listas
+      const streamAberto = this.openStream();
       this.state.refreshIntervalId = setInterval(() => {
         this.loadAll(false);
-      }, 5000); // 5s
+      }, streamAberto ? 60000 : 5000);
     }
   }
 
+  openStream() {
+    if (!window.EventSource) return false;
+    const es = new EventSource("/localizacao/stream");
+    es.addEventListener("posicao", (e) => {
+      try {
+        this.aplicarPosicoes(JSON.parse(e.data));
+      } catch (err) {
+        console.error(err);
+      }
+    });
+    this.state.stream = es;
+    return true;
+  }
+
+  // Delta compacto: v=veículo, p=placa, la/lo=coordenadas, t=epoch (s)
+  aplicarPosicoes(lista) {
+    lista.forEach((m) => {
+      const timestamp = new Date(m.t * 1000).toISOString();
+      const loc = this.state.locations.find(
+        (l) => String(l.veiculo_id) === String(m.v)
+      );
+      if (loc) {
+        loc.latitude = m.la;
+        loc.longitude = m.lo;
+        loc.timestamp = timestamp;
+      } else {
+        this.state.locations.push({
+          veiculo_id: m.v,
+          placa: m.p,
+          latitude: m.la,
+          longitude: m.lo,
+          timestamp,
+        });
+      }
+      const veiculo = this.state.vehicles.find((v) => String(v.id) === String(m.v));
+      if (veiculo) veiculo.status_gps = "Online";
+    });
+    this.renderListaVeiculos();
+    this.atualizarMarcadores();
+  }
+
   async loadAll(showLoader = true) {
     try {
       if (showLoader && this.elements.listaVeiculos) {
@@ -129,6 +182,8 @@ class MonitoramentoUI {
       }
 
       let clientes, veiculos, localizacoes;
+      // Depois da carga inicial, só a área visível do mapa
+      const bbox = this.bboxDoMapa();
 
       if (this.adminId) {
         [clientes, veiculos, localizacoes] = await Promise.all([
@@ -150,13 +205,13 @@ class MonitoramentoUI {
         [clientes, veiculos, localizacoes] = await Promise.all([
             MonitoramentoApi.listClients(),
             MonitoramentoApi.listVehicles(),
-            MonitoramentoApi.listLocations(),
+            MonitoramentoApi.listLocations(bbox),
         ]);
       }
 
       this.state.clients = Array.isArray(clientes) ? clientes : [];
       this.state.vehicles = Array.isArray(veiculos) ? veiculos : [];
-      this.state.locations = Array.isArray(localizacoes) ? localizacoes : [];
+      this.mesclarLocalizacoes(localizacoes, !!bbox);
 
       this.populateClienteSelect();
       this.populateVeiculosSelect();
@@ -172,6 +227,53 @@ class MonitoramentoUI {
     }
   }
 
+  // Área visível do mapa no formato minLng,minLat,maxLng,maxLat (null antes do mapa existir)
+  bboxDoMapa() {
+    const b = this.map && this.map.getBounds();
+    if (!b) return null;
+    const sw = b.getSouthWest();
+    const ne = b.getNorthEast();
+    return [sw.lng(), sw.lat(), ne.lng(), ne.lat()].map((v) => v.toFixed(5)).join(",");
+  }
+
+  // Com bbox a resposta só traz a área visível: atualiza essas posições e mantém as demais
+  mesclarLocalizacoes(lista, parcial) {
+    lista = Array.isArray(lista) ? lista : [];
+    if (!parcial) {
+      this.state.locations = lista;
+      return;
+    }
+    const porVeiculo = new Map(this.state.locations.map((l) => [String(l.veiculo_id), l]));
+    lista.forEach((l) => porVeiculo.set(String(l.veiculo_id), l));
+    this.state.locations = [...porVeiculo.values()];
+  }
+
+  // Frotas grandes sem filtro de veículo: agrupa no servidor pelo zoom atual
+  usarClusters() {
+    const { clienteId, veiculoId, status } = this.state.filters;
+    return (
+      this.state.vehicles.length > LIMITE_MARCADORES &&
+      clienteId === "all" && veiculoId === "all" && status === "all"
+    );
+  }
+
+  // Ao arrastar/zoom: busca só as posições da nova área
+  async carregarArea() {
+    const bbox = this.bboxDoMapa();
+    if (!bbox) return;
+    if (this.usarClusters()) {
+      this.carregarClusters();
+      return;
+    }
+    try {
+      this.mesclarLocalizacoes(await MonitoramentoApi.listLocations(bbox), true);
+      this.renderListaVeiculos();
+      this.atualizarMarcadores();
+    } catch (error) {
+      console.error(error);
+    }
+  }
+
   populateClienteSelect() {
     if (!this.elements.clienteSelect) return;
     const select = this.elements.clienteSelect;
@@ -331,19 +433,89 @@ class MonitoramentoUI {
             trafficLayer.setMap(this.map);
         }
         this.markers = [];
+        this.map.addListener("idle", () => {
+            clearTimeout(this.areaTimer);
+            this.areaTimer = setTimeout(() => this.carregarArea(), 300);
+        });
     }
 
     this.atualizarMarcadores();
   }
 
-  atualizarMarcadores() {
-    if (!this.map) return;
-
-    // Limpar marcadores antigos
+  limparMarcadores() {
     if (this.markers) {
         this.markers.forEach(m => m.setMap(null));
     }
     this.markers = [];
+  }
+
+  async carregarClusters() {
+    // Posições chegam pelo SSE a todo instante: no máximo uma busca a cada 2s
+    if (this.clustersEmAndamento || Date.now() - (this.clustersEm || 0) < 2000) {
+        clearTimeout(this.clustersTimer);
+        this.clustersTimer = setTimeout(() => this.carregarClusters(), 2000);
+        return;
+    }
+    this.clustersEmAndamento = true;
+    try {
+        const zoom = this.map.getZoom();
+        const { clusters } = await MonitoramentoApi.listClusters(zoom, this.bboxDoMapa());
+        this.clustersEm = Date.now();
+        if (!this.usarClusters()) return;
+        this.desenharClusters(clusters || [], zoom);
+    } catch (error) {
+        console.error(error);
+    } finally {
+        this.clustersEmAndamento = false;
+    }
+  }
+
+  desenharClusters(clusters, zoom) {
+    this.limparMarcadores();
+    clusters.forEach(c => {
+        const pos = { lat: c.latitude, lng: c.longitude };
+        const individual = c.total === 1;
+        // Cor pela proporção de veículos online no grupo
+        const fillColor = c.online === c.total ? "#198754" : c.online === 0 ? "#6c757d" : "#fd7e14";
+        const marker = new google.maps.Marker({
+            position: pos,
+            map: this.map,
+            title: individual ? c.placa : `${c.total} veículos (${c.online} online)`,
+            label: {
+                text: individual ? c.placa : String(c.total),
+                color: individual ? "black" : "white",
+                fontSize: "10px",
+                fontWeight: "bold"
+            },
+            icon: {
+                path: google.maps.SymbolPath.CIRCLE,
+                scale: individual ? 10 : Math.min(12 + Math.log2(c.total) * 3, 30),
+                fillColor,
+                fillOpacity: individual ? 1 : 0.85,
+                strokeWeight: 2,
+                strokeColor: "#ffffff",
+            }
+        });
+        if (!individual) {
+            marker.addListener("click", () => {
+                this.map.setCenter(pos);
+                this.map.setZoom(zoom + 2);
+            });
+        }
+        this.markers.push(marker);
+    });
+  }
+
+  atualizarMarcadores() {
+    if (!this.map) return;
+
+    if (this.usarClusters()) {
+        this.carregarClusters();
+        return;
+    }
+
+    // Limpar marcadores antigos
+    this.limparMarcadores();
 
     const veiculos = this.getFilteredVehicles();
     const bounds = new google.maps.LatLngBounds();
@@ -402,11 +574,13 @@ class MonitoramentoUI {
         }
     });
 
-    if (hasPoints) {
+    // Enquadra só na primeira carga; depois o usuário navega e o mapa busca a área visível
+    if (hasPoints && !this.initialFitDone) {
         this.map.fitBounds(bounds);
         if (this.markers.length === 1) {
             this.map.setZoom(15);
         }
+        this.initialFitDone = true;
     }
   }
 
@@ -2,6 +2,9 @@ document.addEventListener("DOMContentLoaded", () => {
   const badge = document.getElementById("navbarNotificationBadge");
   const listContainer = document.getElementById("navbarNotificationsList");
   let currentUserId = null;
+  // Estado do feed em tempo real (GET /eventos/stream)
+  let streamNotifs = [];
+  let streamUnread = 0;
 
   // Helper: Format Time Ago
   function timeAgo(isoString) {
@@ -136,10 +139,47 @@ document.addEventListener("DOMContentLoaded", () => {
       }
   }
 
-  function renderNavbarNotifications(notifs) {
+  function toNotif(e) {
+      return {
+          id: e.id,
+          tipo: e.tipo,
+          descricao: e.descricao,
+          timestamp: new Date(e.timestamp),
+          lido: e.lido
+      };
+  }
+
+  // Push: o servidor manda um snapshot, depois cada Evento novo e o total de não lidos.
+  // O EventSource reconecta sozinho enviando o Last-Event-ID (id do último evento).
+  function openNotificationStream() {
+      if (!window.EventSource) return false;
+      if (window.location.pathname.includes('/pagamento-pendente')) return true;
+
+      const es = new EventSource("/eventos/stream");
+      es.addEventListener("snapshot", (e) => {
+          const data = JSON.parse(e.data);
+          streamNotifs = (data.eventos || []).map(toNotif);
+          streamUnread = data.nao_lidos || 0;
+          renderNavbarNotifications(streamNotifs, streamUnread);
+      });
+      es.addEventListener("evento", (e) => {
+          const ev = JSON.parse(e.data);
+          if (streamNotifs.some(n => String(n.id) === String(ev.id))) return;
+          streamNotifs.unshift(toNotif(ev));
+          streamNotifs = streamNotifs.slice(0, 10);
+          renderNavbarNotifications(streamNotifs, streamUnread);
+      });
+      es.addEventListener("nao_lidos", (e) => {
+          streamUnread = JSON.parse(e.data).total || 0;
+          renderNavbarNotifications(streamNotifs, streamUnread);
+      });
+      return true;
+  }
+
+  function renderNavbarNotifications(notifs, totalUnread) {
       if (!listContainer) return;
       
-      const unreadCount = notifs.filter(n => !n.lido).length;
+      const unreadCount = typeof totalUnread === "number" ? totalUnread : notifs.filter(n => !n.lido).length;
       
       // Update Badge
       if (badge) {
@@ -222,9 +262,11 @@ document.addEventListener("DOMContentLoaded", () => {
              const found = users.find(u => u.email && u.email.toLowerCase() === user.email.toLowerCase());
              if (found) {
                  currentUserId = found.id;
-                 fetchNotifications();
-                 // Poll every 5s (Real-time feel)
-                 setInterval(fetchNotifications, 5000);
+                 if (!openNotificationStream()) {
+                     // Navegador sem EventSource: polling a cada 5s
+                     fetchNotifications();
+                     setInterval(fetchNotifications, 5000);
+                 }
              } else {
                  // User logged in firebase but not found in DB
                  if (listContainer) listContainer.innerHTML = '<li class="text-center py-2 text-danger small">Usuário não vinculado</li>';
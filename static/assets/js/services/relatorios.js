@@ -24,8 +24,9 @@ const RelatoriosApi = (() => {
     listClientsByAdmin: (adminId) => request(`/clientes/admin/${adminId}`),
     listVehicles: () => request("/veiculos"),
     listVehiclesByAdmin: (adminId) => request(`/veiculos/admin/${adminId}`),
-    listLocationsHistorico: () => request("/localizacao/historico"),
-    listLocationsHistoricoByAdmin: (adminId) => request(`/localizacao/historico/admin/${adminId}`),
+    listLocationsHistorico: (periodo = "") => request(`/localizacao/historico${periodo}`),
+    listLocationsHistoricoByAdmin: (adminId, periodo = "") =>
+      request(`/localizacao/historico/admin/${adminId}${periodo}`),
     listEventos: () => request("/eventos"),
     listEventosByAdmin: (adminId) => request(`/eventos/admin/${adminId}`),
   };
@@ -168,12 +169,13 @@ class RelatoriosUI {
   async gerarRelatorio() {
     try {
       let locationsPromise, eventosPromise;
+      const periodo = this.parametrosPeriodo();
 
       if (this.adminId) {
-        locationsPromise = RelatoriosApi.listLocationsHistoricoByAdmin(this.adminId);
+        locationsPromise = RelatoriosApi.listLocationsHistoricoByAdmin(this.adminId, periodo);
         eventosPromise = RelatoriosApi.listEventosByAdmin(this.adminId);
       } else {
-        locationsPromise = RelatoriosApi.listLocationsHistorico();
+        locationsPromise = RelatoriosApi.listLocationsHistorico(periodo);
         eventosPromise = RelatoriosApi.listEventos();
       }
 
@@ -214,6 +216,18 @@ class RelatoriosUI {
     }
   }
 
+  // Período filtrado no servidor: em semanas/meses a API devolve agregados
+  // de 1/15 min por veículo em vez de todas as posições
+  parametrosPeriodo() {
+    const { dataInicial, dataFinal } = this.state.filtros;
+    const inicial = this.elements.dataInicial?.value || (dataInicial ? this.toInputDate(dataInicial) : "");
+    const final = this.elements.dataFinal?.value || (dataFinal ? this.toInputDate(dataFinal) : "");
+    if (!inicial) return "";
+    const params = new URLSearchParams({ data_inicial: inicial });
+    if (final) params.set("data_final", final);
+    return `?${params}`;
+  }
+
   filtrarPorDataELimite(timestamp, inicio, fim) {
     try {
       const d = new Date(timestamp);
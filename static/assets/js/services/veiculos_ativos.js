@@ -46,7 +46,7 @@ const VeiculosAtivosApi = (() => {
 
   return {
     listVehicles: () => request("/veiculos"),
-    listLocations: () => request("/localizacao"),
+    listLocations: (bbox) => request(bbox ? `/localizacao?bbox=${bbox}` : "/localizacao"),
   };
 })();
 
@@ -104,13 +104,15 @@ class VeiculosAtivosUI {
           '<div class="p-3 text-muted text-center">Carregando veículos...</div>';
       }
 
+      // Depois da carga inicial, só a área visível do mapa
+      const bbox = this.bboxDoMapa();
       const [veiculos, localizacoes] = await Promise.all([
         VeiculosAtivosApi.listVehicles(),
-        VeiculosAtivosApi.listLocations(),
+        VeiculosAtivosApi.listLocations(bbox),
       ]);
 
       this.state.vehicles = Array.isArray(veiculos) ? veiculos : [];
-      this.state.locations = Array.isArray(localizacoes) ? localizacoes : [];
+      this.mesclarLocalizacoes(localizacoes, !!bbox);
 
       this.renderResumo();
       this.renderLista();
@@ -149,6 +151,40 @@ class VeiculosAtivosUI {
     }
   }
 
+  // Área visível do mapa no formato minLng,minLat,maxLng,maxLat (null antes do mapa existir)
+  bboxDoMapa() {
+    const b = this.map && this.map.getBounds();
+    if (!b) return null;
+    const sw = b.getSouthWest();
+    const ne = b.getNorthEast();
+    return [sw.lng(), sw.lat(), ne.lng(), ne.lat()].map((v) => v.toFixed(5)).join(",");
+  }
+
+  // Com bbox a resposta só traz a área visível: atualiza essas posições e mantém as demais
+  mesclarLocalizacoes(lista, parcial) {
+    lista = Array.isArray(lista) ? lista : [];
+    if (!parcial) {
+      this.state.locations = lista;
+      return;
+    }
+    const porVeiculo = new Map(this.state.locations.map((l) => [String(l.veiculo_id), l]));
+    lista.forEach((l) => porVeiculo.set(String(l.veiculo_id), l));
+    this.state.locations = [...porVeiculo.values()];
+  }
+
+  // Ao arrastar/zoom: busca só as posições da nova área
+  async carregarArea() {
+    const bbox = this.bboxDoMapa();
+    if (!bbox) return;
+    try {
+      this.mesclarLocalizacoes(await VeiculosAtivosApi.listLocations(bbox), true);
+      this.renderLista();
+      this.atualizarMarcadores();
+    } catch (error) {
+      console.error(error);
+    }
+  }
+
   lastLocationForVehicle(veiculo) {
     if (!this.state.locations?.length) return null;
     const locs = this.state.locations.filter(
@@ -278,6 +314,10 @@ class VeiculosAtivosUI {
             trafficLayer.setMap(this.map);
         }
         this.markers = [];
+        this.map.addListener("idle", () => {
+            clearTimeout(this.areaTimer);
+            this.areaTimer = setTimeout(() => this.carregarArea(), 300);
+        });
     }
 
     this.atualizarMarcadores();
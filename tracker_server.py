@@ -0,0 +1,188 @@
+"""
+Servidor de socket (asyncio) para conexões diretas dos rastreadores.
+
+Mantém conexões TCP persistentes (e opcionalmente UDP) e aceita, uma por linha,
+as mesmas mensagens do GET /mensagem:
+
+    placa=ABC1234, latitude=-23.5505, longitude=-46.6333
+
+As localizações são acumuladas e gravadas em lotes pelo mesmo pipeline do
+POST /localizacao/batch (utils.ingestao.processar_lote). Conexões ociosas
+custam apenas um StreamReader, então milhares cabem em um único núcleo.
+
+Uso:
+    python tracker_server.py --tcp-port 5050 --udp-port 5051
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pytz
+
+from app import app, iniciar_servicos
+from utils.ingestao import extrair_fix_mensagem, processar_lote
+from utils import fila_ingestao
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+TAMANHO_MAX_LINHA = 1024
+
+# Tentativas de gravar um lote antes de desviá-lo para a fila durável
+TENTATIVAS_LOTE = 3
+
+
+class ServidorRastreadores:
+    def __init__(self, tamanho_lote, intervalo, timeout_ocioso):
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.timeout_ocioso = timeout_ocioso
+        # Fila limitada: se o banco atrasar, as conexões param de ler (backpressure no TCP)
+        self.fila = asyncio.Queue(maxsize=tamanho_lote * 20)
+        # Uma única thread grava no banco, preservando a ordem dos lotes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tracker-db")
+        self.conexoes = 0
+
+    def _receber_linha(self, linha):
+        texto = linha.strip()
+        if not texto:
+            return None
+        fix = extrair_fix_mensagem(texto)
+        if fix:
+            fix["timestamp"] = datetime.now(br_tz)
+        return fix
+
+    async def tratar_conexao(self, reader, writer):
+        self.conexoes += 1
+        peer = writer.get_extra_info("peername")
+        try:
+            while True:
+                try:
+                    linha = await asyncio.wait_for(reader.readline(), timeout=self.timeout_ocioso)
+                except (asyncio.TimeoutError, asyncio.LimitOverrunError, ValueError):
+                    break
+                if not linha:
+                    break
+                fix = self._receber_linha(linha.decode("utf-8", errors="replace"))
+                if fix is None:
+                    writer.write(b"ERRO\n")
+                else:
+                    await self.fila.put(fix)
+                    writer.write(b"OK\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.conexoes -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            print(f"[TRACKER] Conexão encerrada: {peer}")
+
+    def _gravar(self, lote):
+        if fila_ingestao.ingestao_assincrona_ativa():
+            fila_ingestao.fila.enfileirar([{**f, "timestamp": f["timestamp"].isoformat()} for f in lote])
+            return len(lote), 0
+        with app.app_context():
+            resultados = processar_lote(lote)
+        erros = sum(1 for r in resultados if r["status"] == "erro")
+        return len(lote) - erros, erros
+
+    async def gravar_em_lotes(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = [await self.fila.get()]
+            limite = loop.time() + self.intervalo
+            while len(lote) < self.tamanho_lote:
+                restante = limite - loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(self.fila.get(), timeout=restante))
+                except asyncio.TimeoutError:
+                    break
+
+            inicio = time.perf_counter()
+            gravados, erros = await self._gravar_com_retentativas(loop, lote)
+            print(
+                f"[TRACKER] Lote gravado: {gravados} ok, {erros} rejeitado(s) "
+                f"em {(time.perf_counter() - inicio) * 1000:.1f} ms "
+                f"({self.conexoes} conexões, fila {self.fila.qsize()})"
+            )
+
+    async def _gravar_com_retentativas(self, loop, lote):
+        """
+        Cada fix do lote já foi respondido com OK, então o lote nunca é descartado:
+        tenta de novo com backoff e, se o banco continuar fora, passa a gravar pela
+        fila durável (fila_ingestao), que o writer drena quando o banco voltar.
+        Enquanto isso a fila em memória enche e as conexões TCP param de ser lidas.
+        """
+        espera = 0.5
+        tentativa = 0
+        while True:
+            tentativa += 1
+            try:
+                return await loop.run_in_executor(self.executor, self._gravar, lote)
+            except Exception as e:
+                print(f"[TRACKER] Erro ao gravar lote de {len(lote)} localizações (tentativa {tentativa}): {e}")
+            if tentativa >= TENTATIVAS_LOTE and not fila_ingestao.ingestao_assincrona_ativa():
+                try:
+                    await loop.run_in_executor(self.executor, fila_ingestao.iniciar_ingestao_assincrona, app)
+                    print("[TRACKER] Banco indisponível: lotes seguem pela fila durável")
+                    continue
+                except Exception as e:
+                    print(f"[TRACKER] Erro ao abrir a fila durável: {e}")
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, 30)
+
+
+class ProtocoloUDP(asyncio.DatagramProtocol):
+    def __init__(self, servidor):
+        self.servidor = servidor
+
+    def datagram_received(self, data, addr):
+        for linha in data.decode("utf-8", errors="replace").splitlines():
+            fix = self.servidor._receber_linha(linha)
+            if fix is None:
+                continue
+            try:
+                self.servidor.fila.put_nowait(fix)
+            except asyncio.QueueFull:
+                # UDP não tem backpressure: descarta quando a fila está cheia
+                print(f"[TRACKER] Fila cheia, datagrama de {addr} descartado")
+
+
+async def main(args):
+    servidor = ServidorRastreadores(args.lote, args.intervalo, args.timeout_ocioso)
+    loop = asyncio.get_running_loop()
+
+    tcp = await asyncio.start_server(
+        servidor.tratar_conexao, host=args.host, port=args.tcp_port,
+        limit=TAMANHO_MAX_LINHA, backlog=1024
+    )
+    print(f"[TRACKER] TCP escutando em {args.host}:{args.tcp_port}")
+
+    if args.udp_port:
+        await loop.create_datagram_endpoint(
+            lambda: ProtocoloUDP(servidor), local_addr=(args.host, args.udp_port)
+        )
+        print(f"[TRACKER] UDP escutando em {args.host}:{args.udp_port}")
+
+    async with tcp:
+        await asyncio.gather(tcp.serve_forever(), servidor.gravar_em_lotes())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor TCP/UDP para rastreadores FindWay")
+    parser.add_argument("--host", default=os.getenv("TRACKER_HOST", "0.0.0.0"))
+    parser.add_argument("--tcp-port", type=int, default=int(os.getenv("TRACKER_TCP_PORT", "5050")))
+    parser.add_argument("--udp-port", type=int, default=int(os.getenv("TRACKER_UDP_PORT", "0")))
+    parser.add_argument("--lote", type=int, default=int(os.getenv("TRACKER_LOTE", "200")))
+    parser.add_argument("--intervalo", type=float, default=float(os.getenv("TRACKER_INTERVALO", "1.0")))
+    parser.add_argument("--timeout-ocioso", type=float, default=float(os.getenv("TRACKER_TIMEOUT_OCIOSO", "900")))
+    args = parser.parse_args()
+    iniciar_servicos(app)
+    asyncio.run(main(args))
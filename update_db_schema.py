@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine, text, inspect
 from config import Config
 from dotenv import load_dotenv
+from utils.geo import geohash
 
 load_dotenv()
 
@@ -68,5 +69,134 @@ def upgrade_database():
         else:
             print("✅ Coluna 'lido' já existe.")
 
+        print("\nRemovendo índice de 'Veiculo.ultima_atualizacao' (a varredura usa 'VeiculoEstado')...")
+        try:
+            conn.execute(text('DROP INDEX IF EXISTS "ix_Veiculo_ultima_atualizacao"'))
+            conn.commit()
+            print("✅ Índice 'ix_Veiculo_ultima_atualizacao' removido.")
+        except Exception as e:
+            print(f"❌ Erro ao remover índice 'ix_Veiculo_ultima_atualizacao': {e}")
+
+        print("\nVerificando tabela 'VeiculoEstado'...")
+        if inspector.has_table('VeiculoEstado'):
+            columns_estado = [col['name'] for col in inspector.get_columns('VeiculoEstado')]
+
+            if 'versao' not in columns_estado:
+                print("⚠️  Adicionando coluna 'versao' na tabela 'VeiculoEstado'...")
+                try:
+                    conn.execute(text('ALTER TABLE "VeiculoEstado" ADD COLUMN versao BIGINT NOT NULL DEFAULT 0'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_versao" ON "VeiculoEstado" (versao)'))
+                    conn.commit()
+                    print("✅ Coluna 'versao' adicionada com sucesso!")
+                except Exception as e:
+                    print(f"❌ Erro ao adicionar coluna 'versao': {e}")
+            else:
+                print("✅ Coluna 'versao' já existe.")
+
+            if 'alterado_em' in columns_estado:
+                # Cursor antigo (horário da alteração), substituído por 'versao'
+                print("⚠️  Removendo coluna 'alterado_em' da tabela 'VeiculoEstado'...")
+                try:
+                    conn.execute(text('DROP INDEX IF EXISTS "ix_VeiculoEstado_alterado_em"'))
+                    conn.execute(text('ALTER TABLE "VeiculoEstado" DROP COLUMN alterado_em'))
+                    conn.commit()
+                    print("✅ Coluna 'alterado_em' removida.")
+                except Exception as e:
+                    print(f"❌ Erro ao remover coluna 'alterado_em': {e}")
+
+            try:
+                conn.execute(text(
+                    'CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_posicao" ON "VeiculoEstado" '
+                    'USING gist (point(longitude::float8, latitude::float8))'
+                ))
+                conn.commit()
+                print("✅ Índice espacial 'ix_VeiculoEstado_posicao' disponível.")
+            except Exception as e:
+                print(f"❌ Erro ao criar índice 'ix_VeiculoEstado_posicao': {e}")
+
+            try:
+                conn.execute(text(
+                    'CREATE INDEX IF NOT EXISTS "ix_VeiculoEstado_sem_conexao" ON "VeiculoEstado" (ultima_atualizacao) '
+                    "WHERE ultimo_evento_tipo IS NULL OR ultimo_evento_tipo <> 'CONEXAO'"
+                ))
+                conn.commit()
+                print("✅ Índice 'ix_VeiculoEstado_sem_conexao' disponível.")
+            except Exception as e:
+                print(f"❌ Erro ao criar índice 'ix_VeiculoEstado_sem_conexao': {e}")
+        else:
+            print("⚠️  Tabela 'VeiculoEstado' não existe: rode scripts_reconstruir_veiculo_estado.py")
+
+        print("\nVerificando tabela 'VeiculoRemovido'...")
+        if inspector.has_table('VeiculoRemovido'):
+            columns_removido = [col['name'] for col in inspector.get_columns('VeiculoRemovido')]
+            if 'versao' not in columns_removido:
+                print("⚠️  Adicionando coluna 'versao' na tabela 'VeiculoRemovido'...")
+                try:
+                    conn.execute(text('ALTER TABLE "VeiculoRemovido" ADD COLUMN versao BIGINT NOT NULL DEFAULT 0'))
+                    conn.execute(text('CREATE INDEX IF NOT EXISTS "ix_VeiculoRemovido_versao" ON "VeiculoRemovido" (versao)'))
+                    conn.commit()
+                    print("✅ Coluna 'versao' adicionada com sucesso!")
+                except Exception as e:
+                    print(f"❌ Erro ao adicionar coluna 'versao': {e}")
+            else:
+                print("✅ Coluna 'versao' já existe.")
+
+        print("\nVerificando tabela 'Localizacao'...")
+        columns_localizacao = [col['name'] for col in inspector.get_columns('Localizacao')]
+        if 'geohash' not in columns_localizacao:
+            print("⚠️  Adicionando coluna 'geohash' na tabela 'Localizacao'...")
+            try:
+                conn.execute(text('ALTER TABLE "Localizacao" ADD COLUMN geohash VARCHAR(12)'))
+                conn.commit()
+                print("✅ Coluna 'geohash' adicionada com sucesso!")
+            except Exception as e:
+                print(f"❌ Erro ao adicionar coluna 'geohash': {e}")
+
+        # Linhas antigas: calcula o geohash em blocos, andando pelo id (pode ser retomado)
+        preenchidas = 0
+        ultimo_id = 0
+        while True:
+            linhas = conn.execute(text(
+                'SELECT id, latitude, longitude FROM "Localizacao" '
+                'WHERE id > :ultimo AND geohash IS NULL ORDER BY id LIMIT 10000'
+            ), {"ultimo": ultimo_id}).all()
+            if not linhas:
+                break
+            ultimo_id = linhas[-1][0]
+            conn.execute(
+                text('UPDATE "Localizacao" SET geohash = :g WHERE id = :id'),
+                [{"id": id_, "g": geohash(lat, lng)} for id_, lat, lng in linhas]
+            )
+            conn.commit()
+            preenchidas += len(linhas)
+            print(f"   {preenchidas} localizações com geohash preenchido...")
+        indices_localizacao = [
+            ("ix_Localizacao_geohash_timestamp", "geohash, timestamp"),
+            ("ix_Localizacao_placa_timestamp", "placa, timestamp, id"),
+            ("ix_Localizacao_timestamp", "timestamp, id"),
+        ]
+        for nome, colunas in indices_localizacao:
+            try:
+                conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{nome}" ON "Localizacao" ({colunas})'))
+                conn.commit()
+                print(f"✅ Índice '{nome}' disponível.")
+            except Exception as e:
+                print(f"❌ Erro ao criar índice '{nome}': {e}")
+
+        if engine.dialect.name == "postgresql":
+            particionada = conn.execute(text(
+                """SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('"Localizacao"')"""
+            )).scalar()
+            if particionada:
+                print("✅ Tabela 'Localizacao' particionada por mês.")
+            else:
+                print("⚠️  Tabela 'Localizacao' não é particionada: rode scripts_particionar_localizacao.py")
+
+        print("\nVerificando tabelas de agregados...")
+        if inspector.has_table('LocalizacaoAgregada') and inspector.has_table('LocalizacaoAgregadaPendente'):
+            print("✅ Tabelas 'LocalizacaoAgregada' e 'LocalizacaoAgregadaPendente' já existem.")
+        else:
+            print("⚠️  Tabelas de agregados não existem: rode scripts_agregar_localizacao.py (a ingestão grava nelas)")
+
 if __name__ == "__main__":
     upgrade_database()
@@ -0,0 +1,309 @@
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import delete, event, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from database import db
+from models.localizacao import Localizacao
+from models.localizacao_agregada import LocalizacaoAgregada, LocalizacaoAgregadaPendente
+from utils.geo import distancias_trecho, haversine_np, velocidades_kmh
+import pytz
+
+# Agregados de "Localizacao" por veículo em intervalos de 1 e 15 minutos
+# ("LocalizacaoAgregada"): primeira/última/média das posições, velocidade máxima
+# e distância. Relatórios de semana/mês leem algumas centenas de linhas por
+# veículo em vez de centenas de milhares de posições.
+#
+# A ingestão só marca, na mesma transação, as janelas de 15 min de cada veículo
+# que receberam (ou perderam) posições; a atualização periódica recalcula essas
+# janelas inteiras a partir das posições brutas, apagando e regravando os
+# agregados. Por isso posições fora de ordem, cargas históricas e exclusões
+# chegam ao mesmo resultado de um recálculo completo.
+
+RESOLUCOES = (60, 900)
+JANELA = 900   # unidade de recálculo: o agregado de 15 min e os de 1 min dentro dele
+NOMES_RESOLUCAO = {None: "bruta", 60: "1min", 900: "15min"}
+
+# Resolução automática pelo tamanho do período: até 2 dias as posições brutas
+# (os históricos de um dia continuam iguais), até 14 dias 1 min, acima 15 min
+LIMITE_BRUTO = timedelta(days=2)
+LIMITE_1MIN = timedelta(days=14)
+
+PENDENTES_POR_RODADA = 2000
+
+_CHAVE_JANELAS = "agregados_janelas_alteradas"
+
+
+def _utc(ts):
+    return pytz.utc.localize(ts) if ts.tzinfo is None else ts.astimezone(pytz.utc)
+
+
+def janela(ts):
+    """Início (UTC) da janela de 15 min que contém `ts`."""
+    return datetime.fromtimestamp(_utc(ts).timestamp() // JANELA * JANELA, pytz.utc)
+
+
+def escolher_resolucao(inicio, fim):
+    """Resolução (segundos) adequada ao período, ou None para as posições brutas."""
+    periodo = fim - inicio
+    if periodo <= LIMITE_BRUTO:
+        return None
+    return 60 if periodo <= LIMITE_1MIN else 900
+
+
+def calcular_agregados(placa, linhas):
+    """
+    Agregados de 1 e 15 min de `linhas` (latitude, longitude, timestamp) de um
+    veículo, já em ordem de tempo. Retorna dicts prontos para o INSERT.
+    """
+    n = len(linhas)
+    if not n:
+        return []
+    tss = [_utc(l.timestamp) for l in linhas]
+    lats = np.fromiter((float(l.latitude) for l in linhas), dtype=np.float64, count=n)
+    lngs = np.fromiter((float(l.longitude) for l in linhas), dtype=np.float64, count=n)
+    epochs = np.fromiter((ts.timestamp() for ts in tss), dtype=np.float64, count=n)
+    trechos = distancias_trecho(lats, lngs)
+    velocidades = velocidades_kmh(lats, lngs, epochs)
+
+    agregados = []
+    for resolucao in RESOLUCOES:
+        intervalos = epochs // resolucao
+        cortes = np.flatnonzero(np.diff(intervalos)) + 1
+        for i, f in zip(np.concatenate(([0], cortes)), np.concatenate((cortes, [n]))):
+            i, f = int(i), int(f)
+            # Trechos i -> i+1 ... f-2 -> f-1: só os internos ao intervalo
+            agregados.append({
+                "resolucao": resolucao,
+                "placa": placa,
+                "inicio": datetime.fromtimestamp(intervalos[i] * resolucao, pytz.utc),
+                "pontos": f - i,
+                "primeiro_ts": tss[i],
+                "primeiro_lat": float(lats[i]),
+                "primeiro_lng": float(lngs[i]),
+                "ultimo_ts": tss[f - 1],
+                "ultimo_lat": float(lats[f - 1]),
+                "ultimo_lng": float(lngs[f - 1]),
+                "media_lat": round(float(lats[i:f].mean()), 7),
+                "media_lng": round(float(lngs[i:f].mean()), 7),
+                "distancia_m": float(trechos[i:f - 1].sum()),
+                "velocidade_max_kmh": float(velocidades[i:f - 1].max()) if f - i > 1 else 0.0,
+            })
+    return agregados
+
+
+def recalcular(placa, inicio, fim, session=None):
+    """
+    Refaz os agregados de `placa` entre `inicio` e `fim` (limites de janela) a
+    partir das posições brutas. Não faz commit. Retorna quantos agregados gravou.
+    """
+    session = session or db.session
+    linhas = session.query(Localizacao.latitude, Localizacao.longitude, Localizacao.timestamp).filter(
+        Localizacao.placa == placa,
+        Localizacao.timestamp >= inicio,
+        Localizacao.timestamp < fim,
+    ).order_by(Localizacao.timestamp, Localizacao.id).all()
+
+    session.execute(delete(LocalizacaoAgregada).where(
+        LocalizacaoAgregada.placa == placa,
+        LocalizacaoAgregada.inicio >= inicio,
+        LocalizacaoAgregada.inicio < fim,
+    ).execution_options(synchronize_session=False))
+    agregados = calcular_agregados(placa, linhas)
+    if agregados:
+        session.execute(insert(LocalizacaoAgregada), agregados)
+    return len(agregados)
+
+
+def recalcular_periodo(placa, inicio, fim, session=None):
+    """Recalcula todas as janelas de `placa` entre `inicio` e `fim`, um dia por commit."""
+    session = session or db.session
+    atual = janela(inicio)
+    fim = janela(fim) + timedelta(seconds=JANELA)
+    total = 0
+    while atual < fim:
+        ate = min(atual + timedelta(days=1), fim)
+        total += recalcular(placa, atual, ate, session)
+        session.commit()
+        atual = ate
+    return total
+
+
+def _sequencias(janelas):
+    """Janelas ordenadas -> [(inicio, fim)] com as consecutivas juntas (fim exclusivo)."""
+    passo = timedelta(seconds=JANELA)
+    sequencias = []
+    for inicio in janelas:
+        if sequencias and sequencias[-1][1] == inicio:
+            sequencias[-1][1] = inicio + passo
+        else:
+            sequencias.append([inicio, inicio + passo])
+    return sequencias
+
+
+def processar_pendentes(limite=PENDENTES_POR_RODADA):
+    """
+    Tira da fila até `limite` janelas pendentes (as mais antigas primeiro) e as
+    recalcula, numa transação. Com vários workers cada um pega janelas diferentes
+    (SKIP LOCKED). Retorna quantas janelas foram processadas.
+
+    As marcas são apagadas (DELETE ... RETURNING) antes de ler as posições: uma
+    ingestão que marcar a mesma janela durante o recálculo espera este commit e
+    grava a marca de novo, então a posição dela entra na próxima rodada.
+    """
+    session = db.session
+    try:
+        fila = select(
+            LocalizacaoAgregadaPendente.placa, LocalizacaoAgregadaPendente.janela
+        ).order_by(LocalizacaoAgregadaPendente.janela).limit(limite)
+        if session.get_bind().dialect.name == "postgresql":
+            fila = fila.with_for_update(skip_locked=True)
+        pendentes = session.execute(
+            delete(LocalizacaoAgregadaPendente).where(
+                tuple_(LocalizacaoAgregadaPendente.placa, LocalizacaoAgregadaPendente.janela).in_(fila)
+            ).returning(
+                LocalizacaoAgregadaPendente.placa, LocalizacaoAgregadaPendente.janela
+            ).execution_options(synchronize_session=False)
+        ).all()
+
+        por_placa = defaultdict(list)
+        for placa, inicio in pendentes:
+            por_placa[placa].append(_utc(inicio))
+        for placa, janelas in por_placa.items():
+            for inicio, fim in _sequencias(sorted(janelas)):
+                recalcular(placa, inicio, fim, session)
+        session.commit()
+        return len(pendentes)
+    except Exception:
+        session.rollback()
+        raise
+
+
+def resumo_agregados(linhas):
+    """
+    Mesmo resultado de geo.resumo_trajeto sobre as posições brutas, a partir dos
+    agregados do período em ordem de tempo: aos trechos internos de cada
+    intervalo somam-se os trechos entre o último ponto de um e o primeiro do seguinte.
+    """
+    pontos = sum(l.pontos for l in linhas)
+    if pontos < 2:
+        return {
+            "pontos": pontos,
+            "distancia_m": 0.0,
+            "duracao_s": 0.0,
+            "velocidade_media_kmh": 0.0,
+            "velocidade_max_kmh": 0.0,
+        }
+    anteriores, seguintes = linhas[:-1], linhas[1:]
+    ligacoes = haversine_np(
+        [float(l.ultimo_lat) for l in anteriores], [float(l.ultimo_lng) for l in anteriores],
+        [float(l.primeiro_lat) for l in seguintes], [float(l.primeiro_lng) for l in seguintes],
+    )
+    dt = np.array([
+        (_utc(b.primeiro_ts) - _utc(a.ultimo_ts)).total_seconds() for a, b in zip(anteriores, seguintes)
+    ], dtype=np.float64)
+    velocidades = np.zeros_like(ligacoes)
+    validos = dt > 0
+    velocidades[validos] = ligacoes[validos] / dt[validos] * 3.6
+
+    distancia = sum(l.distancia_m for l in linhas) + float(ligacoes.sum())
+    duracao = (_utc(linhas[-1].ultimo_ts) - _utc(linhas[0].primeiro_ts)).total_seconds()
+    velocidade_max = max([l.velocidade_max_kmh for l in linhas] + velocidades.tolist())
+    return {
+        "pontos": pontos,
+        "distancia_m": round(distancia, 1),
+        "duracao_s": duracao,
+        "velocidade_media_kmh": round(distancia / duracao * 3.6, 1) if duracao > 0 else 0.0,
+        "velocidade_max_kmh": round(velocidade_max, 1),
+    }
+
+
+def marcar_pendentes(linhas, session=None):
+    """Agenda o recálculo das janelas de (placa, timestamp) no commit desta transação."""
+    session = session or db.session
+    janelas = session.info.setdefault(_CHAVE_JANELAS, set())
+    for placa, ts in linhas:
+        if ts is not None:
+            janelas.add((placa, janela(ts)))
+
+
+def descartar_desde(inicio, session=None):
+    """
+    Após apagar todas as posições a partir de `inicio` (DELETE em massa): apaga
+    os agregados das janelas seguintes e agenda o recálculo da janela de `inicio`.
+    """
+    session = session or db.session
+    primeira = janela(inicio)
+    placas = session.query(LocalizacaoAgregada.placa).filter(
+        LocalizacaoAgregada.resolucao == JANELA, LocalizacaoAgregada.inicio == primeira
+    ).all()
+    marcar_pendentes([(placa, primeira) for (placa,) in placas], session)
+    session.execute(delete(LocalizacaoAgregada).where(
+        LocalizacaoAgregada.inicio >= primeira + timedelta(seconds=JANELA)
+    ).execution_options(synchronize_session=False))
+
+
+@event.listens_for(Session, "after_flush")
+def _acompanhar_localizacoes(session, flush_context):
+    # Localizações gravadas ou apagadas pelo ORM (rotas antigas, DELETE /localizacao/<id>)
+    alteradas = [obj for obj in list(session.new) + list(session.deleted) if isinstance(obj, Localizacao)]
+    if alteradas:
+        marcar_pendentes([(obj.placa, obj.timestamp) for obj in alteradas], session)
+
+
+@event.listens_for(Session, "before_commit")
+def _gravar_pendentes(session):
+    if any(isinstance(obj, Localizacao) for obj in list(session.new) + list(session.deleted)):
+        session.flush()
+    janelas = session.info.pop(_CHAVE_JANELAS, None)
+    if not janelas:
+        return
+    insert_dialeto = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    # Ordenadas: duas ingestões do mesmo veículo travam as linhas na mesma ordem
+    session.execute(insert_dialeto(LocalizacaoAgregadaPendente).values([
+        {"placa": placa, "janela": inicio} for placa, inicio in sorted(janelas)
+    ]).on_conflict_do_nothing())
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_pendentes(session):
+    session.info.pop(_CHAVE_JANELAS, None)
+
+
+class AtualizacaoAgregados:
+    """Thread que processa as janelas pendentes a cada `intervalo` segundos."""
+
+    def __init__(self):
+        self.app = None
+        self.intervalo = None
+        self.ultimo_erro = None
+
+    def _rodar(self):
+        try:
+            with self.app.app_context():
+                # Rodada cheia: ainda há fila (ex.: depois de uma carga grande)
+                while processar_pendentes() == PENDENTES_POR_RODADA:
+                    pass
+            self.ultimo_erro = None
+        except Exception as e:
+            self.ultimo_erro = str(e)
+            print(f"[AGREGADOS] Erro na atualização: {e}")
+
+    def _loop(self):
+        while True:
+            self._rodar()
+            time.sleep(self.intervalo)
+
+    def iniciar(self, app):
+        """Inicia a atualização (uma vez por processo)."""
+        if self.app is not None:
+            return
+        self.app = app
+        self.intervalo = app.config["AGREGACAO_INTERVALO"]
+        threading.Thread(target=self._loop, name="atualizacao-agregados", daemon=True).start()
+
+
+atualizacao_agregados = AtualizacaoAgregados()
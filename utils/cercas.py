@@ -0,0 +1,201 @@
+import threading
+import time
+from collections import defaultdict
+from math import cos, floor, radians
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import Session
+from database import db
+from models.cliente import Cliente
+from models.evento import Evento
+from models.geofence import Geofence
+from utils.geo import haversine
+
+# Cercas virtuais avaliadas na ingestão (process_vehicle_events).
+#
+# As cercas de cada cliente (as dele e as do seu administrador) ficam em memória
+# numa grade uniforme: cada cerca é registrada nas células que o seu retângulo
+# envolvente toca, e um fix só é testado contra as cercas da sua célula. O custo
+# por fix depende de quantas cercas se sobrepõem ali, não do total de cercas.
+
+EVENTO_ENTRADA_CERCA = "Entrada em cerca"
+EVENTO_SAIDA_CERCA = "Saída de cerca"
+TIPOS_EVENTO_CERCA = (EVENTO_ENTRADA_CERCA, EVENTO_SAIDA_CERCA)
+
+# ~1,1 km de lado em latitude
+CELULA_GRAUS = 0.01
+# Cercas que cobririam mais células que isso ficam numa lista testada a cada fix
+MAX_CELULAS_POR_CERCA = 4096
+# Outros processos (tracker, writer) recarregam as cercas depois deste tempo
+RECARGA_SEGUNDOS = 60
+
+METROS_POR_GRAU = 111320.0
+
+_CHAVE_ALTERADAS = "cercas_alteradas"
+
+
+class CercaIndexada:
+    """Cópia em memória de uma Geofence, com o retângulo envolvente (graus)."""
+
+    __slots__ = ("id", "nome", "tipo", "latitude", "longitude", "raio_m", "pontos", "bbox")
+
+    def __init__(self, id_, nome, tipo, latitude=None, longitude=None, raio_m=None, pontos=None):
+        self.id = id_
+        self.nome = nome
+        self.tipo = tipo
+        if tipo == "circulo":
+            self.latitude = float(latitude)
+            self.longitude = float(longitude)
+            self.raio_m = float(raio_m)
+            self.pontos = None
+            dlat = self.raio_m / METROS_POR_GRAU
+            dlng = self.raio_m / (METROS_POR_GRAU * max(cos(radians(self.latitude)), 1e-6))
+            self.bbox = (self.latitude - dlat, self.longitude - dlng, self.latitude + dlat, self.longitude + dlng)
+        else:
+            self.latitude = self.longitude = self.raio_m = None
+            self.pontos = [(float(lat), float(lng)) for lat, lng in pontos]
+            lats = [p[0] for p in self.pontos]
+            lngs = [p[1] for p in self.pontos]
+            self.bbox = (min(lats), min(lngs), max(lats), max(lngs))
+
+    @classmethod
+    def de_modelo(cls, g):
+        return cls(g.id, g.nome, g.tipo, g.latitude, g.longitude, g.raio_m, g.pontos)
+
+    def contem(self, lat, lng):
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        if self.tipo == "circulo":
+            return haversine(self.latitude, self.longitude, lat, lng) <= self.raio_m
+        # Ray casting (plano lat/lng: suficiente para cercas de alguns km)
+        dentro = False
+        pontos = self.pontos
+        j = len(pontos) - 1
+        for i in range(len(pontos)):
+            lat_i, lng_i = pontos[i]
+            lat_j, lng_j = pontos[j]
+            if (lat_i > lat) != (lat_j > lat) and \
+                    lng < (lng_j - lng_i) * (lat - lat_i) / (lat_j - lat_i) + lng_i:
+                dentro = not dentro
+            j = i
+        return dentro
+
+
+def _celula(lat, lng, celula):
+    return floor(lat / celula), floor(lng / celula)
+
+
+class IndiceCercas:
+    """Grade uniforme sobre as cercas de um cliente."""
+
+    def __init__(self, cercas, celula=CELULA_GRAUS):
+        self.celula = celula
+        self.total = 0
+        self._grade = defaultdict(list)
+        self._grandes = []
+        for cerca in cercas:
+            self.adicionar(cerca)
+
+    def adicionar(self, cerca):
+        min_lat, min_lng, max_lat, max_lng = cerca.bbox
+        i0, j0 = _celula(min_lat, min_lng, self.celula)
+        i1, j1 = _celula(max_lat, max_lng, self.celula)
+        self.total += 1
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > MAX_CELULAS_POR_CERCA:
+            self._grandes.append(cerca)
+            return
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self._grade[(i, j)].append(cerca)
+
+    def candidatas(self, lat, lng):
+        return self._grade.get(_celula(lat, lng, self.celula), []) + self._grandes
+
+    def contendo(self, lat, lng):
+        """{id: cerca} das cercas que contêm o ponto."""
+        lat, lng = float(lat), float(lng)
+        return {c.id: c for c in self.candidatas(lat, lng) if c.contem(lat, lng)}
+
+    def __len__(self):
+        return self.total
+
+
+class RegistroCercas:
+    """Índices por cliente, carregados sob demanda e recarregados a cada RECARGA_SEGUNDOS."""
+
+    def __init__(self):
+        self._indices = {}   # cliente_id -> (carregado_em, IndiceCercas)
+        self._lock = threading.Lock()
+
+    def indice(self, cliente_id):
+        agora = time.monotonic()
+        with self._lock:
+            item = self._indices.get(cliente_id)
+        if item is not None and agora - item[0] < RECARGA_SEGUNDOS:
+            return item[1]
+
+        admin_do_cliente = select(Cliente.administrador_id).where(Cliente.id == cliente_id).scalar_subquery()
+        cercas = db.session.execute(
+            select(Geofence).where(
+                Geofence.ativo.is_(True),
+                or_(Geofence.cliente_id == cliente_id, Geofence.administrador_id == admin_do_cliente)
+            )
+        ).scalars().all()
+        indice = IndiceCercas(CercaIndexada.de_modelo(g) for g in cercas)
+        with self._lock:
+            self._indices[cliente_id] = (agora, indice)
+        return indice
+
+    def invalidar(self, cliente_id=None):
+        with self._lock:
+            if cliente_id is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(cliente_id, None)
+
+
+registro_cercas = RegistroCercas()
+
+
+def avaliar_cercas(veiculo, estado, new_lat, new_lng, new_timestamp):
+    """
+    Compara as cercas que contêm a posição anterior (do estado do veículo) com
+    as que contêm o fix novo e grava um Evento de entrada/saída para cada
+    diferença. Fixes fora de ordem ou sem posição anterior não geram eventos.
+    """
+    if not estado.tem_posicao or new_timestamp <= estado.timestamp:
+        return []
+    indice = registro_cercas.indice(veiculo.cliente_id)
+    if not len(indice):
+        return []
+
+    antes = indice.contendo(estado.latitude, estado.longitude)
+    depois = indice.contendo(new_lat, new_lng)
+    eventos = [
+        Evento(veiculo_id=veiculo.id, cliente_id=veiculo.cliente_id, tipo=EVENTO_ENTRADA_CERCA,
+               descricao=f"Entrou na cerca {cerca.nome}", timestamp=new_timestamp, lido=False)
+        for id_, cerca in depois.items() if id_ not in antes
+    ] + [
+        Evento(veiculo_id=veiculo.id, cliente_id=veiculo.cliente_id, tipo=EVENTO_SAIDA_CERCA,
+               descricao=f"Saiu da cerca {cerca.nome}", timestamp=new_timestamp, lido=False)
+        for id_, cerca in antes.items() if id_ not in depois
+    ]
+    db.session.add_all(eventos)
+    return eventos
+
+
+@event.listens_for(Session, "after_flush")
+def _acompanhar_cercas(session, flush_context):
+    if any(isinstance(obj, Geofence) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info[_CHAVE_ALTERADAS] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _recarregar_cercas(session):
+    if session.info.pop(_CHAVE_ALTERADAS, False):
+        registro_cercas.invalidar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_cercas(session):
+    session.info.pop(_CHAVE_ALTERADAS, None)
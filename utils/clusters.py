@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from math import floor, log, pi, radians, tan, cos
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from database import db
+from models.veiculo import Veiculo
+from models.veiculo_estado import VeiculoEstado
+from utils import tempo_real
+from utils.frota import faixas_longitude
+from utils.presenca import presenca
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Agrupamento das últimas posições por zoom (GET /localizacao/clusters).
+#
+# Para cada frota (conjunto de clientes visíveis a um usuário) fica em memória uma
+# pirâmide: em cada zoom, as células da grade Web Mercator com os veículos que
+# estão nelas. As posições novas chegam pelo canal tempo_real.posicoes e movem só
+# o veículo afetado entre células; a pirâmide inteira é recarregada do banco a
+# cada RECARGA_SEGUNDOS (veículos removidos/transferidos) ou logo que a fila da
+# assinatura transbordar (mensagens perdidas). Online/Offline segue a mesma regra
+# de /localizacao/proximos (presenca: última posição ou último heartbeat).
+
+# Lado da célula em pixels de tela (tiles de 256 px => 2^(zoom+2) células por eixo)
+CELULA_PX = 64
+ZOOM_MAXIMO = 18
+RECARGA_SEGUNDOS = 300
+MAX_FROTAS = 100
+
+_CHAVE_FROTA_ALTERADA = "clusters_frota_alterada"
+
+LAT_MERCATOR = 85.05112878
+
+
+def _mercator(lat, lng):
+    """Coordenadas normalizadas (0..1) na projeção Web Mercator."""
+    lat = min(max(float(lat), -LAT_MERCATOR), LAT_MERCATOR)
+    x = (float(lng) + 180.0) / 360.0
+    y = (1.0 - log(tan(radians(lat)) + 1.0 / cos(radians(lat))) / pi) / 2.0
+    return x, y
+
+
+def _celulas_por_eixo(zoom):
+    return (2 ** zoom) * 256 // CELULA_PX
+
+
+def _celula(x, y, zoom):
+    n = _celulas_por_eixo(zoom)
+    return min(int(floor(x * n)), n - 1), min(int(floor(y * n)), n - 1)
+
+
+class Celula:
+    __slots__ = ("membros", "soma_lat", "soma_lng")
+
+    def __init__(self):
+        self.membros = {}   # veiculo_id -> timestamp (epoch) da última posição
+        self.soma_lat = 0.0
+        self.soma_lng = 0.0
+
+
+class PiramideFrota:
+    """Pirâmide de células de uma frota; todas as operações sob `_lock`."""
+
+    def __init__(self, clientes):
+        self.clientes = clientes
+        self.veiculos = {}   # veiculo_id -> (lat, lng, epoch, placa, x, y)
+        self.heartbeats = {}  # veiculo_id -> Veiculo.ultima_atualizacao na última carga
+        self.niveis = [dict() for _ in range(ZOOM_MAXIMO + 1)]
+        self.carregada_em = None
+        self.assinatura = None
+        self._lock = threading.Lock()
+
+    def _remover(self, veiculo_id):
+        atual = self.veiculos.pop(veiculo_id, None)
+        if atual is None:
+            return
+        lat, lng, _, _, x, y = atual
+        for zoom, nivel in enumerate(self.niveis):
+            chave = _celula(x, y, zoom)
+            celula = nivel[chave]
+            del celula.membros[veiculo_id]
+            if not celula.membros:
+                del nivel[chave]
+            else:
+                celula.soma_lat -= lat
+                celula.soma_lng -= lng
+
+    def _posicionar(self, veiculo_id, lat, lng, epoch, placa):
+        atual = self.veiculos.get(veiculo_id)
+        if atual is not None and epoch < atual[2]:
+            return  # fix fora de ordem
+        self._remover(veiculo_id)
+        x, y = _mercator(lat, lng)
+        self.veiculos[veiculo_id] = (lat, lng, epoch, placa, x, y)
+        for zoom, nivel in enumerate(self.niveis):
+            chave = _celula(x, y, zoom)
+            celula = nivel.get(chave)
+            if celula is None:
+                celula = nivel[chave] = Celula()
+            celula.membros[veiculo_id] = epoch
+            celula.soma_lat += lat
+            celula.soma_lng += lng
+
+    def carregar(self):
+        linhas = db.session.query(
+            VeiculoEstado.veiculo_id, Veiculo.placa, VeiculoEstado.latitude,
+            VeiculoEstado.longitude, VeiculoEstado.timestamp, Veiculo.ultima_atualizacao
+        ).join(Veiculo, Veiculo.id == VeiculoEstado.veiculo_id).filter(
+            Veiculo.cliente_id.in_(self.clientes), VeiculoEstado.timestamp.isnot(None)
+        ).all() if self.clientes else []
+        with self._lock:
+            self.veiculos = {}
+            self.heartbeats = {}
+            self.niveis = [dict() for _ in range(ZOOM_MAXIMO + 1)]
+            for veiculo_id, placa, lat, lng, ts, heartbeat in linhas:
+                ts = ts if ts.tzinfo else pytz.utc.localize(ts)
+                self._posicionar(veiculo_id, float(lat), float(lng), ts.timestamp(), placa)
+                self.heartbeats[veiculo_id] = heartbeat
+            self.carregada_em = time.monotonic()
+
+    def aplicar_pendentes(self):
+        """Move os veículos com posições novas publicadas desde a última consulta."""
+        mensagens = self.assinatura.aguardar(0)
+        if not mensagens:
+            return
+        with self._lock:
+            for m in mensagens:
+                self._posicionar(m["v"], m["la"], m["lo"], m["t"], m["p"])
+
+    def clusters(self, zoom, bbox=None, agora=None):
+        zoom = min(zoom, ZOOM_MAXIMO)
+        agora = agora or datetime.now(br_tz)
+        with self._lock:
+            nivel = self.niveis[zoom]
+            if bbox is None:
+                chaves = list(nivel)
+            else:
+                chaves = []
+                _, min_lat, _, max_lat = bbox
+                for lng0, lng1 in faixas_longitude(bbox):
+                    x0, y0 = _celula(*_mercator(max_lat, lng0), zoom)
+                    x1, y1 = _celula(*_mercator(min_lat, lng1), zoom)
+                    if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(nivel):
+                        chaves.extend(
+                            (cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1) if (cx, cy) in nivel
+                        )
+                    else:
+                        chaves.extend(k for k in nivel if x0 <= k[0] <= x1 and y0 <= k[1] <= y1)
+
+            resultado = []
+            for chave in chaves:
+                celula = nivel[chave]
+                total = len(celula.membros)
+                online = sum(
+                    1 for veiculo_id, ts in celula.membros.items()
+                    if presenca.online(veiculo_id, self.heartbeats.get(veiculo_id),
+                                       datetime.fromtimestamp(ts, pytz.utc), agora)
+                )
+                cluster = {
+                    "chave": f"{zoom}/{chave[0]}/{chave[1]}",
+                    "latitude": round(celula.soma_lat / total, 6),
+                    "longitude": round(celula.soma_lng / total, 6),
+                    "total": total,
+                    "online": online,
+                    "offline": total - online,
+                }
+                if total == 1:
+                    veiculo_id = next(iter(celula.membros))
+                    cluster["veiculo_id"] = veiculo_id
+                    cluster["placa"] = self.veiculos[veiculo_id][3]
+                resultado.append(cluster)
+        return resultado
+
+
+class CachePiramides:
+    """Pirâmides por frota (LRU), cada uma assinando o canal de posições."""
+
+    def __init__(self, capacidade=MAX_FROTAS):
+        self.capacidade = capacidade
+        self._frotas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, clientes):
+        chave = frozenset(clientes)
+        with self._lock:
+            piramide = self._frotas.get(chave)
+            if piramide is None:
+                piramide = self._frotas[chave] = PiramideFrota(chave)
+                # Assina antes de carregar: nada publicado durante a carga se perde
+                piramide.assinatura = tempo_real.posicoes.assinar(lambda m: m["c"] in chave, maximo=10000)
+            self._frotas.move_to_end(chave)
+            while len(self._frotas) > self.capacidade:
+                _, antiga = self._frotas.popitem(last=False)
+                tempo_real.posicoes.cancelar(antiga.assinatura)
+
+        # Fila da assinatura cheia: posições foram descartadas e só a carga as recupera
+        transbordou = piramide.assinatura.transbordou()
+        if transbordou or piramide.carregada_em is None or time.monotonic() - piramide.carregada_em > RECARGA_SEGUNDOS:
+            piramide.carregar()
+        piramide.aplicar_pendentes()
+        return piramide
+
+    def invalidar(self):
+        with self._lock:
+            for piramide in self._frotas.values():
+                piramide.carregada_em = None
+
+
+piramides = CachePiramides()
+
+
+@event.listens_for(Session, "after_flush")
+def _acompanhar_frota(session, flush_context):
+    # Veículo excluído ou transferido não passa pelo canal de posições
+    for obj in session.deleted:
+        if isinstance(obj, Veiculo):
+            session.info[_CHAVE_FROTA_ALTERADA] = True
+            return
+    for obj in session.dirty:
+        if isinstance(obj, Veiculo) and inspect(obj).attrs.cliente_id.history.has_changes():
+            session.info[_CHAVE_FROTA_ALTERADA] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _recarregar_frotas(session):
+    if session.info.pop(_CHAVE_FROTA_ALTERADA, False):
+        piramides.invalidar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_frota(session):
+    session.info.pop(_CHAVE_FROTA_ALTERADA, None)
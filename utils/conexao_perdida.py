@@ -0,0 +1,102 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+from database import db
+from models.evento import Evento
+from models.veiculo import Veiculo
+from models.veiculo_estado import SEM_CONEXAO, VeiculoEstado
+from utils.presenca import presenca
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Chave do advisory lock: com vários workers, só um varre por vez
+_CHAVE_LOCK = 7310001
+
+
+def varrer_conexoes_perdidas(timeout, agora=None):
+    """
+    Registra um evento CONEXAO para cada veículo sem atualização há `timeout`
+    segundos cujo último evento ainda não é CONEXAO (uma única vez por queda).
+    Retorna quantos eventos foram criados. Faz commit.
+    """
+    agora = agora or datetime.now(br_tz)
+    limite = agora - timedelta(seconds=timeout)
+    session = db.session
+
+    try:
+        if session.get_bind().dialect.name == "postgresql":
+            livre = session.execute(text("SELECT pg_try_advisory_xact_lock(:chave)"), {"chave": _CHAVE_LOCK}).scalar()
+            if not livre:
+                session.rollback()
+                return 0
+
+        # Índice parcial de "VeiculoEstado" (último fix, só quem não está com CONEXAO);
+        # Veiculo.ultima_atualizacao (heartbeats) só filtra os candidatos
+        candidatos = session.execute(
+            select(Veiculo).join(VeiculoEstado, VeiculoEstado.veiculo_id == Veiculo.id).where(
+                VeiculoEstado.ultima_atualizacao < limite,
+                text(f'({SEM_CONEXAO})'),
+                VeiculoEstado.timestamp.isnot(None),
+                Veiculo.ultima_atualizacao < limite
+            )
+        ).scalars().all()
+
+        # Heartbeats ainda só em memória neste processo
+        perdidos = [v for v in candidatos if presenca.ultima_atualizacao(v) < limite]
+        session.add_all([
+            Evento(
+                veiculo_id=v.id,
+                cliente_id=v.cliente_id,
+                tipo="CONEXAO",
+                descricao=f"Perda de conexão ({timeout // 60}+ min sem atualizações)",
+                timestamp=agora,
+                lido=False
+            )
+            for v in perdidos
+        ])
+        session.commit()
+        return len(perdidos)
+    except Exception:
+        session.rollback()
+        raise
+
+
+class VarreduraConexao:
+    """Thread que roda `varrer_conexoes_perdidas` a cada `intervalo` segundos."""
+
+    def __init__(self):
+        self.app = None
+        self.intervalo = None
+        self.timeout = None
+        self.execucoes = 0
+        self.eventos_criados = 0
+        self.ultimo_erro = None
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                with self.app.app_context():
+                    criados = varrer_conexoes_perdidas(self.timeout)
+                self.execucoes += 1
+                self.eventos_criados += criados
+                self.ultimo_erro = None
+                if criados:
+                    print(f"[CONEXAO] {criados} veículo(s) marcados com perda de conexão")
+            except Exception as e:
+                self.ultimo_erro = str(e)
+                print(f"[CONEXAO] Erro na varredura: {e}")
+
+    def iniciar(self, app):
+        """Inicia a varredura (uma vez por processo)."""
+        if self.app is not None:
+            return
+        self.app = app
+        self.intervalo = app.config["VARREDURA_CONEXAO_INTERVALO"]
+        self.timeout = app.config["CONEXAO_PERDIDA_TIMEOUT"]
+        threading.Thread(target=self._loop, name="varredura-conexao", daemon=True).start()
+
+
+varredura_conexao = VarreduraConexao()
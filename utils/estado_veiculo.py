@@ -0,0 +1,406 @@
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from sqlalchemy import case, delete, event, func, insert, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models.evento import Evento
+from models.localizacao import Localizacao
+from models.veiculo import Veiculo
+from models.veiculo_estado import VeiculoEstado
+from database import db
+from utils import sincronizacao, tempo_real
+from utils.cercas import TIPOS_EVENTO_CERCA
+import os
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Chave em session.info com os estados alterados na transação corrente
+_CHAVE_PENDENTES = "estado_veiculo_pendente"
+# Veículos cuja linha em "VeiculoEstado" deve ser gravada no commit
+_CHAVE_VIVO = "estado_vivo_pendente"
+# Eventos de veículos fora do cache (só o evento vai para "VeiculoEstado")
+_CHAVE_EVENTOS_AVULSOS = "estado_vivo_eventos"
+# Localizações gravadas na transação: placa -> (timestamp, id)
+_CHAVE_LOCALIZACOES = "estado_vivo_localizacoes"
+# Objetos Localizacao novos (o id só existe depois do flush)
+_CHAVE_LOCALIZACOES_ORM = "estado_vivo_localizacoes_orm"
+# veiculo_id -> cache_estado.marca() de quando o estado foi lido
+_CHAVE_MARCAS = "estado_veiculo_marcas"
+
+
+def _aware(ts):
+    if ts is None:
+        return None
+    if ts.tzinfo is None:
+        return pytz.utc.localize(ts).astimezone(br_tz)
+    return ts
+
+
+class EstadoVeiculo:
+    """Última posição e último evento conhecidos de um veículo."""
+
+    __slots__ = ("latitude", "longitude", "timestamp", "ultimo_evento_tipo", "ultimo_evento_ts")
+
+    def __init__(self, latitude=None, longitude=None, timestamp=None,
+                 ultimo_evento_tipo=None, ultimo_evento_ts=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = _aware(timestamp)
+        self.ultimo_evento_tipo = ultimo_evento_tipo
+        self.ultimo_evento_ts = _aware(ultimo_evento_ts)
+
+    def copia(self):
+        return EstadoVeiculo(self.latitude, self.longitude, self.timestamp,
+                             self.ultimo_evento_tipo, self.ultimo_evento_ts)
+
+    @property
+    def tem_posicao(self):
+        return self.timestamp is not None
+
+    def registrar_posicao(self, latitude, longitude, timestamp):
+        # Equivale a "ORDER BY timestamp DESC LIMIT 1": só avança se for mais recente
+        timestamp = _aware(timestamp)
+        if self.timestamp is None or timestamp >= self.timestamp:
+            self.latitude = latitude
+            self.longitude = longitude
+            self.timestamp = timestamp
+
+    def registrar_evento(self, tipo, timestamp):
+        timestamp = _aware(timestamp) or datetime.now(br_tz)
+        if self.ultimo_evento_ts is None or timestamp >= self.ultimo_evento_ts:
+            self.ultimo_evento_tipo = tipo
+            self.ultimo_evento_ts = timestamp
+
+
+class EstadoVeiculoCache:
+    """
+    Cache LRU, local ao processo, do estado de cada veículo (chave: veiculo_id).
+    Só recebe estados já confirmados no banco (ver listeners de commit abaixo).
+
+    Workers do gunicorn, tracker_server e writer assíncrono ingerem os mesmos
+    veículos: cada gravação em "VeiculoEstado" publica (veículo, versão) no canal
+    `estados` e os outros processos descartam a entrada com versão diferente.
+    Sem o LISTEN conectado essas mensagens não chegam, então o cache não é usado
+    (tudo vem do banco) e é esvaziado a cada reconexão.
+    """
+
+    def __init__(self, capacidade):
+        self.capacidade = capacidade
+        self._dados = OrderedDict()
+        # Invalidações recebidas (geral, por veículo): um estado lido antes de uma
+        # invalidação não entra no cache, mesmo que o commit dele chegue depois
+        self._geral = 0
+        self._geracoes = {}
+        # Versões gravadas por este processo: a mensagem delas não invalida nada
+        self._proprias = OrderedDict()
+        self._lock = Lock()
+
+    def registrar_versao_propria(self, versao):
+        with self._lock:
+            self._proprias[versao] = True
+            while len(self._proprias) > 1000:
+                self._proprias.popitem(last=False)
+
+    def marca(self, veiculo_id):
+        with self._lock:
+            return self._geral, self._geracoes.get(veiculo_id, 0)
+
+    def obter(self, veiculo_id):
+        if not tempo_real.listen_ativo():
+            return None
+        with self._lock:
+            estado = self._dados.get(veiculo_id)
+            if estado is None:
+                return None
+            self._dados.move_to_end(veiculo_id)
+            return estado.copia()
+
+    def guardar(self, veiculo_id, estado, marca=None):
+        with self._lock:
+            if marca is not None and marca != (self._geral, self._geracoes.get(veiculo_id, 0)):
+                self._dados.pop(veiculo_id, None)
+                return
+            self._dados[veiculo_id] = estado.copia()
+            self._dados.move_to_end(veiculo_id)
+            while len(self._dados) > self.capacidade:
+                self._dados.popitem(last=False)
+
+    def invalidar(self, veiculo_id=None, exceto_versao=None):
+        """Descarta a entrada (ou todas); `exceto_versao` gravada por este processo não descarta."""
+        with self._lock:
+            if veiculo_id is None:
+                self._dados.clear()
+                self._geral += 1
+                return
+            if exceto_versao is not None and exceto_versao in self._proprias:
+                return
+            self._dados.pop(veiculo_id, None)
+            self._geracoes[veiculo_id] = self._geracoes.get(veiculo_id, 0) + 1
+
+    def __len__(self):
+        return len(self._dados)
+
+
+cache_estado = EstadoVeiculoCache(int(os.getenv("CACHE_ESTADO_VEICULOS", "5000")))
+
+# Gravações em "VeiculoEstado" (v=veículo ou None para todos, n=versão); as do
+# próprio processo também chegam aqui e são ignoradas pela versão
+estados = tempo_real.Canal("findway_estado_veiculo")
+tempo_real.canais[estados.nome] = estados
+estados.ouvir(lambda m: cache_estado.invalidar(m["v"], m.get("n")))
+tempo_real.ao_conectar(cache_estado.invalidar)
+
+
+def _carregar_do_banco(veiculo):
+    vivo = db.session.get(VeiculoEstado, veiculo.id, populate_existing=True)
+    if vivo is not None and vivo.timestamp is not None:
+        return EstadoVeiculo(vivo.latitude, vivo.longitude, vivo.timestamp,
+                             vivo.ultimo_evento_tipo, vivo.ultimo_evento_ts)
+
+    # Sem linha em "VeiculoEstado" (ainda não reconstruída): busca no histórico
+    last_loc = Localizacao.query.filter_by(placa=veiculo.placa)\
+        .order_by(Localizacao.timestamp.desc()).first()
+    last_event = Evento.query.filter_by(veiculo_id=veiculo.id)\
+        .filter(Evento.tipo.notin_(TIPOS_EVENTO_CERCA))\
+        .order_by(Evento.timestamp.desc()).first()
+
+    estado = EstadoVeiculo()
+    if last_loc:
+        estado.registrar_posicao(last_loc.latitude, last_loc.longitude, last_loc.timestamp)
+    if last_event:
+        estado.registrar_evento(last_event.tipo, last_event.timestamp)
+    return estado
+
+
+def obter_estado(veiculo, session=None):
+    """
+    Retorna o estado do veículo para ser alterado na transação corrente.
+
+    Ordem de busca: estado já alterado nesta transação, cache do processo (se
+    coerente com os outros processos, ver EstadoVeiculoCache) e, em caso de
+    miss, o banco. As alterações só vão para o cache após o commit.
+    """
+    session = session or db.session
+    pendentes = session.info.setdefault(_CHAVE_PENDENTES, {})
+    estado = pendentes.get(veiculo.id)
+    if estado is None:
+        session.info.setdefault(_CHAVE_MARCAS, {})[veiculo.id] = cache_estado.marca(veiculo.id)
+        estado = cache_estado.obter(veiculo.id) or _carregar_do_banco(veiculo)
+        pendentes[veiculo.id] = estado
+    return estado
+
+
+def definir_estado(veiculo, estado, session=None):
+    """Substitui o estado do veículo na transação corrente (ex.: reprocessamento de histórico)."""
+    session = session or db.session
+    session.info.setdefault(_CHAVE_MARCAS, {}).setdefault(veiculo.id, cache_estado.marca(veiculo.id))
+    session.info.setdefault(_CHAVE_PENDENTES, {})[veiculo.id] = estado
+    return estado
+
+
+def marcar_estado_vivo(veiculo, session=None):
+    """Agenda a gravação da linha de "VeiculoEstado" do veículo no commit desta transação."""
+    session = session or db.session
+    session.info.setdefault(_CHAVE_VIVO, {})[veiculo.id] = veiculo
+
+
+def registrar_localizacoes_gravadas(linhas, session=None):
+    """Informa (placa, id, timestamp) de localizações inseridas sem ORM (INSERT em massa)."""
+    session = session or db.session
+    gravadas = session.info.setdefault(_CHAVE_LOCALIZACOES, {})
+    for placa, id_, timestamp in linhas:
+        timestamp = _aware(timestamp)
+        atual = gravadas.get(placa)
+        if atual is None or timestamp >= atual[0]:
+            gravadas[placa] = (timestamp, id_)
+
+
+def _upsert_estado_vivo(session, linhas):
+    dialeto = session.get_bind().dialect.name
+    insert_dialeto = postgresql.insert if dialeto == "postgresql" else sqlite.insert
+    stmt = insert_dialeto(VeiculoEstado).values(linhas)
+    novo, atual = stmt.excluded, VeiculoEstado.__table__.c
+
+    def mais_recente(col_ts, col):
+        # Outro processo (ou um reprocessamento de histórico) pode ter gravado algo mais novo
+        return case(
+            (atual[col_ts].is_(None) | (novo[col_ts] >= atual[col_ts]), novo[col]),
+            else_=atual[col]
+        )
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[atual.veiculo_id],
+        set_={
+            "latitude": mais_recente("timestamp", "latitude"),
+            "longitude": mais_recente("timestamp", "longitude"),
+            "localizacao_id": mais_recente("timestamp", "localizacao_id"),
+            "timestamp": mais_recente("timestamp", "timestamp"),
+            "ultimo_evento_tipo": mais_recente("ultimo_evento_ts", "ultimo_evento_tipo"),
+            "ultimo_evento_ts": mais_recente("ultimo_evento_ts", "ultimo_evento_ts"),
+            "status_ignicao": func.coalesce(novo.status_ignicao, atual.status_ignicao),
+            "ultima_atualizacao": mais_recente("ultima_atualizacao", "ultima_atualizacao"),
+            "versao": novo.versao,
+        }
+    )
+    session.execute(stmt)
+
+
+@event.listens_for(Session, "before_flush")
+def _acompanhar_novos_eventos(session, flush_context, instances):
+    # Eventos criados fora do process_vehicle_events (comandos, CONEXAO, POST /eventos)
+    # também mudam o "último evento" do veículo
+    pendentes = session.info.setdefault(_CHAVE_PENDENTES, {})
+    for obj in session.new:
+        if isinstance(obj, Localizacao):
+            session.info.setdefault(_CHAVE_LOCALIZACOES_ORM, []).append(obj)
+            continue
+        # Entrada/saída de cerca não muda o "último evento" da máquina de Movimento/Parada
+        if not isinstance(obj, Evento) or not obj.veiculo_id or obj.tipo in TIPOS_EVENTO_CERCA:
+            continue
+        session.info.setdefault(_CHAVE_VIVO, {}).setdefault(obj.veiculo_id, None)
+        estado = pendentes.get(obj.veiculo_id)
+        if estado is None:
+            marca = cache_estado.marca(obj.veiculo_id)
+            estado = cache_estado.obter(obj.veiculo_id)
+            if estado is None:
+                # Fora do cache: será carregado do banco quando for necessário;
+                # em "VeiculoEstado" grava só o evento
+                session.info.setdefault(_CHAVE_EVENTOS_AVULSOS, {})[obj.veiculo_id] = obj
+                continue
+            session.info.setdefault(_CHAVE_MARCAS, {})[obj.veiculo_id] = marca
+            pendentes[obj.veiculo_id] = estado
+        estado.registrar_evento(obj.tipo, obj.timestamp)
+
+
+@event.listens_for(Session, "before_commit")
+def _gravar_estado_vivo(session):
+    if not session.info.get(_CHAVE_VIVO) and not any(isinstance(obj, Evento) for obj in session.new):
+        return
+    # Garante ids das localizações/eventos ainda não enviados ao banco
+    session.flush()
+    if not session.info.get(_CHAVE_VIVO):
+        return
+
+    registrar_localizacoes_gravadas(
+        [(obj.placa, obj.id, obj.timestamp) for obj in session.info.pop(_CHAVE_LOCALIZACOES_ORM, [])],
+        session
+    )
+    marcados = session.info.pop(_CHAVE_VIVO, {})
+    eventos_avulsos = session.info.pop(_CHAVE_EVENTOS_AVULSOS, {})
+    gravadas = session.info.pop(_CHAVE_LOCALIZACOES, {})
+
+    pendentes = session.info.get(_CHAVE_PENDENTES, {})
+    agora = datetime.now(br_tz)
+    versao = sincronizacao.versao_da_transacao(session)
+    cache_estado.registrar_versao_propria(versao)
+    linhas = []
+    for veiculo_id, veiculo in marcados.items():
+        linha = dict.fromkeys(
+            ("localizacao_id", "latitude", "longitude", "timestamp", "status_ignicao",
+             "ultimo_evento_tipo", "ultimo_evento_ts", "ultima_atualizacao")
+        )
+        linha["veiculo_id"] = veiculo_id
+        linha["versao"] = versao
+        estado = pendentes.get(veiculo_id)
+        if estado is not None:
+            linha.update(
+                latitude=estado.latitude, longitude=estado.longitude, timestamp=estado.timestamp,
+                ultimo_evento_tipo=estado.ultimo_evento_tipo, ultimo_evento_ts=estado.ultimo_evento_ts
+            )
+        elif veiculo_id in eventos_avulsos:
+            evento_novo = eventos_avulsos[veiculo_id]
+            linha.update(ultimo_evento_tipo=evento_novo.tipo, ultimo_evento_ts=_aware(evento_novo.timestamp))
+        if veiculo is not None:
+            # Marcado pela ingestão: houve fix agora
+            linha.update(status_ignicao=veiculo.status_ignicao, ultima_atualizacao=agora)
+            gravada = gravadas.get(veiculo.placa)
+            if gravada is not None and estado is not None and gravada[0] == estado.timestamp:
+                linha["localizacao_id"] = gravada[1]
+        linhas.append(linha)
+
+    if linhas:
+        _upsert_estado_vivo(session, sorted(linhas, key=lambda l: l["veiculo_id"]))
+        tempo_real.publicar_no_commit(estados, [{"v": linha["veiculo_id"], "n": versao} for linha in linhas], session)
+        # Delta compacto para GET /localizacao/stream: v=veículo, c=cliente, p=placa, la/lo, t=epoch
+        tempo_real.publicar_no_commit(tempo_real.posicoes, [
+            {
+                "v": linha["veiculo_id"],
+                "c": marcados[linha["veiculo_id"]].cliente_id,
+                "p": marcados[linha["veiculo_id"]].placa,
+                "la": float(linha["latitude"]),
+                "lo": float(linha["longitude"]),
+                "t": int(linha["timestamp"].timestamp()),
+            }
+            for linha in linhas
+            if marcados[linha["veiculo_id"]] is not None and linha["timestamp"] is not None
+        ], session)
+
+
+def reconstruir_estado_vivo(veiculo_ids=None, session=None):
+    """
+    Recalcula "VeiculoEstado" a partir do histórico (última localização e último
+    evento de cada veículo). Sem `veiculo_ids`, reconstrói a frota inteira.
+    Não faz commit.
+    """
+    session = session or db.session
+    v = Veiculo.__table__
+    loc = Localizacao.__table__
+    ev = Evento.__table__
+
+    # Subconsultas correlacionadas por veículo (usam os índices por placa/veículo)
+    l2, e2 = loc.alias(), ev.alias()
+    ultima_loc = select(l2.c.id).where(l2.c.placa == v.c.placa)\
+        .order_by(l2.c.timestamp.desc(), l2.c.id.desc()).limit(1).correlate(v).scalar_subquery()
+    ultimo_evento = select(e2.c.id).where(e2.c.veiculo_id == v.c.id, e2.c.tipo.notin_(TIPOS_EVENTO_CERCA))\
+        .order_by(e2.c.timestamp.desc(), e2.c.id.desc()).limit(1).correlate(v).scalar_subquery()
+
+    origem = select(
+        v.c.id, loc.c.id, loc.c.latitude, loc.c.longitude, loc.c.timestamp,
+        v.c.status_ignicao, ev.c.tipo, ev.c.timestamp, v.c.ultima_atualizacao,
+        literal(sincronizacao.versao_da_transacao(session), VeiculoEstado.versao.type)
+    ).select_from(
+        v.outerjoin(loc, loc.c.id == ultima_loc).outerjoin(ev, ev.c.id == ultimo_evento)
+    )
+    apagar = delete(VeiculoEstado)
+    if veiculo_ids is not None:
+        veiculo_ids = list(veiculo_ids)
+        origem = origem.where(v.c.id.in_(veiculo_ids))
+        apagar = apagar.where(VeiculoEstado.veiculo_id.in_(veiculo_ids))
+
+    session.execute(apagar)
+    resultado = session.execute(insert(VeiculoEstado).from_select(
+        ["veiculo_id", "localizacao_id", "latitude", "longitude", "timestamp",
+         "status_ignicao", "ultimo_evento_tipo", "ultimo_evento_ts", "ultima_atualizacao", "versao"],
+        origem
+    ))
+    # O estado em memória pode ter ficado para trás (ex.: localizações apagadas),
+    # aqui e nos outros processos
+    if veiculo_ids is None:
+        cache_estado.invalidar()
+        tempo_real.publicar_no_commit(estados, [{"v": None}], session)
+    else:
+        for veiculo_id in veiculo_ids:
+            cache_estado.invalidar(veiculo_id)
+        tempo_real.publicar_no_commit(estados, [{"v": veiculo_id} for veiculo_id in veiculo_ids], session)
+    return resultado.rowcount
+
+
+@event.listens_for(Session, "after_commit")
+def _confirmar_pendentes(session):
+    for chave in (_CHAVE_VIVO, _CHAVE_EVENTOS_AVULSOS, _CHAVE_LOCALIZACOES, _CHAVE_LOCALIZACOES_ORM):
+        session.info.pop(chave, None)
+    marcas = session.info.pop(_CHAVE_MARCAS, None) or {}
+    pendentes = session.info.pop(_CHAVE_PENDENTES, None)
+    if pendentes:
+        for veiculo_id, estado in pendentes.items():
+            if veiculo_id in marcas:
+                cache_estado.guardar(veiculo_id, estado, marcas[veiculo_id])
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_pendentes(session):
+    for chave in (_CHAVE_PENDENTES, _CHAVE_VIVO, _CHAVE_EVENTOS_AVULSOS,
+                  _CHAVE_LOCALIZACOES, _CHAVE_LOCALIZACOES_ORM, _CHAVE_MARCAS):
+        session.info.pop(chave, None)
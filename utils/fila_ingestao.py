@@ -0,0 +1,303 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from sqlalchemy import text
+from utils.ingestao import processar_lote, normalizar_fix
+from utils.reordenacao import BufferReordenacao
+from database import db
+
+# Fila local e durável (SQLite em modo WAL) para a ingestão assíncrona de localizações.
+# Os handlers HTTP só validam e enfileiram; o writer drena em micro-lotes e grava no Postgres.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fila (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    enfileirado_em REAL NOT NULL,
+    reservado_por TEXT,
+    reservado_em REAL
+);
+CREATE TABLE IF NOT EXISTS fila_erros (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    erro TEXT,
+    registrado_em REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fila_reserva ON fila (reservado_por, id);
+"""
+
+# Reserva de um lote expira se o processo que a fez morrer no meio do flush
+RESERVA_EXPIRA_SEGUNDOS = 120
+
+
+class FilaIngestao:
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        conn = self._conexao()
+        conn.executescript(_SCHEMA)
+
+    def _conexao(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def enfileirar(self, itens):
+        """Grava os itens na fila (um commit/fsync por chamada)."""
+        agora = time.time()
+        conn = self._conexao()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO fila (payload, enfileirado_em) VALUES (?, ?)",
+                [(json.dumps(item, default=str), agora) for item in itens]
+            )
+
+    def reservar(self, dono, limite):
+        """Reserva até `limite` itens mais antigos para o writer `dono`."""
+        conn = self._conexao()
+        expirado = time.time() - RESERVA_EXPIRA_SEGUNDOS
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            linhas = conn.execute(
+                "SELECT id, payload FROM fila "
+                "WHERE reservado_por IS NULL OR reservado_em < ? "
+                "ORDER BY id LIMIT ?",
+                (expirado, limite)
+            ).fetchall()
+            if linhas:
+                conn.executemany(
+                    "UPDATE fila SET reservado_por = ?, reservado_em = ? WHERE id = ?",
+                    [(dono, time.time(), id_) for id_, _ in linhas]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(id_, json.loads(payload)) for id_, payload in linhas]
+
+    def renovar(self, dono, ids):
+        """Renova a reserva de itens que o writer `dono` ainda segura em memória."""
+        conn = self._conexao()
+        agora = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE fila SET reservado_em = ? WHERE id = ? AND reservado_por = ?",
+                [(agora, i, dono) for i in ids]
+            )
+
+    def confirmar(self, ids):
+        conn = self._conexao()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("DELETE FROM fila WHERE id = ?", [(i,) for i in ids])
+
+    def liberar(self, ids):
+        conn = self._conexao()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE fila SET reservado_por = NULL, reservado_em = NULL WHERE id = ?",
+                [(i,) for i in ids]
+            )
+
+    def descartar(self, itens_com_erro):
+        """Move itens que falham isoladamente para fila_erros (dead letter)."""
+        conn = self._conexao()
+        agora = time.time()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO fila_erros (id, payload, erro, registrado_em) VALUES (?, ?, ?, ?)",
+                [(id_, json.dumps(item, default=str), erro, agora) for id_, item, erro in itens_com_erro]
+            )
+            conn.executemany("DELETE FROM fila WHERE id = ?", [(id_,) for id_, _, _ in itens_com_erro])
+
+    def profundidade(self):
+        conn = self._conexao()
+        total, mais_antigo = conn.execute("SELECT COUNT(*), MIN(enfileirado_em) FROM fila").fetchone()
+        erros = conn.execute("SELECT COUNT(*) FROM fila_erros").fetchone()[0]
+        idade = round(time.time() - mais_antigo, 3) if mais_antigo else 0.0
+        return total, idade, erros
+
+
+class WriterIngestao(threading.Thread):
+    """
+    Drena a fila em micro-lotes: dispara quando há `tamanho_lote` itens
+    ou quando `intervalo` segundos se passaram desde o último flush.
+    """
+
+    def __init__(self, app, fila, tamanho_lote, intervalo, janela_reordenacao=0, max_por_veiculo=100):
+        super().__init__(name="writer-ingestao", daemon=True)
+        self.app = app
+        self.fila = fila
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        # Itens segurados no buffer continuam reservados na fila durável (a reserva
+        # é renovada a cada flush), então nada se perde num restart
+        self.buffer = BufferReordenacao(janela_reordenacao, max_por_veiculo)
+        self.dono = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=100)
+        self.itens_gravados = 0
+        self.itens_rejeitados = 0
+        self.itens_duplicados = 0
+        self.lotes = 0
+        self.falhas = 0
+        self.ultimo_erro = None
+        self.ultimo_flush = None
+
+    def run(self):
+        espera = self.intervalo
+        while True:
+            time.sleep(espera)
+            try:
+                processados = self.flush()
+                # Se o lote veio cheio ainda há fila acumulada: drena sem esperar
+                espera = 0 if processados >= self.tamanho_lote else self.intervalo
+            except Exception as e:
+                self.falhas += 1
+                self.ultimo_erro = str(e)
+                print(f"[INGESTAO] Erro no writer: {e}")
+                # Banco indisponível: recua para não martelar o Postgres
+                espera = min(max(espera * 2, self.intervalo), 30)
+
+    def flush(self):
+        # O buffer pode segurar um item por mais que RESERVA_EXPIRA_SEGUNDOS (banco
+        # fora do ar, timestamps fora de ordem): sem renovar, ele seria reservado de
+        # novo e confirmado como duplicata com a única cópia só em memória
+        retidos = {id_ for id_, _ in self.buffer.dados()}
+        if retidos:
+            self.fila.renovar(self.dono, retidos)
+        reservados = [(id_, item) for id_, item in self.fila.reservar(self.dono, self.tamanho_lote)
+                      if id_ not in retidos]
+
+        # Itens inválidos vão direto para o dead letter; duplicatas exatas são
+        # confirmadas na hora; o resto espera a janela de reordenação no buffer
+        invalidos, duplicados = [], []
+        for id_, item in reservados:
+            fix, erro = normalizar_fix(item)
+            if erro:
+                invalidos.append((id_, item, erro))
+            elif not self.buffer.adicionar(fix, dado=(id_, item)):
+                duplicados.append(id_)
+        if invalidos:
+            self.fila.descartar(invalidos)
+        if duplicados:
+            self.fila.confirmar(duplicados)
+        if invalidos or duplicados:
+            with self._lock:
+                self.itens_rejeitados += len(invalidos)
+                self.itens_duplicados += len(duplicados)
+
+        prontos = self.buffer.liberar()
+        if not prontos:
+            return len(reservados)
+
+        ids = [id_ for _, (id_, _) in prontos]
+        inicio = time.perf_counter()
+        with self.app.app_context():
+            try:
+                resultados = processar_lote([fix for fix, _ in prontos])
+            except Exception as e:
+                print(f"[INGESTAO] Lote falhou, isolando itens: {e}")
+                resultados = self._processar_isolado(prontos)
+                if resultados is None:
+                    # Voltam para a fila e, ao serem reservados de novo, não podem contar como duplicata
+                    self.buffer.esquecer([fix for fix, _ in prontos])
+                    self.fila.liberar(ids)
+                    raise
+
+        rejeitados = [
+            (id_, item, r.get("error"))
+            for (_, (id_, item)), r in zip(prontos, resultados) if r["status"] == "erro"
+        ]
+        if rejeitados:
+            self.fila.descartar(rejeitados)
+        self.fila.confirmar(ids)
+
+        with self._lock:
+            self._latencias.append(time.perf_counter() - inicio)
+            self.itens_gravados += sum(1 for r in resultados if r["status"] == "ok")
+            self.itens_duplicados += sum(1 for r in resultados if r["status"] == "duplicado")
+            self.itens_rejeitados += len(rejeitados)
+            self.lotes += 1
+            self.ultimo_flush = time.time()
+        return len(reservados)
+
+    def _processar_isolado(self, prontos):
+        # Um item "envenenado" não pode travar a fila: tenta um a um.
+        # Se o próprio banco estiver fora, o lote volta inteiro para a fila.
+        try:
+            db.session.execute(text("SELECT 1"))
+            db.session.rollback()
+        except Exception:
+            db.session.rollback()
+            return None
+
+        resultados = []
+        for fix, _ in prontos:
+            try:
+                resultados.append(processar_lote([fix])[0])
+            except Exception as e:
+                resultados.append({"status": "erro", "error": str(e)})
+        return resultados
+
+    def metricas(self):
+        profundidade, idade, erros = self.fila.profundidade()
+        with self._lock:
+            latencias = list(self._latencias)
+            return {
+                "profundidade_fila": profundidade,
+                "idade_item_mais_antigo_s": idade,
+                "itens_descartados_total": erros,
+                "itens_gravados": self.itens_gravados,
+                "itens_rejeitados": self.itens_rejeitados,
+                "itens_duplicados": self.itens_duplicados,
+                "itens_no_buffer_reordenacao": len(self.buffer),
+                "lotes": self.lotes,
+                "falhas": self.falhas,
+                "ultimo_erro": self.ultimo_erro,
+                "ultimo_flush": self.ultimo_flush,
+                "flush_latencia_ultima_ms": round(latencias[-1] * 1000, 2) if latencias else None,
+                "flush_latencia_media_ms": round(sum(latencias) / len(latencias) * 1000, 2) if latencias else None,
+                "flush_latencia_max_ms": round(max(latencias) * 1000, 2) if latencias else None,
+                "tamanho_lote": self.tamanho_lote,
+                "intervalo_s": self.intervalo,
+                "janela_reordenacao_s": self.buffer.janela,
+            }
+
+
+fila = None
+writer = None
+
+
+def iniciar_ingestao_assincrona(app):
+    """Abre a fila local e inicia o writer em background (uma vez por processo)."""
+    global fila, writer
+    if writer is not None:
+        return writer
+    fila = FilaIngestao(app.config["FILA_INGESTAO_ARQUIVO"])
+    writer = WriterIngestao(
+        app, fila,
+        tamanho_lote=app.config["FILA_INGESTAO_LOTE"],
+        intervalo=app.config["FILA_INGESTAO_INTERVALO"],
+        janela_reordenacao=app.config["JANELA_REORDENACAO_S"],
+        max_por_veiculo=app.config["REORDENACAO_MAX_POR_VEICULO"]
+    )
+    writer.start()
+    print(f"[INGESTAO] Modo assíncrono ativo (fila: {fila.caminho})")
+    return writer
+
+
+def ingestao_assincrona_ativa():
+    return writer is not None
@@ -0,0 +1,179 @@
+from datetime import datetime
+from math import cos, pi, radians
+from sqlalchemy import and_, func, or_
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlalchemy.orm import joinedload
+from database import db
+from models.administrador import Administrador
+from models.cliente import Cliente
+from models.localizacao import Localizacao
+from models.veiculo import Veiculo
+from models.veiculo_estado import VeiculoEstado
+from utils.geo import RAIO_TERRA_M, celulas_geohash, haversine
+from utils.presenca import presenca
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+
+def status_frota(*filtros):
+    """
+    Veículos, dono e status do GPS em uma única consulta (qualquer tamanho de frota).
+
+    A última posição vem de "VeiculoEstado" (uma linha por veículo) e o cliente
+    vem por JOIN, então não há consulta por veículo. `filtros` são critérios
+    sobre Veiculo (ex.: Veiculo.cliente_id == 1). Retorna [(veiculo, status_gps)].
+    """
+    linhas = db.session.query(Veiculo, VeiculoEstado.timestamp).outerjoin(
+        VeiculoEstado, VeiculoEstado.veiculo_id == Veiculo.id
+    ).options(
+        joinedload(Veiculo.cliente)
+    ).filter(*filtros).order_by(Veiculo.id).all()
+
+    agora = datetime.now(br_tz)
+    return [(v, presenca.status_gps(v, ts, agora)) for v, ts in linhas]
+
+
+def do_administrador(admin_id):
+    """Filtro para status_frota: veículos dos clientes de um administrador."""
+    return Veiculo.cliente_id.in_(
+        db.session.query(Cliente.id).filter(Cliente.administrador_id == admin_id)
+    )
+
+
+def clientes_do_usuario(email):
+    """
+    Ids dos clientes visíveis para o usuário logado: o próprio cliente ou os
+    clientes de um administrador. None se o e-mail não for de nenhum dos dois.
+    """
+    if not email:
+        return None
+    admin = Administrador.query.filter_by(email=email).first()
+    if admin:
+        return {id_ for (id_,) in db.session.query(Cliente.id).filter(Cliente.administrador_id == admin.id)}
+    cliente = Cliente.query.filter_by(email=email).first()
+    if cliente:
+        return {cliente.id}
+    return None
+
+
+def ler_bbox(texto):
+    """
+    "minLng,minLat,maxLng,maxLat" (formato do Google Maps/GeoJSON) -> tupla de floats.
+    minLng > maxLng é aceito (área que cruza o antimeridiano). Lança ValueError se inválido.
+    """
+    partes = [float(p) for p in str(texto).split(",")]
+    if len(partes) != 4:
+        raise ValueError("bbox deve ter 4 valores")
+    min_lng, min_lat, max_lng, max_lat = partes
+    if not (-90 <= min_lat <= max_lat <= 90) or not all(-180 <= v <= 180 for v in (min_lng, max_lng)):
+        raise ValueError("bbox fora dos limites")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def faixas_longitude(bbox):
+    min_lng, _, max_lng, _ = bbox
+    if min_lng <= max_lng:
+        return [(min_lng, max_lng)]
+    return [(min_lng, 180.0), (-180.0, max_lng)]
+
+
+def _ponto_estado():
+    # Mesma expressão do índice GiST ix_VeiculoEstado_posicao
+    return func.point(
+        VeiculoEstado.longitude.cast(DOUBLE_PRECISION), VeiculoEstado.latitude.cast(DOUBLE_PRECISION)
+    )
+
+
+def dentro_da_area(bbox):
+    """Filtro sobre "VeiculoEstado": última posição dentro do retângulo."""
+    _, min_lat, _, max_lat = bbox
+    if db.session.get_bind().dialect.name == "postgresql":
+        ponto = _ponto_estado()
+        return or_(*[
+            ponto.op("<@")(func.box(func.point(lng0, min_lat), func.point(lng1, max_lat)))
+            for lng0, lng1 in faixas_longitude(bbox)
+        ])
+    return and_(
+        VeiculoEstado.latitude.between(min_lat, max_lat),
+        or_(*[VeiculoEstado.longitude.between(lng0, lng1) for lng0, lng1 in faixas_longitude(bbox)])
+    )
+
+
+def historico_na_area(bbox):
+    """
+    Filtro sobre "Localizacao": pontos dentro do retângulo. As células geohash
+    que cobrem a área viram faixas do índice (geohash, timestamp); a comparação
+    de latitude/longitude descarta o que está nas células mas fora da área.
+    """
+    min_lng, min_lat, max_lng, max_lat = bbox
+    faixas = [
+        Localizacao.geohash.between(prefixo, prefixo.ljust(12, "z"))
+        for lng0, lng1 in faixas_longitude(bbox)
+        for prefixo in celulas_geohash(min_lat, lng0, max_lat, lng1)
+    ]
+    return and_(
+        or_(*faixas),
+        Localizacao.latitude.between(min_lat, max_lat),
+        or_(*[Localizacao.longitude.between(lng0, lng1) for lng0, lng1 in faixas_longitude(bbox)])
+    )
+
+
+def ponto_na_area(bbox, latitude, longitude):
+    _, min_lat, _, max_lat = bbox
+    latitude, longitude = float(latitude), float(longitude)
+    return min_lat <= latitude <= max_lat and any(
+        lng0 <= longitude <= lng1 for lng0, lng1 in faixas_longitude(bbox)
+    )
+
+
+def _area_do_raio(latitude, longitude, raio_m):
+    """Retângulo (formato de ler_bbox) que contém o círculo; None se der a volta no globo."""
+    # 1% de folga para arredondamentos: a busca por retângulo só pode sobrar, nunca faltar
+    dlat = raio_m * 1.01 / (RAIO_TERRA_M * pi / 180.0)
+    lat_extrema = min(abs(latitude) + dlat, 90.0)
+    if lat_extrema >= 89.0:
+        return None
+    dlng = dlat / cos(radians(lat_extrema))
+    if dlng >= 180.0:
+        return None
+    min_lng = (longitude - dlng + 180.0) % 360.0 - 180.0
+    max_lng = (longitude + dlng + 180.0) % 360.0 - 180.0
+    return min_lng, max(latitude - dlat, -90.0), max_lng, min(latitude + dlat, 90.0)
+
+
+def mais_proximos(clientes, latitude, longitude, k):
+    """
+    Os k veículos dos `clientes` cuja última posição está mais perto do ponto.
+    Retorna [(estado, veiculo, distancia_m)] em ordem de distância.
+
+    No PostgreSQL a primeira busca é k-NN pelo índice GiST (`<->`, distância em
+    graus). Graus de longitude encolhem com a latitude, então essa ordem é só
+    aproximada: o k-ésimo candidato dá um raio em metros e uma segunda busca por
+    retângulo (mesmo índice) traz todos os veículos dentro dele, reordenados por
+    haversine. O resultado é exato e as duas consultas leem poucas linhas.
+    """
+    if not clientes:
+        return []
+    consulta = db.session.query(VeiculoEstado, Veiculo).join(
+        Veiculo, VeiculoEstado.veiculo_id == Veiculo.id
+    ).filter(Veiculo.cliente_id.in_(clientes), VeiculoEstado.timestamp.isnot(None))
+
+    if db.session.get_bind().dialect.name == "postgresql":
+        ordem = _ponto_estado().op("<->")(func.point(longitude, latitude))
+    else:
+        ordem = (VeiculoEstado.latitude - latitude) * (VeiculoEstado.latitude - latitude) + \
+            (VeiculoEstado.longitude - longitude) * (VeiculoEstado.longitude - longitude)
+    candidatos = consulta.order_by(ordem).limit(k).all()
+
+    if len(candidatos) == k:
+        raio = max(haversine(latitude, longitude, e.latitude, e.longitude) for e, _ in candidatos)
+        area = _area_do_raio(latitude, longitude, raio)
+        candidatos = (consulta.filter(dentro_da_area(area)) if area else consulta).all()
+
+    com_distancia = [
+        (estado, veiculo, haversine(latitude, longitude, estado.latitude, estado.longitude))
+        for estado, veiculo in candidatos
+    ]
+    com_distancia.sort(key=lambda linha: linha[2])
+    return com_distancia[:k]
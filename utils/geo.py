@@ -0,0 +1,286 @@
+from math import radians, cos, sin, asin, sqrt, atan2, degrees
+import numpy as np
+
+# Funções geodésicas usadas na ingestão (par único) e no histórico/relatórios
+# (vetorizadas com NumPy sobre trajetos inteiros). Distâncias em metros.
+
+RAIO_TERRA_M = 6371000.0
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Distância em metros entre dois pontos (graus decimais).
+    Caminho rápido para um único par: aceita Decimal (colunas Numeric) e
+    converte para float antes de usar `math`.
+    """
+    lat1, lon1, lat2, lon2 = radians(float(lat1)), radians(float(lon1)), radians(float(lat2)), radians(float(lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    return 2 * asin(sqrt(a)) * RAIO_TERRA_M
+
+
+def rumo(lat1, lon1, lat2, lon2):
+    """Rumo inicial (0-360°, 0 = norte) de um ponto para outro."""
+    lat1, lon1, lat2, lon2 = radians(float(lat1)), radians(float(lon1)), radians(float(lat2)), radians(float(lon2))
+    dlon = lon2 - lon1
+    x = sin(dlon) * cos(lat2)
+    y = cos(lat1) * sin(lat2) - sin(lat1) * cos(lat2) * cos(dlon)
+    return (degrees(atan2(x, y)) + 360.0) % 360.0
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Versão vetorizada de `haversine`: aceita arrays (ou escalares) com broadcast."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) * RAIO_TERRA_M
+
+
+def rumo_np(lat1, lon1, lat2, lon2):
+    """Versão vetorizada de `rumo`."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    x = np.sin(dlon) * np.cos(lat2)
+    y = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+
+def distancias_trecho(lats, lngs):
+    """Distância de cada ponto ao seguinte (n-1 valores)."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    if lats.size < 2:
+        return np.zeros(0)
+    return haversine_np(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+
+
+def distancia_acumulada(lats, lngs):
+    """Distância percorrida até cada ponto (n valores, começando em 0)."""
+    trechos = distancias_trecho(lats, lngs)
+    return np.concatenate(([0.0], np.cumsum(trechos)))
+
+
+def rumos_trecho(lats, lngs):
+    """Rumo de cada ponto ao seguinte (n-1 valores)."""
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    if lats.size < 2:
+        return np.zeros(0)
+    return rumo_np(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+
+
+def velocidades_kmh(lats, lngs, epochs):
+    """
+    Velocidade média (km/h) em cada trecho. `epochs` são timestamps em segundos;
+    trechos com intervalo <= 0 (duplicados/fora de ordem) ficam com velocidade 0.
+    """
+    trechos = distancias_trecho(lats, lngs)
+    dt = np.diff(np.asarray(epochs, dtype=np.float64))
+    velocidades = np.zeros_like(trechos)
+    validos = dt > 0
+    velocidades[validos] = trechos[validos] / dt[validos] * 3.6
+    return velocidades
+
+
+def arrays_trajeto(localizacoes):
+    """Converte uma lista de Localizacao (em ordem) em arrays lat, lng e epoch."""
+    n = len(localizacoes)
+    lats = np.fromiter((float(l.latitude) for l in localizacoes), dtype=np.float64, count=n)
+    lngs = np.fromiter((float(l.longitude) for l in localizacoes), dtype=np.float64, count=n)
+    epochs = np.fromiter((l.timestamp.timestamp() for l in localizacoes), dtype=np.float64, count=n)
+    return lats, lngs, epochs
+
+
+def resumo_trajeto(lats, lngs, epochs):
+    """Distância total, duração e velocidades de um trajeto já ordenado por tempo."""
+    if len(lats) < 2:
+        return {
+            "pontos": int(len(lats)),
+            "distancia_m": 0.0,
+            "duracao_s": 0.0,
+            "velocidade_media_kmh": 0.0,
+            "velocidade_max_kmh": 0.0,
+        }
+    distancia = float(distancias_trecho(lats, lngs).sum())
+    duracao = float(epochs[-1] - epochs[0])
+    return {
+        "pontos": int(len(lats)),
+        "distancia_m": round(distancia, 1),
+        "duracao_s": duracao,
+        "velocidade_media_kmh": round(distancia / duracao * 3.6, 1) if duracao > 0 else 0.0,
+        "velocidade_max_kmh": round(float(velocidades_kmh(lats, lngs, epochs).max()), 1),
+    }
+
+
+def metros_por_pixel(zoom, lat):
+    """Resolução do mapa (Web Mercator, tiles de 256 px) na latitude dada."""
+    return 156543.03392 * cos(radians(float(lat))) / 2 ** zoom
+
+
+def _distancia_ao_segmento(x, y, ax, ay, bx, by):
+    """Distância (plano) de cada ponto (x, y) ao segmento a-b."""
+    dx, dy = bx - ax, by - ay
+    comprimento2 = dx * dx + dy * dy
+    if comprimento2 == 0:
+        return np.hypot(x - ax, y - ay)
+    t = np.clip(((x - ax) * dx + (y - ay) * dy) / comprimento2, 0.0, 1.0)
+    return np.hypot(x - (ax + t * dx), y - (ay + t * dy))
+
+
+def simplificar_trajeto(lats, lngs, tolerancia_m, manter=None):
+    """
+    Douglas-Peucker sobre um trajeto ordenado: máscara booleana dos pontos que
+    ficam, de modo que nenhum ponto descartado se afaste mais que `tolerancia_m`
+    da linha simplificada. Pontos marcados em `manter` (paradas, eventos), o
+    primeiro e o último sempre ficam e servem de âncoras: a simplificação roda
+    entre cada par de âncoras consecutivas.
+    """
+    lats = np.asarray(lats, dtype=np.float64)
+    lngs = np.asarray(lngs, dtype=np.float64)
+    n = lats.size
+    mascara = np.zeros(n, dtype=bool) if manter is None else np.array(manter, dtype=bool)
+    if n <= 2:
+        mascara[:] = True
+        return mascara
+    mascara[0] = mascara[-1] = True
+
+    # Projeção equirretangular local em metros (trajetos de até centenas de km)
+    metros_por_grau = RAIO_TERRA_M * np.pi / 180.0
+    y = (lats - lats[0]) * metros_por_grau
+    x = (lngs - lngs[0]) * metros_por_grau * np.cos(np.radians(lats.mean()))
+
+    ancoras = np.flatnonzero(mascara)
+    pilha = [(a, b) for a, b in zip(ancoras[:-1], ancoras[1:]) if b - a > 1]
+    while pilha:
+        a, b = pilha.pop()
+        distancias = _distancia_ao_segmento(x[a + 1:b], y[a + 1:b], x[a], y[a], x[b], y[b])
+        i = int(distancias.argmax())
+        if distancias[i] > tolerancia_m:
+            meio = a + 1 + i
+            mascara[meio] = True
+            if meio - a > 1:
+                pilha.append((a, meio))
+            if b - meio > 1:
+                pilha.append((meio, b))
+    return mascara
+
+
+def pontos_de_parada(lats, lngs, epochs, limite_kmh=2.0):
+    """
+    Máscara dos pontos onde o veículo começa ou termina uma parada (velocidade do
+    trecho abaixo de `limite_kmh`, o mesmo limite de "Parada" da ingestão).
+    """
+    n = len(lats)
+    mascara = np.zeros(n, dtype=bool)
+    if n < 2:
+        return mascara
+    parado = velocidades_kmh(lats, lngs, epochs) < limite_kmh
+    mudou = np.flatnonzero(parado[1:] != parado[:-1]) + 1   # ponto entre dois trechos diferentes
+    mascara[mudou] = True
+    # Trajeto que começa ou termina parado
+    mascara[0] = True
+    mascara[-1] = True
+    return mascara
+
+
+def pontos_mais_proximos(epochs, instantes):
+    """Índice do ponto (epochs ordenados) mais próximo no tempo de cada instante."""
+    epochs = np.asarray(epochs, dtype=np.float64)
+    instantes = np.asarray(instantes, dtype=np.float64)
+    if epochs.size == 0 or instantes.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    direita = np.clip(np.searchsorted(epochs, instantes), 0, epochs.size - 1)
+    esquerda = np.clip(direita - 1, 0, epochs.size - 1)
+    usar_esquerda = np.abs(epochs[esquerda] - instantes) < np.abs(epochs[direita] - instantes)
+    return np.where(usar_esquerda, esquerda, direita)
+
+def _codificar_inteiro_polyline(valor):
+    valor = ~(valor << 1) if valor < 0 else valor << 1
+    caracteres = []
+    while valor >= 0x20:
+        caracteres.append(chr((0x20 | (valor & 0x1F)) + 63))
+        valor >>= 5
+    caracteres.append(chr(valor + 63))
+    return "".join(caracteres)
+
+
+def codificar_polyline(lats, lngs, precisao=5):
+    """
+    Encoded polyline do Google (o que google.maps.geometry.encoding.decodePath lê):
+    coordenadas com `precisao` casas decimais, cada ponto como diferença do anterior.
+    """
+    fator = 10 ** precisao
+    inteiros = np.column_stack((
+        np.rint(np.asarray(lats, dtype=np.float64) * fator),
+        np.rint(np.asarray(lngs, dtype=np.float64) * fator),
+    )).astype(np.int64)
+    if not len(inteiros):
+        return ""
+    deltas = np.diff(inteiros, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    return "".join(_codificar_inteiro_polyline(int(v)) for v in deltas)
+
+# --- Geohash: id de célula gravado em "Localizacao" (busca por área e período) ---
+
+BASE32_GEOHASH = "0123456789bcdefghjkmnpqrstuvwxyz"
+# 7 caracteres: células de ~153 x 153 m
+PRECISAO_GEOHASH = 7
+
+
+def geohash(lat, lng, precisao=PRECISAO_GEOHASH):
+    """Geohash do ponto (bits alternados de longitude e latitude, base32)."""
+    lat, lng = float(lat), float(lng)
+    lat_min, lat_max, lng_min, lng_max = -90.0, 90.0, -180.0, 180.0
+    codigo = []
+    bits = valor = 0
+    par = True  # bits pares = longitude
+    while len(codigo) < precisao:
+        if par:
+            meio = (lng_min + lng_max) / 2
+            if lng >= meio:
+                valor = valor * 2 + 1
+                lng_min = meio
+            else:
+                valor *= 2
+                lng_max = meio
+        else:
+            meio = (lat_min + lat_max) / 2
+            if lat >= meio:
+                valor = valor * 2 + 1
+                lat_min = meio
+            else:
+                valor *= 2
+                lat_max = meio
+        par = not par
+        bits += 1
+        if bits == 5:
+            codigo.append(BASE32_GEOHASH[valor])
+            bits = valor = 0
+    return "".join(codigo)
+
+
+def _tamanho_celula_geohash(precisao):
+    """(altura, largura) em graus de uma célula com `precisao` caracteres."""
+    bits = 5 * precisao
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def celulas_geohash(min_lat, min_lng, max_lat, max_lng, max_celulas=64):
+    """
+    Geohashes que cobrem o retângulo (sem cruzar o antimeridiano), na maior
+    precisão (até PRECISAO_GEOHASH) que não passe de `max_celulas` células.
+    Cada um é um prefixo dos geohashes gravados dentro dele.
+    """
+    for precisao in range(PRECISAO_GEOHASH, 0, -1):
+        altura, largura = _tamanho_celula_geohash(precisao)
+        i0, i1 = int((min_lat + 90.0) // altura), int((max_lat + 90.0) // altura)
+        j0, j1 = int((min_lng + 180.0) // largura), int((max_lng + 180.0) // largura)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) <= max_celulas or precisao == 1:
+            break
+    i1 = min(i1, int(round(180.0 / altura)) - 1)
+    j1 = min(j1, int(round(360.0 / largura)) - 1)
+    return sorted({
+        geohash(-90.0 + (i + 0.5) * altura, -180.0 + (j + 0.5) * largura, precisao)
+        for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+    })
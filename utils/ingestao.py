@@ -0,0 +1,195 @@
+from collections import defaultdict
+from datetime import datetime
+from sqlalchemy import insert
+from models.localizacao import Localizacao
+from models.veiculo import Veiculo
+from utils.event_helper import process_vehicle_events
+from utils.estado_veiculo import obter_estado, registrar_localizacoes_gravadas
+from utils.agregados import marcar_pendentes
+from utils.geo import geohash
+from utils.presenca import presenca
+from database import db
+import re
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Formato de texto enviado pelos rastreadores: "placa=ABC1234, latitude=-23.5, longitude=-46.6"
+PADRAO_MENSAGEM = re.compile(
+    r"placa=([A-Z0-9]+), latitude=([-+]?\d*\.\d+|\d+), longitude=([-+]?\d*\.\d+|\d+)"
+)
+
+
+def extrair_fix_mensagem(mensagem):
+    """Extrai placa/latitude/longitude de uma mensagem de texto ou retorna None."""
+    match = PADRAO_MENSAGEM.search(mensagem)
+    if not match:
+        return None
+    return {
+        "placa": match.group(1),
+        "latitude": float(match.group(2)),
+        "longitude": float(match.group(3)),
+    }
+
+
+def parse_timestamp(valor):
+    """
+    Converte o timestamp enviado pelo rastreador (ISO 8601) em datetime.
+    Se não vier ou for inválido, usa o horário atual de Brasília.
+    """
+    if isinstance(valor, datetime):
+        return valor
+    if isinstance(valor, str):
+        try:
+            return datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return datetime.now(br_tz)
+
+
+def _timestamp_aware(ts):
+    # Mesmo critério do event_helper: timestamps sem fuso são tratados como UTC
+    if ts.tzinfo is None:
+        return pytz.utc.localize(ts).astimezone(br_tz)
+    return ts
+
+
+def chave_fix(fix):
+    """Identidade de um fix (placa, instante, coordenadas) para detectar duplicatas exatas."""
+    ts = _timestamp_aware(parse_timestamp(fix.get("timestamp")))
+    return (
+        fix["placa"],
+        ts.timestamp(),
+        round(float(fix["latitude"]), 7),
+        round(float(fix["longitude"]), 7),
+    )
+
+
+def fix_duplicado(estado, latitude, longitude, timestamp):
+    """True se o fix é idêntico à última localização conhecida do veículo."""
+    if not estado.tem_posicao:
+        return False
+    try:
+        return (
+            estado.timestamp == _timestamp_aware(timestamp)
+            and round(float(estado.latitude), 7) == round(float(latitude), 7)
+            and round(float(estado.longitude), 7) == round(float(longitude), 7)
+        )
+    except (TypeError, ValueError):
+        return False
+
+
+def normalizar_fix(item):
+    """
+    Valida um item de localização recebido do rastreador.
+    Retorna (fix, None) se válido ou (None, mensagem_de_erro).
+    """
+    if not isinstance(item, dict):
+        return None, "Item inválido"
+
+    placa = item.get("placa")
+    if not placa:
+        return None, "Placa não informada"
+
+    try:
+        latitude = float(item.get("latitude"))
+        longitude = float(item.get("longitude"))
+    except (TypeError, ValueError):
+        return None, "Latitude/longitude inválidas"
+
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        return None, "Latitude/longitude fora do intervalo"
+
+    return {
+        "placa": placa,
+        "latitude": latitude,
+        "longitude": longitude,
+        "timestamp": _timestamp_aware(parse_timestamp(item.get("timestamp"))),
+        "led": item.get("led"),
+    }, None
+
+
+def processar_lote(itens):
+    """
+    Persiste um lote de localizações de um ou mais veículos em uma única transação.
+
+    Os eventos (Movimento/Parada/Ignição) são gerados por veículo em ordem de
+    timestamp e as localizações são gravadas com um único INSERT em massa.
+    Duplicatas exatas (no lote ou da última posição gravada) são ignoradas.
+    Retorna uma lista de status ("ok", "duplicado" ou "erro") na mesma ordem
+    dos itens recebidos.
+    """
+    resultados = [None] * len(itens)
+    validos = []
+
+    for idx, item in enumerate(itens):
+        fix, erro = normalizar_fix(item)
+        if erro:
+            resultados[idx] = {"index": idx, "status": "erro", "error": erro}
+        else:
+            validos.append((idx, fix))
+
+    # Resolve todas as placas do lote com uma única consulta
+    placas = {fix["placa"] for _, fix in validos}
+    veiculos = {}
+    if placas:
+        veiculos = {v.placa: v for v in Veiculo.query.filter(Veiculo.placa.in_(placas)).all()}
+
+    por_veiculo = defaultdict(list)
+    for idx, fix in validos:
+        if fix["placa"] not in veiculos:
+            resultados[idx] = {
+                "index": idx,
+                "status": "erro",
+                "error": f"Veículo não encontrado para a placa {fix['placa']}"
+            }
+            continue
+        por_veiculo[fix["placa"]].append((idx, fix))
+
+    linhas = []
+    agora = datetime.now(br_tz)
+    for placa, fixes in por_veiculo.items():
+        veiculo = veiculos[placa]
+        fixes.sort(key=lambda par: par[1]["timestamp"])
+
+        vistos = set()
+        for idx, fix in fixes:
+            chave = chave_fix(fix)
+            if chave in vistos or fix_duplicado(
+                obter_estado(veiculo), fix["latitude"], fix["longitude"], fix["timestamp"]
+            ):
+                resultados[idx] = {"index": idx, "status": "duplicado", "placa": placa}
+                continue
+            vistos.add(chave)
+
+            # O estado do veículo (utils.estado_veiculo) já reflete as posições
+            # anteriores do próprio lote, mesmo antes do INSERT
+            process_vehicle_events(
+                veiculo, fix["latitude"], fix["longitude"], fix["timestamp"], fix["led"]
+            )
+            linhas.append({
+                "placa": placa,
+                "latitude": fix["latitude"],
+                "longitude": fix["longitude"],
+                "timestamp": fix["timestamp"],
+                "geohash": geohash(fix["latitude"], fix["longitude"]),
+            })
+            resultados[idx] = {"index": idx, "status": "ok", "placa": placa}
+
+        # Heartbeat do veículo (gravado em lote pelo registro de presença)
+        presenca.registrar(veiculo, agora)
+
+    try:
+        if linhas:
+            gravadas = db.session.execute(
+                insert(Localizacao).returning(Localizacao.placa, Localizacao.id, Localizacao.timestamp),
+                linhas
+            )
+            registrar_localizacoes_gravadas(gravadas.all())
+            marcar_pendentes((linha["placa"], linha["timestamp"]) for linha in linhas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return resultados
@@ -0,0 +1,114 @@
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+from database import db
+from models.evento import Evento
+from models.veiculo import Veiculo
+from utils import tempo_real
+
+# Feed de notificações por cliente (GET /eventos/stream).
+#
+# Qualquer Evento criado pela ORM (process_vehicle_events, comandos, webhook de
+# pagamento, POST /eventos) ou marcado como lido gera, no commit, uma mensagem
+# no canal abaixo: o evento novo (o stream soma 1 aos não lidos) ou, quando
+# eventos são lidos ou apagados, só o aviso "nao_lidos" de que o total do
+# cliente mudou. O commit não conta nada; cada stream reconta o cliente quando
+# recebe o aviso.
+
+notificacoes = tempo_real.Canal("findway_notificacoes")
+tempo_real.canais[notificacoes.nome] = notificacoes
+
+_CHAVE_NOVOS = "notificacoes_eventos_novos"
+_CHAVE_CLIENTES = "notificacoes_clientes_alterados"
+
+
+def evento_to_dict(e):
+    return {
+        "id": e.id,
+        "veiculo_id": e.veiculo_id,
+        "tipo": e.tipo,
+        "descricao": e.descricao,
+        "timestamp": e.timestamp.isoformat() if e.timestamp else None,
+        "lido": bool(getattr(e, "lido", False)),
+    }
+
+
+def contar_nao_lidos(cliente_ids, conexao=None):
+    """Total de eventos não lidos por cliente: {cliente_id: total}."""
+    if not cliente_ids:
+        return {}
+    consulta = select(Evento.cliente_id, func.count()).where(
+        Evento.cliente_id.in_(list(cliente_ids)),
+        Evento.lido.is_(False)
+    ).group_by(Evento.cliente_id)
+    linhas = (conexao or db.session).execute(consulta).all()
+    totais = dict.fromkeys(cliente_ids, 0)
+    totais.update({cliente_id: total for cliente_id, total in linhas})
+    return totais
+
+
+def ultimos_eventos(cliente_ids, conexao=None):
+    """Maior id de Evento por cliente: o que já entrou numa contagem feita agora."""
+    if not cliente_ids:
+        return {}
+    consulta = select(Evento.cliente_id, func.max(Evento.id)).where(
+        Evento.cliente_id.in_(list(cliente_ids))
+    ).group_by(Evento.cliente_id)
+    return dict((conexao or db.session).execute(consulta).all())
+
+
+def notificar_nao_lidos(cliente_ids, session=None):
+    """Para alterações em massa fora da ORM (ex.: DELETE dos eventos de um cliente)."""
+    session = session or db.session
+    session.info.setdefault(_CHAVE_CLIENTES, set()).update(cliente_ids)
+
+
+@event.listens_for(Session, "before_flush")
+def _completar_cliente(session, flush_context, instances):
+    # Eventos criados só com o veículo (Alerta/Parada do retorno, comandos) ficam
+    # no feed e na contagem do dono do veículo
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, Evento) and obj.cliente_id is None and obj.veiculo_id is not None:
+                veiculo = session.get(Veiculo, obj.veiculo_id)
+                if veiculo is not None:
+                    obj.cliente_id = veiculo.cliente_id
+
+
+@event.listens_for(Session, "after_flush")
+def _acompanhar_eventos(session, flush_context):
+    # Aqui os ids já existem e new/dirty ainda mostram o que foi gravado neste flush
+    novos = session.info.setdefault(_CHAVE_NOVOS, [])
+    clientes = session.info.setdefault(_CHAVE_CLIENTES, set())
+    for obj in session.new:
+        if isinstance(obj, Evento) and obj.cliente_id:
+            novos.append(obj)
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Evento) and obj.cliente_id and (
+            obj in session.deleted or inspect(obj).attrs.lido.history.has_changes()
+        ):
+            clientes.add(obj.cliente_id)
+
+
+@event.listens_for(Session, "before_commit")
+def _publicar_notificacoes(session):
+    if any(isinstance(obj, Evento) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.flush()
+    novos = session.info.pop(_CHAVE_NOVOS, [])
+    clientes = session.info.pop(_CHAVE_CLIENTES, set())
+    if not novos and not clientes:
+        return
+
+    mensagens = [
+        {"c": e.cliente_id, "tipo": "evento", "evento": evento_to_dict(e)}
+        for e in sorted(novos, key=lambda e: e.id)
+    ]
+    # Eventos novos já contam pelo "evento"; o aviso é para o resto (lidos,
+    # apagados, alterações em massa)
+    mensagens.extend({"c": cliente_id, "tipo": "nao_lidos"} for cliente_id in sorted(clientes))
+    tempo_real.publicar_no_commit(notificacoes, mensagens, session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_notificacoes(session):
+    session.info.pop(_CHAVE_NOVOS, None)
+    session.info.pop(_CHAVE_CLIENTES, None)
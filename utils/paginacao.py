@@ -0,0 +1,71 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+# Paginação por cursor (keyset) e respostas em streaming para os endpoints de
+# histórico. A ordem é sempre (timestamp, id) decrescente; o cursor é a chave da
+# última linha entregue, então cada página é uma busca no índice e não depende
+# de OFFSET. No streaming as linhas saem de um cursor do servidor (yield_per) e
+# são serializadas em blocos: a memória fica constante para qualquer período.
+
+TAMANHO_PAGINA_MAXIMO = 5000
+LINHAS_POR_BLOCO = 1000
+
+
+def emitir_cursor(timestamp, id_):
+    """Cursor opaco com a chave (timestamp, id) da última linha da página."""
+    texto = json.dumps([timestamp.isoformat(), id_], separators=(",", ":"))
+    return base64.urlsafe_b64encode(texto.encode()).decode().rstrip("=")
+
+
+def ler_cursor(valor):
+    """(timestamp, id) de um cursor emitido por emitir_cursor. Lança ValueError se inválido."""
+    try:
+        texto = base64.urlsafe_b64decode(str(valor) + "=" * (-len(str(valor)) % 4)).decode()
+        iso, id_ = json.loads(texto)
+        return datetime.fromisoformat(iso), int(id_)
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("cursor inválido")
+
+
+def pagina(consulta, coluna_ts, coluna_id, limite, cursor=None):
+    """
+    Uma página de `consulta` em ordem (timestamp, id) decrescente, depois do
+    `cursor` ((timestamp, id) já lido). As linhas precisam expor `.timestamp` e
+    `.id`. Retorna (linhas, próximo cursor ou None na última página).
+    """
+    if cursor is not None:
+        consulta = consulta.filter(tuple_(coluna_ts, coluna_id) < tuple_(*cursor))
+    linhas = consulta.order_by(coluna_ts.desc(), coluna_id.desc()).limit(limite + 1).all()
+    if len(linhas) <= limite:
+        return linhas, None
+    linhas = linhas[:limite]
+    return linhas, emitir_cursor(linhas[-1].timestamp, linhas[-1].id)
+
+
+def _em_blocos(consulta, serializar):
+    bloco = []
+    for linha in consulta.yield_per(LINHAS_POR_BLOCO):
+        bloco.append(serializar(linha))
+        if len(bloco) >= LINHAS_POR_BLOCO:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+def gerar_ndjson(consulta, serializar):
+    """Um objeto JSON por linha (`serializar` devolve a linha já como texto JSON)."""
+    for bloco in _em_blocos(consulta, serializar):
+        yield "\n".join(bloco) + "\n"
+
+
+def gerar_lista_json(consulta, serializar):
+    """O mesmo array JSON de sempre, mas montado e enviado aos poucos (chunked)."""
+    yield "["
+    primeiro = True
+    for bloco in _em_blocos(consulta, serializar):
+        yield ("" if primeiro else ",") + ",".join(bloco)
+        primeiro = False
+    yield "]\n"
@@ -0,0 +1,187 @@
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import text
+from database import db
+import pytz
+
+# Partições mensais de "Localizacao" (PostgreSQL, PARTITION BY RANGE (timestamp)).
+#
+# Cada mês (em UTC) é uma tabela "Localizacao_AAAA_MM"; linhas fora de qualquer
+# partição caem em "Localizacao_padrao" (ex.: carga histórica de meses antigos).
+# A manutenção periódica cria os próximos meses antes de chegarem, move para a
+# partição certa o que estiver na padrão e aplica a retenção apagando partições
+# inteiras (DROP TABLE): sem DELETE linha a linha, sem VACUUM nem índice inchado.
+
+TABELA = "Localizacao"
+PARTICAO_PADRAO = "Localizacao_padrao"
+
+# Chave do advisory lock: com vários workers, só um mexe nas partições por vez
+CHAVE_LOCK = 7310002
+
+
+def _mes(ts):
+    ts = ts if ts.tzinfo else pytz.utc.localize(ts)
+    ts = ts.astimezone(pytz.utc)
+    return datetime(ts.year, ts.month, 1, tzinfo=pytz.utc)
+
+
+def somar_meses(mes, n):
+    indice = mes.year * 12 + mes.month - 1 + n
+    return datetime(indice // 12, indice % 12 + 1, 1, tzinfo=pytz.utc)
+
+
+def nome_particao(mes):
+    return f"{TABELA}_{mes:%Y_%m}"
+
+
+def _limites(mes):
+    return f"'{mes:%Y-%m-%d} 00:00:00+00'", f"'{somar_meses(mes, 1):%Y-%m-%d} 00:00:00+00'"
+
+
+def tabela_particionada(conn):
+    return bool(conn.execute(text(
+        f"""SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('"{TABELA}"')"""
+    )).scalar())
+
+
+def particoes_mensais(conn):
+    """{mês (datetime UTC): nome} das partições mensais existentes."""
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        f"""WHERE i.inhparent = to_regclass('"{TABELA}"')"""
+    )).scalars().all()
+    particoes = {}
+    for nome in nomes:
+        try:
+            mes = datetime.strptime(nome[len(TABELA) + 1:], "%Y_%m").replace(tzinfo=pytz.utc)
+        except ValueError:
+            continue  # a partição padrão
+        particoes[mes] = nome
+    return particoes
+
+
+def criar_particao(conn, mes):
+    """
+    Cria a partição do mês. Se a partição padrão já tiver linhas desse mês, elas
+    são movidas para uma tabela nova que então é anexada (ATTACH) ao "Localizacao".
+    """
+    nome = nome_particao(mes)
+    inicio, fim = _limites(mes)
+    padrao_tem_linhas = conn.execute(text(
+        f'SELECT 1 FROM "{PARTICAO_PADRAO}" WHERE "timestamp" >= {inicio} AND "timestamp" < {fim} LIMIT 1'
+    )).scalar()
+    if not padrao_tem_linhas:
+        conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{nome}" PARTITION OF "{TABELA}" FOR VALUES FROM ({inicio}) TO ({fim})'
+        ))
+        return 0
+
+    conn.execute(text(f'CREATE TABLE "{nome}" (LIKE "{TABELA}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    movidas = conn.execute(text(
+        f'WITH movidas AS (DELETE FROM "{PARTICAO_PADRAO}" WHERE "timestamp" >= {inicio} AND "timestamp" < {fim} '
+        f'RETURNING *) INSERT INTO "{nome}" SELECT * FROM movidas'
+    )).rowcount
+    conn.execute(text(f'ALTER TABLE "{TABELA}" ATTACH PARTITION "{nome}" FOR VALUES FROM ({inicio}) TO ({fim})'))
+    return movidas
+
+
+def garantir_particoes(conn, agora=None, futuras=3):
+    """
+    Partição padrão, mês atual e os `futuras` meses seguintes, mais os meses que
+    estiverem na partição padrão. Retorna (partições criadas, linhas movidas).
+    """
+    agora = agora or datetime.now(pytz.utc)
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{PARTICAO_PADRAO}" PARTITION OF "{TABELA}" DEFAULT'))
+
+    existentes = particoes_mensais(conn)
+    meses = {somar_meses(_mes(agora), n) for n in range(futuras + 1)}
+    meses.update(
+        mes.replace(tzinfo=pytz.utc) for mes in conn.execute(text(
+            "SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC') "
+            f'FROM "{PARTICAO_PADRAO}"'
+        )).scalars()
+    )
+    criadas = movidas = 0
+    for mes in sorted(meses):
+        if mes not in existentes:
+            movidas += criar_particao(conn, mes)
+            criadas += 1
+    return criadas, movidas
+
+
+def aplicar_retencao(conn, meses_retencao, agora=None):
+    """Apaga as partições que terminam antes do início da retenção. Retorna os nomes apagados."""
+    if not meses_retencao:
+        return []
+    limite = somar_meses(_mes(agora or datetime.now(pytz.utc)), -meses_retencao)
+    apagadas = []
+    for mes, nome in sorted(particoes_mensais(conn).items()):
+        if somar_meses(mes, 1) <= limite:
+            conn.execute(text(f'DROP TABLE "{nome}"'))
+            apagadas.append(nome)
+    return apagadas
+
+
+def manter_particoes(futuras, meses_retencao, agora=None):
+    """
+    Uma rodada da manutenção (cria, move, apaga), numa transação. Retorna um
+    resumo, ou None se o banco não for PostgreSQL, a tabela ainda não for
+    particionada (rode scripts_particionar_localizacao.py) ou outro worker
+    estiver rodando.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return None
+    with db.engine.begin() as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:chave)"), {"chave": CHAVE_LOCK}).scalar():
+            return None
+        if not tabela_particionada(conn):
+            return None
+        criadas, movidas = garantir_particoes(conn, agora, futuras)
+        apagadas = aplicar_retencao(conn, meses_retencao, agora)
+    return {"criadas": criadas, "movidas": movidas, "apagadas": apagadas}
+
+
+class ManutencaoParticoes:
+    """Thread que roda `manter_particoes` a cada `intervalo` segundos."""
+
+    def __init__(self):
+        self.app = None
+        self.intervalo = None
+        self.futuras = None
+        self.retencao = None
+        self.ultimo_resultado = None
+        self.ultimo_erro = None
+
+    def _rodar(self):
+        try:
+            with self.app.app_context():
+                resultado = manter_particoes(self.futuras, self.retencao)
+            self.ultimo_resultado = resultado
+            self.ultimo_erro = None
+            if resultado and (resultado["criadas"] or resultado["apagadas"]):
+                print(
+                    f"[PARTICOES] {resultado['criadas']} criada(s), {resultado['movidas']} linha(s) movida(s) "
+                    f"da padrão, apagadas: {', '.join(resultado['apagadas']) or 'nenhuma'}"
+                )
+        except Exception as e:
+            self.ultimo_erro = str(e)
+            print(f"[PARTICOES] Erro na manutenção: {e}")
+
+    def _loop(self):
+        while True:
+            self._rodar()
+            time.sleep(self.intervalo)
+
+    def iniciar(self, app):
+        """Inicia a manutenção (uma vez por processo); a primeira rodada é imediata."""
+        if self.app is not None:
+            return
+        self.app = app
+        self.intervalo = app.config["MANUTENCAO_PARTICOES_INTERVALO"]
+        self.futuras = app.config["PARTICOES_FUTURAS_MESES"]
+        self.retencao = app.config["RETENCAO_LOCALIZACAO_MESES"]
+        threading.Thread(target=self._loop, name="manutencao-particoes", daemon=True).start()
+
+
+manutencao_particoes = ManutencaoParticoes()
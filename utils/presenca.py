@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, or_, update
+from database import db
+from models.veiculo import Veiculo
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Sem atualização há mais que isso, o veículo é considerado Offline
+ONLINE_TIMEOUT_SECS = 9
+
+
+def _aware(ts):
+    if ts is None:
+        return None
+    if ts.tzinfo is None:
+        return pytz.utc.localize(ts).astimezone(br_tz)
+    return ts
+
+
+class RegistroPresenca:
+    """
+    Registro em memória do último heartbeat de cada veículo (chave: veiculo_id).
+
+    A ingestão só anota o horário aqui; uma thread grava os heartbeats
+    acumulados em Veiculo.ultima_atualizacao com um único UPDATE em lote a
+    cada `intervalo` segundos, em vez de um UPDATE na linha do veículo por fix.
+    """
+
+    def __init__(self):
+        self._ultimos = {}
+        self._sujos = set()
+        self._lock = threading.Lock()
+        self.app = None
+        self.intervalo = None
+        self.flushes = 0
+        self.ultimo_erro = None
+
+    @property
+    def ativo(self):
+        return self.app is not None
+
+    def registrar(self, veiculo, timestamp=None):
+        """Anota um heartbeat. Sem o flusher rodando (scripts), grava direto no objeto."""
+        timestamp = _aware(timestamp) or datetime.now(br_tz)
+        if not self.ativo:
+            veiculo.ultima_atualizacao = timestamp
+            return
+        with self._lock:
+            atual = self._ultimos.get(veiculo.id)
+            if atual is None or timestamp > atual:
+                self._ultimos[veiculo.id] = timestamp
+                self._sujos.add(veiculo.id)
+
+    def ultima_atualizacao(self, veiculo):
+        """Mais recente entre o heartbeat em memória e o valor gravado no banco."""
+        return self._ultima(veiculo.id, veiculo.ultima_atualizacao)
+
+    def _ultima(self, veiculo_id, gravado):
+        gravado = _aware(gravado)
+        with self._lock:
+            em_memoria = self._ultimos.get(veiculo_id)
+        if em_memoria is None:
+            return gravado
+        if gravado is None:
+            return em_memoria
+        return max(em_memoria, gravado)
+
+    def online(self, veiculo_id, gravado=None, timestamp_localizacao=None, agora=None):
+        """
+        Online se a última localização ou o último heartbeat (`gravado` no banco ou
+        em memória) tiverem até ONLINE_TIMEOUT_SECS. Para quem não tem o Veiculo
+        carregado (ex.: clusters); os demais usam `status_gps`.
+        """
+        agora = agora or datetime.now(br_tz)
+        for ts in (_aware(timestamp_localizacao), self._ultima(veiculo_id, gravado)):
+            if ts is not None and (agora - ts).total_seconds() <= ONLINE_TIMEOUT_SECS:
+                return True
+        return False
+
+    def status_gps(self, veiculo, timestamp_localizacao=None, agora=None):
+        """Online se a última localização ou o último heartbeat tiverem até ONLINE_TIMEOUT_SECS."""
+        online = self.online(veiculo.id, veiculo.ultima_atualizacao, timestamp_localizacao, agora)
+        return "Online" if online else "Offline"
+
+    def flush(self):
+        """Grava os heartbeats pendentes; retorna quantos veículos foram atualizados."""
+        with self._lock:
+            pendentes = [
+                {"b_id": veiculo_id, "b_ts": self._ultimos[veiculo_id]}
+                for veiculo_id in self._sujos
+            ]
+            self._sujos.clear()
+        if not pendentes:
+            return 0
+
+        tabela = Veiculo.__table__
+        # Só avança: outro processo pode ter gravado um heartbeat mais recente
+        stmt = update(tabela).where(
+            tabela.c.id == bindparam("b_id"),
+            or_(tabela.c.ultima_atualizacao.is_(None), tabela.c.ultima_atualizacao < bindparam("b_ts"))
+        ).values(ultima_atualizacao=bindparam("b_ts"))
+
+        with self.app.app_context():
+            try:
+                db.session.connection().execute(stmt, pendentes)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                # Volta para a lista de pendentes para a próxima tentativa
+                with self._lock:
+                    self._sujos.update(p["b_id"] for p in pendentes)
+                raise
+        self.flushes += 1
+        return len(pendentes)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.flush()
+                self.ultimo_erro = None
+            except Exception as e:
+                self.ultimo_erro = str(e)
+                print(f"[PRESENCA] Erro ao gravar heartbeats: {e}")
+
+    def iniciar(self, app):
+        """Liga o registro e inicia a thread de flush (uma vez por processo)."""
+        if self.ativo:
+            return
+        self.app = app
+        self.intervalo = app.config["PRESENCA_FLUSH_INTERVALO"]
+        threading.Thread(target=self._loop, name="flush-presenca", daemon=True).start()
+
+
+presenca = RegistroPresenca()
@@ -0,0 +1,88 @@
+import struct
+from datetime import datetime
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Protocolo binário compacto dos rastreadores (little-endian).
+#
+# Cabeçalho (2 bytes):
+#   uint8  versão (1)
+#   uint8  quantidade de registros
+#
+# Registro (23 bytes), repetido `quantidade` vezes:
+#   10s    placa (ASCII, completada com \x00)
+#   int32  latitude em micrograus (graus * 1e6)
+#   int32  longitude em micrograus (graus * 1e6)
+#   uint32 timestamp (epoch UTC, segundos)
+#   uint8  flags: bit0 = ignição informada, bit1 = ignição ligada (LED verde)
+
+VERSAO = 1
+CABECALHO = struct.Struct("<BB")
+REGISTRO = struct.Struct("<10siiIB")
+
+FLAG_IGNICAO_INFORMADA = 0x01
+FLAG_IGNICAO_LIGADA = 0x02
+
+
+class PacoteInvalido(ValueError):
+    pass
+
+
+def decodificar_pacote(dados):
+    """
+    Decodifica um pacote binário em uma lista de fixes no formato aceito
+    por utils.ingestao.processar_lote. Os registros são lidos direto do
+    buffer via memoryview, sem copiar o corpo da requisição.
+    """
+    buf = memoryview(dados)
+    if len(buf) < CABECALHO.size:
+        raise PacoteInvalido("Pacote menor que o cabeçalho")
+
+    versao, quantidade = CABECALHO.unpack_from(buf, 0)
+    if versao != VERSAO:
+        raise PacoteInvalido(f"Versão de protocolo não suportada: {versao}")
+
+    corpo = buf[CABECALHO.size:]
+    if quantidade == 0 or len(corpo) != quantidade * REGISTRO.size:
+        raise PacoteInvalido(
+            f"Tamanho inconsistente: {quantidade} registro(s) exigem "
+            f"{quantidade * REGISTRO.size} bytes, recebidos {len(corpo)}"
+        )
+
+    fixes = []
+    for placa, lat_u, lng_u, epoch, flags in REGISTRO.iter_unpack(corpo):
+        led = None
+        if flags & FLAG_IGNICAO_INFORMADA:
+            led = "verde" if flags & FLAG_IGNICAO_LIGADA else "vermelho"
+        fixes.append({
+            "placa": placa.rstrip(b"\x00").decode("ascii", errors="replace"),
+            "latitude": lat_u / 1e6,
+            "longitude": lng_u / 1e6,
+            "timestamp": datetime.fromtimestamp(epoch, pytz.utc).astimezone(br_tz),
+            "led": led,
+        })
+    return fixes
+
+
+def codificar_pacote(fixes):
+    """Monta um pacote a partir de fixes (usado por simuladores e testes de carga)."""
+    if not 0 < len(fixes) <= 255:
+        raise PacoteInvalido("Um pacote comporta de 1 a 255 registros")
+
+    partes = [CABECALHO.pack(VERSAO, len(fixes))]
+    for fix in fixes:
+        flags = 0
+        led = (fix.get("led") or "").lower()
+        if led in ("verde", "green"):
+            flags = FLAG_IGNICAO_INFORMADA | FLAG_IGNICAO_LIGADA
+        elif led in ("vermelho", "red"):
+            flags = FLAG_IGNICAO_INFORMADA
+        partes.append(REGISTRO.pack(
+            fix["placa"].encode("ascii"),
+            round(fix["latitude"] * 1e6),
+            round(fix["longitude"] * 1e6),
+            int(fix["timestamp"].timestamp()),
+            flags
+        ))
+    return b"".join(partes)
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from threading import Lock
+from utils.ingestao import parse_timestamp, chave_fix
+
+
+class BufferReordenacao:
+    """
+    Buffer por veículo que segura as localizações por `janela` segundos após a
+    chegada, descarta duplicatas exatas e libera os fixes em ordem de timestamp.
+
+    Pacotes atrasados/duplicados em links 2G instáveis deixam de gerar
+    eventos espúrios e linhas repetidas. `max_por_veiculo` limita a memória:
+    se um veículo acumular mais que isso, os mais antigos saem antes da janela.
+    """
+
+    def __init__(self, janela, max_por_veiculo=100, memoria_dedup=64):
+        self.janela = janela
+        self.max_por_veiculo = max_por_veiculo
+        self.memoria_dedup = memoria_dedup
+        self._pendentes = {}   # placa -> heap [(epoch, seq, chegada, fix, dado)]
+        self._vistos = {}      # placa -> OrderedDict das chaves recentes (dedup)
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self.duplicados = 0
+
+    def adicionar(self, fix, dado=None, chegada=None):
+        """Guarda o fix; retorna False se for duplicata exata de um fix recente."""
+        chegada = time.monotonic() if chegada is None else chegada
+        placa = fix["placa"]
+        chave = chave_fix(fix)
+        epoch = parse_timestamp(fix.get("timestamp")).timestamp()
+
+        with self._lock:
+            vistos = self._vistos.setdefault(placa, OrderedDict())
+            if chave in vistos:
+                self.duplicados += 1
+                return False
+            vistos[chave] = True
+            if len(vistos) > self.memoria_dedup:
+                vistos.popitem(last=False)
+
+            heapq.heappush(
+                self._pendentes.setdefault(placa, []),
+                (epoch, next(self._seq), chegada, fix, dado)
+            )
+            return True
+
+    def esquecer(self, fixes):
+        """Remove fixes da memória de dedup (ex.: gravação falhou e eles voltarão a chegar)."""
+        with self._lock:
+            for fix in fixes:
+                vistos = self._vistos.get(fix["placa"])
+                if vistos is not None:
+                    vistos.pop(chave_fix(fix), None)
+
+    def liberar(self, agora=None, forcar=False):
+        """
+        Retorna [(fix, dado)] prontos, em ordem de timestamp por veículo.
+        Um fix sai quando o mais antigo (em timestamp) do veículo já esperou a janela.
+        """
+        agora = time.monotonic() if agora is None else agora
+        limite = agora - self.janela
+        prontos = []
+
+        with self._lock:
+            for placa in list(self._pendentes):
+                heap = self._pendentes[placa]
+                while heap and (forcar or heap[0][2] <= limite or len(heap) > self.max_por_veiculo):
+                    _, _, _, fix, dado = heapq.heappop(heap)
+                    prontos.append((fix, dado))
+                if not heap:
+                    del self._pendentes[placa]
+        return prontos
+
+    def dados(self):
+        """`dado` de cada fix ainda segurado no buffer."""
+        with self._lock:
+            return [item[4] for heap in self._pendentes.values() for item in heap]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(h) for h in self._pendentes.values())
@@ -0,0 +1,164 @@
+import hashlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import and_, event, func, inspect, or_, select, text, update
+from sqlalchemy.orm import Session
+from database import db
+from models.veiculo import Veiculo
+from models.veiculo_estado import VeiculoEstado
+from models.veiculo_removido import VeiculoRemovido
+from utils.presenca import ONLINE_TIMEOUT_SECS
+import pytz
+
+br_tz = pytz.timezone("America/Sao_Paulo")
+
+# Sincronização incremental das últimas posições (GET /localizacao?since=...).
+#
+# Cada linha de "VeiculoEstado" e "VeiculoRemovido" guarda em `versao` o id da
+# transação que a gravou (xid8 no PostgreSQL: bigint monotônico). O cursor é o
+# xmin do snapshot de quem montou a resposta: toda transação com id menor já
+# terminou, então a próxima consulta pede `versao >= cursor` e nada confirmado
+# depois se perde, sem depender de relógio. A ETag é a maior versão abaixo do
+# cursor (consulta no índice de `versao`, sem agregar a frota).
+#
+# O status Online/Offline é calculado na leitura pelo timestamp da posição: o
+# cursor leva também o horário da resposta para devolver quem ficou Offline.
+
+# Relógios de workers diferentes: quem ficou Offline perto do cursor vem de novo
+MARGEM_CURSOR_SEGUNDOS = 2
+# Tombstones mais antigos que isso são apagados; cursores anteriores recebem a frota inteira
+RETENCAO_REMOVIDOS_DIAS = 7
+
+_CHAVE_REMOVIDOS = "sincronizacao_removidos"
+_CHAVE_TRANSFERIDOS = "sincronizacao_transferidos"
+
+Cursor = namedtuple("Cursor", "versao momento")
+
+
+def versao_da_transacao(session=None):
+    """Versão a gravar nas linhas alteradas pela transação atual."""
+    session = session or db.session
+    if session.get_bind().dialect.name == "postgresql":
+        return session.execute(text("SELECT pg_current_xact_id()::text::bigint")).scalar()
+    # SQLite (dev/testes): escritas serializadas, basta seguir a maior versão gravada
+    return _maior_versao(session) + 1
+
+
+def marca_dagua(session=None):
+    """Versões abaixo deste valor são de transações já terminadas (cursor da resposta)."""
+    session = session or db.session
+    if session.get_bind().dialect.name == "postgresql":
+        return session.execute(text("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+    return _maior_versao(session) + 1
+
+
+def _maior_versao(session):
+    return max(
+        session.execute(select(func.coalesce(func.max(VeiculoEstado.versao), 0))).scalar(),
+        session.execute(select(func.coalesce(func.max(VeiculoRemovido.versao), 0))).scalar(),
+    )
+
+
+def emitir_cursor(marca, agora):
+    return f"{marca}.{int(agora.timestamp() * 1000)}"
+
+
+def ler_cursor(valor):
+    """Aceita o cursor emitido (`versao.epoch_ms`). Lança ValueError se inválido."""
+    versao, _, momento = str(valor).strip().partition(".")
+    if versao.isdigit() and not momento:
+        # Cursor antigo (só o horário): tratado como expirado, recebe a frota inteira
+        return Cursor(0, datetime.fromtimestamp(0, br_tz))
+    if not (versao.isdigit() and momento.isdigit()):
+        raise ValueError(valor)
+    return Cursor(int(versao), datetime.fromtimestamp(int(momento) / 1000, br_tz))
+
+
+def cursor_expirado(desde, agora):
+    return desde.momento < agora - timedelta(days=RETENCAO_REMOVIDOS_DIAS)
+
+
+def versao_frota(marca, cliente_id=None, agora=None):
+    """
+    ETag da frota (toda ou de um cliente): muda quando alguma linha de
+    "VeiculoEstado" muda, quando um veículo sai da frota e a cada
+    ONLINE_TIMEOUT_SECS (veículos passam de Online para Offline sem escrita).
+    """
+    agora = agora or datetime.now(br_tz)
+    estados = select(func.max(VeiculoEstado.versao)).where(VeiculoEstado.versao < marca)
+    removidos = select(func.max(VeiculoRemovido.versao)).where(VeiculoRemovido.versao < marca)
+    if cliente_id is not None:
+        estados = estados.join(Veiculo, Veiculo.id == VeiculoEstado.veiculo_id).where(Veiculo.cliente_id == cliente_id)
+        removidos = removidos.where(VeiculoRemovido.cliente_id == cliente_id)
+
+    estado = db.session.execute(estados).scalar()
+    removido = db.session.execute(removidos).scalar()
+    periodo = int(agora.timestamp() // ONLINE_TIMEOUT_SECS)
+    chave = f"{estado}|{removido}|{periodo}"
+    return hashlib.sha1(chave.encode()).hexdigest()[:20]
+
+
+def filtrar_alterados(consulta, desde, agora):
+    """Restringe uma consulta sobre "VeiculoEstado" ao que mudou desde o cursor."""
+    janela_online = timedelta(seconds=ONLINE_TIMEOUT_SECS)
+    return consulta.filter(or_(
+        VeiculoEstado.versao >= desde.versao,
+        # Sem posição nova, mas ficaram Offline entre o cursor e agora
+        and_(
+            VeiculoEstado.timestamp > desde.momento - timedelta(seconds=MARGEM_CURSOR_SEGUNDOS) - janela_online,
+            VeiculoEstado.timestamp <= agora - janela_online
+        )
+    ))
+
+
+def removidos_desde(desde, cliente_id=None):
+    consulta = db.session.query(VeiculoRemovido.veiculo_id).filter(VeiculoRemovido.versao >= desde.versao)
+    if cliente_id is not None:
+        consulta = consulta.filter(VeiculoRemovido.cliente_id == cliente_id)
+    return sorted({veiculo_id for (veiculo_id,) in consulta})
+
+
+@event.listens_for(Session, "before_flush")
+def _acompanhar_remocoes(session, flush_context, instances):
+    for obj in session.deleted:
+        if isinstance(obj, Veiculo):
+            session.info.setdefault(_CHAVE_REMOVIDOS, []).append((obj.id, obj.cliente_id, obj.placa))
+    for obj in session.dirty:
+        if not isinstance(obj, Veiculo):
+            continue
+        anterior = inspect(obj).attrs.cliente_id.history.deleted
+        if anterior and anterior[0] is not None and anterior[0] != obj.cliente_id:
+            # Transferido: some do cliente antigo e aparece no novo
+            session.info.setdefault(_CHAVE_REMOVIDOS, []).append((obj.id, anterior[0], obj.placa))
+            session.info.setdefault(_CHAVE_TRANSFERIDOS, set()).add(obj.id)
+
+
+@event.listens_for(Session, "before_commit")
+def _gravar_remocoes(session):
+    if any(isinstance(obj, Veiculo) for obj in (*session.deleted, *session.dirty)):
+        session.flush()
+    removidos = session.info.pop(_CHAVE_REMOVIDOS, [])
+    transferidos = session.info.pop(_CHAVE_TRANSFERIDOS, set())
+    if not removidos:
+        return
+
+    agora = datetime.now(br_tz)
+    versao = versao_da_transacao(session)
+    session.add_all([
+        VeiculoRemovido(veiculo_id=veiculo_id, cliente_id=cliente_id, placa=placa, removido_em=agora, versao=versao)
+        for veiculo_id, cliente_id, placa in removidos
+    ])
+    if transferidos:
+        session.execute(
+            update(VeiculoEstado).where(VeiculoEstado.veiculo_id.in_(transferidos)).values(versao=versao)
+        )
+    session.query(VeiculoRemovido).filter(
+        VeiculoRemovido.removido_em < agora - timedelta(days=RETENCAO_REMOVIDOS_DIAS)
+    ).delete(synchronize_session=False)
+    session.flush()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_remocoes(session):
+    session.info.pop(_CHAVE_REMOVIDOS, None)
+    session.info.pop(_CHAVE_TRANSFERIDOS, None)
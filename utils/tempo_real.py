@@ -0,0 +1,228 @@
+import json
+import select
+import threading
+import time
+from collections import deque
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from database import db
+
+# Publicação de mudanças para os streams SSE (posições, notificações).
+#
+# No PostgreSQL as mensagens saem por NOTIFY dentro da própria transação, então
+# só são entregues se o commit acontecer e chegam a todos os processos (web,
+# tracker_server, writer assíncrono). Cada publicação vira um único NOTIFY com o
+# array de mensagens (mais de um só se passar do limite de payload). Cada
+# processo web tem uma thread com LISTEN que repassa ao canal local. Em outros
+# bancos (dev/testes) a entrega é só no processo, no after_commit.
+
+_CHAVE_MENSAGENS = "tempo_real_mensagens"
+# O PostgreSQL recusa payloads de NOTIFY a partir de 8000 bytes
+_LIMITE_PAYLOAD = 7900
+
+
+class Assinatura:
+    """Fila de um stream aberto; o gerador SSE fica bloqueado em `aguardar`."""
+
+    def __init__(self, filtro, maximo=1000):
+        self.filtro = filtro
+        self._fila = deque(maxlen=maximo)
+        self._cond = threading.Condition()
+        self._transbordou = False
+
+    def entregar(self, mensagem):
+        if not self.filtro(mensagem):
+            return
+        with self._cond:
+            if len(self._fila) == self._fila.maxlen:
+                # A mais antiga sai da fila: quem assina precisa recarregar o estado
+                self._transbordou = True
+            self._fila.append(mensagem)
+            self._cond.notify()
+
+    def transbordou(self):
+        """True se alguma mensagem foi descartada desde a última chamada."""
+        with self._cond:
+            transbordou, self._transbordou = self._transbordou, False
+        return transbordou
+
+    def aguardar(self, timeout):
+        """Retorna as mensagens acumuladas ou [] se `timeout` passar sem nenhuma."""
+        with self._cond:
+            if not self._fila:
+                self._cond.wait(timeout)
+            mensagens = list(self._fila)
+            self._fila.clear()
+        return mensagens
+
+
+class _Callback:
+    __slots__ = ("entregar",)
+
+    def __init__(self, funcao):
+        self.entregar = funcao
+
+
+class Canal:
+    def __init__(self, nome):
+        self.nome = nome
+        self._assinaturas = set()
+        self._lock = threading.Lock()
+
+    def ouvir(self, funcao):
+        """Chama `funcao(mensagem)` a cada publicação, na thread que publica (sem fila)."""
+        ouvinte = _Callback(funcao)
+        with self._lock:
+            self._assinaturas.add(ouvinte)
+        return ouvinte
+
+    def assinar(self, filtro, maximo=1000):
+        assinatura = Assinatura(filtro, maximo)
+        with self._lock:
+            self._assinaturas.add(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def publicar(self, mensagem):
+        with self._lock:
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            assinatura.entregar(mensagem)
+
+    def __len__(self):
+        return len(self._assinaturas)
+
+
+posicoes = Canal("findway_posicoes")
+canais = {posicoes.nome: posicoes}
+
+# Chamados a cada (re)conexão do LISTEN: o que foi notificado enquanto a
+# conexão estava caída não chega mais (ex.: caches locais se esvaziam aqui)
+_ao_conectar = []
+
+
+def ao_conectar(funcao):
+    _ao_conectar.append(funcao)
+    return funcao
+
+
+def _lotes(mensagens):
+    """Arrays JSON com as mensagens, cada um dentro do limite de payload do NOTIFY."""
+    lote, tamanho = [], 2
+    for mensagem in mensagens:
+        item = json.dumps(mensagem, separators=(",", ":"))
+        if lote and tamanho + len(item.encode()) + 1 > _LIMITE_PAYLOAD:
+            yield "[" + ",".join(lote) + "]"
+            lote, tamanho = [], 2
+        lote.append(item)
+        tamanho += len(item.encode()) + 1
+    if lote:
+        yield "[" + ",".join(lote) + "]"
+
+
+def publicar_no_commit(canal, mensagens, session=None):
+    """Agenda `mensagens` (dicts JSON) para serem publicadas quando a transação confirmar."""
+    if not mensagens:
+        return
+    session = session or db.session
+    if session.get_bind().dialect.name == "postgresql":
+        # Um NOTIFY com o lote inteiro (não um por mensagem); só quebra se passar do limite
+        session.execute(
+            text("SELECT pg_notify(:canal, :payload)"),
+            [{"canal": canal.nome, "payload": payload} for payload in _lotes(mensagens)]
+        )
+    else:
+        session.info.setdefault(_CHAVE_MENSAGENS, []).extend((canal, m) for m in mensagens)
+
+
+@event.listens_for(Session, "after_commit")
+def _publicar_locais(session):
+    for canal, mensagem in session.info.pop(_CHAVE_MENSAGENS, []):
+        canal.publicar(mensagem)
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_locais(session):
+    session.info.pop(_CHAVE_MENSAGENS, None)
+
+
+class OuvinteNotificacoes(threading.Thread):
+    """LISTEN nos canais do PostgreSQL e repasse para as assinaturas deste processo."""
+
+    def __init__(self, app):
+        super().__init__(name="listen-tempo-real", daemon=True)
+        self.app = app
+        self.conectado = False
+
+    def _conectar(self):
+        with self.app.app_context():
+            conn = db.engine.raw_connection()
+        # Conexão dedicada: sai do pool e fica em autocommit só para o LISTEN
+        conn.detach()
+        pg = conn.dbapi_connection
+        pg.autocommit = True
+        with pg.cursor() as cur:
+            for nome in canais:
+                cur.execute(f"LISTEN {nome}")
+        return pg
+
+    def run(self):
+        while True:
+            pg = None
+            try:
+                pg = self._conectar()
+                for funcao in _ao_conectar:
+                    funcao()
+                self.conectado = True
+                while True:
+                    if select.select([pg], [], [], 60) == ([], [], []):
+                        continue
+                    pg.poll()
+                    while pg.notifies:
+                        notificacao = pg.notifies.pop(0)
+                        canal = canais.get(notificacao.channel)
+                        if canal is not None:
+                            for mensagem in json.loads(notificacao.payload):
+                                canal.publicar(mensagem)
+            except Exception as e:
+                self.conectado = False
+                print(f"[TEMPO_REAL] LISTEN interrompido: {e}")
+                if pg is not None:
+                    try:
+                        pg.close()
+                    except Exception:
+                        pass
+                time.sleep(5)
+
+
+ouvinte = None
+
+
+def iniciar_tempo_real(app):
+    """Inicia o LISTEN do PostgreSQL (uma vez por processo; sem efeito em outros bancos)."""
+    global ouvinte
+    if ouvinte is not None:
+        return
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            return
+    ouvinte = OuvinteNotificacoes(app)
+    ouvinte.start()
+
+
+def listen_ativo():
+    """True se este processo está recebendo as notificações dos outros processos."""
+    return ouvinte is not None and ouvinte.conectado
+
+
+def formatar_sse(dados, evento=None, id_=None):
+    linhas = []
+    if id_ is not None:
+        linhas.append(f"id: {id_}")
+    if evento:
+        linhas.append(f"event: {evento}")
+    linhas.append("data: " + json.dumps(dados, separators=(",", ":"), default=str))
+    return "\n".join(linhas) + "\n\n"
@@ -0,0 +1,6 @@
+"""
+Ponto de entrada WSGI de produção (gunicorn wsgi:app): o app com as threads de fundo.
+"""
+from app import app, iniciar_servicos
+
+iniciar_servicos(app)